@@ -1,12 +1,20 @@
 from django.contrib import admin
+from django.db.models import Q
+from .filters import product_search_condition
 from .models import User, CustomerProfile, VendorProfile, UserAddress, ProductCategory, ProductList
+from .pagination import EstimatedCountPaginator
 
-admin.site.register([CustomerProfile, VendorProfile, UserAddress, ProductCategory, ProductList])
+#  Changelists of the large tables. Counts are estimated, and the unfiltered total that
+#  Django counts next to every filtered result is left out. Searches match prefixes without
+#  regard to case, on Postgres an UPPER(column) pattern index serves them, see migration 0011.
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(LargeTableAdmin):
     list_display = ('email', 'username', 'role', 'is_staff', 'is_active')
-    search_fields = ('email', 'username')
+    search_fields = ('email__istartswith', 'username__istartswith')
     list_filter = ('role', 'is_staff', 'is_active')
     ordering = ('email',)
     readonly_fields = ('last_login', 'date_joined', 'email', 'username', 'role', 'password')
@@ -22,3 +30,58 @@ class UserAdmin(admin.ModelAdmin):
             # Make core fields readonly when editing
             return self.readonly_fields + ('email', 'username', 'role')
         return self.readonly_fields
+
+@admin.register(VendorProfile)
+class VendorProfileAdmin(LargeTableAdmin):
+    list_display = ('company_name', 'user', 'is_verified', 'updated_at')
+    list_filter = ('is_verified',)
+    search_fields = ('company_name__istartswith', 'user__email__istartswith')
+    ordering = ('company_name',)
+    autocomplete_fields = ('user',)
+
+    # The user is part of every vendor label, in autocomplete results as well as the changelist
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+@admin.register(CustomerProfile)
+class CustomerProfileAdmin(LargeTableAdmin):
+    list_display = ('user', 'phone_number', 'gender', 'date_of_birth')
+    list_select_related = ('user',)
+    list_filter = ('gender',)
+    search_fields = ('user__email__istartswith', 'user__username__istartswith')
+    ordering = ('-user_id',)
+    autocomplete_fields = ('user',)
+
+@admin.register(UserAddress)
+class UserAddressAdmin(LargeTableAdmin):
+    list_display = ('user', 'country', 'state', 'city', 'pincode')
+    list_select_related = ('user',)
+    search_fields = ('user__email__istartswith', 'user__username__istartswith')
+    ordering = ('-user_id',)
+    autocomplete_fields = ('user',)
+
+@admin.register(ProductCategory)
+class ProductCategoryAdmin(admin.ModelAdmin):
+    list_display = ('category_name', 'slug')
+    # Slugs are lowercase, the unique index serves their prefix match
+    search_fields = ('category_name__istartswith', 'slug__startswith')
+    ordering = ('category_name',)
+
+@admin.register(ProductList)
+class ProductListAdmin(LargeTableAdmin):
+    list_display = ('product_name', 'slug', 'product_vendor', 'product_category', 'product_price', 'product_stock', 'product_availability', 'product_created_at')
+    list_select_related = ('product_vendor__user', 'product_category')
+    list_filter = ('product_availability', 'product_category')
+    # Newest first, the order of product_created_idx
+    ordering = ('-product_created_at', '-id')
+    autocomplete_fields = ('product_vendor', 'product_category')
+    # Enables the search box, get_search_results does the matching
+    search_fields = ('slug',)
+    search_help_text = 'Searches product names, descriptions and specifications, or a slug prefix.'
+
+    #  Full-text search over the search_vector index on Postgres, the same as the product listing
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(Q(slug__startswith=search_term) | product_search_condition(queryset, search_term)), False
@@ -0,0 +1,172 @@
+import hashlib
+import logging
+import os
+import sys
+import threading
+from pathlib import Path
+from types import ModuleType
+import drf_yasg
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import URLResolver, get_resolver
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+from drf_yasg.generators import OpenAPISchemaGenerator
+from drf_yasg.renderers import _SpecRenderer
+from drf_yasg.views import get_schema_view
+from rest_framework import permissions, serializers
+from .mixins import conditional_response
+
+logger = logging.getLogger(__name__)
+
+API_SCHEMA_VERSION = 'v1'
+API_SCHEMA_INFO = openapi.Info(
+    title="Project API",
+    default_version=API_SCHEMA_VERSION,
+    description="First version of API for this project",
+)
+API_SCHEMA_URL = "https://8000-firebase-zippycart-1769518988054.cluster-sumfw3zmzzhzkx4mpvz3ogth4y.cloudworkstations.dev/"
+# Artifact extension by codec, both are written and served from memory
+API_SCHEMA_CODECS = {'json': OpenAPICodecJson, 'yaml': OpenAPICodecYaml}
+
+
+#  The schema document is built once, by `manage.py build_api_schema` or by the first request
+#  that finds no artifact for the current code, and served from memory with an ETag after that.
+#  Artifacts are named after a fingerprint of the files the schema is built from, so only a
+#  change to those files makes a new one.
+class ApiSchema:
+    def __init__(self, fingerprint, documents):
+        self.fingerprint = fingerprint
+        self.documents = documents
+
+_schema = None
+_schema_lock = threading.Lock()
+
+# Forked workers keep the parent's schema, it is read only
+def _reset_after_fork():
+    global _schema_lock
+    _schema_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def api_schema():
+    global _schema
+    if _schema is None:
+        with _schema_lock:
+            if _schema is None:
+                fingerprint = schema_fingerprint()
+                documents = read_artifacts(fingerprint)
+                if documents is None:
+                    logger.warning("No API schema artifact for %s, building it. Run manage.py build_api_schema when deploying.", fingerprint)
+                    documents = write_artifacts(fingerprint, build_documents())
+                _schema = ApiSchema(fingerprint, documents)
+    return _schema
+
+def build_documents():
+    generator = OpenAPISchemaGenerator(API_SCHEMA_INFO, url=API_SCHEMA_URL)
+    # Public schema, every endpoint is listed whoever asks
+    swagger = generator.get_schema(request=None, public=True)
+    return {extension: codec([]).encode(swagger) for extension, codec in API_SCHEMA_CODECS.items()}
+
+def artifact_path(fingerprint, extension):
+    return os.path.join(settings.API_SCHEMA_ROOT, f'openapi-{API_SCHEMA_VERSION}-{fingerprint}.{extension}')
+
+def read_artifacts(fingerprint):
+    documents = {}
+    for extension in API_SCHEMA_CODECS:
+        try:
+            with open(artifact_path(fingerprint, extension), 'rb') as artifact:
+                documents[extension] = artifact.read()
+        except FileNotFoundError:
+            return None
+    return documents
+
+#  Writes the documents of this fingerprint and removes the artifacts of older ones
+def write_artifacts(fingerprint, documents):
+    os.makedirs(settings.API_SCHEMA_ROOT, exist_ok=True)
+    current = set()
+    for extension, document in documents.items():
+        path = artifact_path(fingerprint, extension)
+        partial = f'{path}.partial'
+        with open(partial, 'wb') as artifact:
+            artifact.write(document)
+        os.replace(partial, path)
+        current.add(os.path.basename(path))
+    prefix = f'openapi-{API_SCHEMA_VERSION}-'
+    for name in os.listdir(settings.API_SCHEMA_ROOT):
+        if name.startswith(prefix) and name not in current:
+            os.remove(os.path.join(settings.API_SCHEMA_ROOT, name))
+    return documents
+
+#  Digest of the files the schema is built from and the generator version
+def schema_fingerprint():
+    digest = hashlib.sha256(f'{drf_yasg.__version__}|{API_SCHEMA_VERSION}|{API_SCHEMA_URL}'.encode())
+    for path in sorted(schema_source_files()):
+        digest.update(str(path.relative_to(settings.BASE_DIR)).encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+#  Project files defining the URL confs, the views they route to with their filters and
+#  pagination, and every serializer with its model
+def schema_source_files():
+    sources = []
+    def walk(resolver):
+        sources.append(resolver.urlconf_module)
+        for pattern in resolver.url_patterns:
+            if isinstance(pattern, URLResolver):
+                walk(pattern)
+                continue
+            view = getattr(pattern.callback, 'cls', None) or getattr(pattern.callback, 'view_class', None)
+            if view is None:
+                sources.append(pattern.callback)
+                continue
+            sources.extend(view.__mro__)
+            sources.extend(getattr(view, 'filter_backends', None) or ())
+            sources.extend(filter(None, [getattr(view, 'pagination_class', None), getattr(view, 'filterset_class', None)]))
+    walk(get_resolver())
+    def subclasses(cls):
+        for subclass in cls.__subclasses__():
+            yield subclass
+            yield from subclasses(subclass)
+    for serializer in subclasses(serializers.BaseSerializer):
+        sources.append(serializer)
+        model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+        if model is not None:
+            sources.append(model)
+
+    base_dir = Path(settings.BASE_DIR).resolve()
+    files = set()
+    for source in sources:
+        module = source if isinstance(source, ModuleType) else sys.modules.get(getattr(source, '__module__', None))
+        path = getattr(module, '__file__', None)
+        if path is None:
+            continue
+        path = Path(path).resolve()
+        if path.is_relative_to(base_dir) and 'site-packages' not in path.parts:
+            files.add(path)
+    return files
+
+_SchemaView = get_schema_view(
+    API_SCHEMA_INFO,
+    public=True,
+    permission_classes=(permissions.AllowAny,),
+    url=API_SCHEMA_URL,
+)
+
+#  drf_yasg's schema view with the document served from api_schema(). The Swagger and ReDoc
+#  pages only link to the document, drf_yasg renders them without building a schema.
+class SchemaView(_SchemaView):
+    def get(self, request, version='', format=None):
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, _SpecRenderer):
+            return super().get(request, version, format)
+        schema = api_schema()
+        extension = 'yaml' if renderer.codec_class is OpenAPICodecYaml else 'json'
+        return conditional_response(
+            request, (schema.fingerprint, extension), None,
+            lambda: HttpResponse(schema.documents[extension], content_type=f'{renderer.media_type}; charset=utf-8'),
+        )
+
+# Routed through lazy_view, drf_yasg is only imported once someone opens the docs
+swagger_view = SchemaView.with_ui('swagger')
+redoc_view = SchemaView.with_ui('redoc')
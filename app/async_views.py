@@ -0,0 +1,128 @@
+import json
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.contrib.auth import aauthenticate
+from django.contrib.auth.models import update_last_login
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, ParseError, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from .authentication import DatabaseUserAuthentication, TokenUserAuthentication, password_pool_was_busy
+from .passwords import PasswordPoolBusy, ahash_password, apassword_errors, averify_password
+from .serializers import ChangeUserPasswordSerializer, CreateUserSerializer, UserTokenObtainPairSerializer
+from .views import ProductCategoryView, ProductListView
+
+
+#  Async endpoints for ASGI servers, next to the sync DRF views. Database work goes through
+#  the async ORM and password work through the password pool, so slow clients and login
+#  surges wait on the event loop instead of holding request threads.
+
+#  JSON POST endpoint, API errors are rendered the way DRF renders them
+def async_api_view(view):
+    @csrf_exempt
+    @require_POST
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await view(request, *args, **kwargs)
+        except APIException as exc:
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            response = JsonResponse(data, status=exc.status_code, safe=False)
+            if getattr(exc, 'auth_header', None):
+                response['WWW-Authenticate'] = exc.auth_header
+            if getattr(exc, 'wait', None):
+                response['Retry-After'] = '%d' % exc.wait
+            return response
+    return wrapper
+
+def request_data(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError as e:
+        raise ParseError(f'JSON parse error - {e}')
+    if not isinstance(data, dict):
+        raise ParseError('Expected a JSON object.')
+    return data
+
+async def authenticate_request(request):
+    authenticator = DatabaseUserAuthentication()
+    result = await sync_to_async(authenticator.authenticate)(request)
+    if result is None:
+        exc = NotAuthenticated()
+        exc.auth_header = authenticator.authenticate_header(request)
+        raise exc
+    return result[0]
+
+@async_api_view
+async def signup(request):
+    serializer = CreateUserSerializer(data=request_data(request), context={'request': request, 'defer_password_checks': True})
+    # The email uniqueness check queries the database
+    await sync_to_async(serializer.is_valid)(raise_exception=True)
+    password = serializer.validated_data['password']
+    errors = await apassword_errors(password)
+    if errors:
+        raise ValidationError({'password': errors})
+    await sync_to_async(serializer.save)(password_hash=await ahash_password(password))
+    return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+
+@async_api_view
+async def login(request):
+    serializer = UserTokenObtainPairSerializer(data=request_data(request), context={'request': request})
+    credentials = serializer.to_internal_value(serializer.initial_data)
+    user = await aauthenticate(request, **credentials)
+    if not api_settings.USER_AUTHENTICATION_RULE(user):
+        if password_pool_was_busy(request):
+            raise PasswordPoolBusy()
+        raise AuthenticationFailed(serializer.error_messages['no_active_account'], 'no_active_account')
+    refresh = serializer.get_token(user)
+    if api_settings.UPDATE_LAST_LOGIN:
+        await sync_to_async(update_last_login)(None, user)
+    return JsonResponse({'refresh': str(refresh), 'access': str(refresh.access_token)})
+
+@async_api_view
+async def change_password(request):
+    user = await authenticate_request(request)
+    serializer = ChangeUserPasswordSerializer(user, data=request_data(request), context={'request': request, 'defer_password_checks': True})
+    serializer.is_valid(raise_exception=True)
+    data = serializer.validated_data
+    correct, _ = await averify_password(data['old_password'], user.password)
+    if not correct:
+        raise ValidationError({'old_password': [serializer.OLD_PASSWORD_INCORRECT]})
+    errors = await apassword_errors(data['new_password'], user)
+    if errors:
+        raise ValidationError({'new_password': errors})
+    await sync_to_async(serializer.save)(password_hash=await ahash_password(data['new_password']))
+    return JsonResponse({'message': 'Password changed successfully.'})
+
+#  Async GET endpoint for a viewset action, served by the viewset's `a<action>` method with the
+#  viewset's queryset, filters, pagination, permissions and serializer. Only the stateless JWT
+#  authentication is accepted, the session and basic ones would query the database.
+def async_read_view(viewset_class, action):
+    @require_GET
+    async def view(request, *args, **kwargs):
+        viewset = viewset_class(
+            action_map={'get': action}, args=args, kwargs=kwargs, format_kwarg=None,
+            authentication_classes=[TokenUserAuthentication], renderer_classes=[JSONRenderer],
+        )
+        drf_request = viewset.initialize_request(request, *args, **kwargs)
+        viewset.request = drf_request
+        viewset.headers = viewset.default_response_headers
+        try:
+            # Authentication, throttling, permissions and the replica pick read the cache and
+            # may query the database, so they run on a worker thread like the ORM calls
+            await sync_to_async(viewset.initial)(drf_request, *args, **kwargs)
+            response = await getattr(viewset, f'a{action}')(drf_request, *args, **kwargs)
+        except Exception as exc:
+            response = viewset.handle_exception(exc)
+        response = viewset.finalize_response(drf_request, response, *args, **kwargs)
+        # Rendered here, Django would otherwise render it on a worker thread
+        return response.render() if hasattr(response, 'render') else response
+    return view
+
+product_list = async_read_view(ProductListView, 'list')
+product_detail = async_read_view(ProductListView, 'retrieve')
+category_list = async_read_view(ProductCategoryView, 'list')
@@ -0,0 +1,136 @@
+import sys
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db.models import F
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from .cache import cache_is_shared
+from .passwords import PasswordPoolBusy, ahash_password, averify_password, hash_password, verify_password
+
+TOKEN_VERSION_CLAIM = 'token_version'
+# Minimum accepted token version for deleted and deactivated users
+REVOKED_ALL = sys.maxsize
+
+
+def revoked_key(user_id):
+    return f'auth:revoked:{user_id}'
+
+#  Reject the user's access tokens older than `min_version`. The entry only has to outlive the
+#  access tokens it revokes, refresh tokens are checked against the database instead.
+def revoke_access_tokens(user_id, min_version=REVOKED_ALL):
+    cache.set(revoked_key(user_id), min_version, api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+
+#  Invalidate every token issued so far, used when the password changes
+def bump_token_version(user):
+    type(user).objects.filter(pk=user.pk).update(token_version=F('token_version') + 1)
+    user.refresh_from_db(fields=['token_version'])
+    revoke_access_tokens(user.pk, user.token_version)
+
+#  Revocations reach every worker through a shared cache. A process-local cache only holds the
+#  ones made in this process, so the user row is checked instead, which makes it a query.
+def check_token_version(user_id, token_version):
+    if not cache_is_shared():
+        stored = get_user_model().objects.filter(pk=user_id).values_list('is_active', 'token_version').first()
+        if stored is None or not stored[0] or (token_version or 0) != stored[1]:
+            raise AuthenticationFailed(_("Token has been revoked."), code='token_revoked')
+        return
+    min_version = cache.get(revoked_key(user_id))
+    if min_version is not None and (token_version or 0) < min_version:
+        raise AuthenticationFailed(_("Token has been revoked."), code='token_revoked')
+
+#  User built from the access token claims, ids are numeric like the User model's
+class ClaimsUser(TokenUser):
+    @cached_property
+    def id(self):
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def is_active(self):
+        return self.token.get('is_active', True)
+
+#  Default authentication, builds the user from the role, staff and version claims without a
+#  database lookup when the cache is shared, see check_token_version
+class TokenUserAuthentication(JWTStatelessUserAuthentication):
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code='user_inactive')
+        check_token_version(user.pk, validated_token.get(TOKEN_VERSION_CLAIM))
+        return user
+
+#  For endpoints that work on the User row itself, such as profile and password changes
+class DatabaseUserAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        if validated_token.get(TOKEN_VERSION_CLAIM, 0) != user.token_version:
+            raise AuthenticationFailed(_("Token has been revoked."), code='token_revoked')
+        return user
+
+#  Requests whose login found the password pool full, the API answers them with a 503
+def mark_password_pool_busy(request):
+    if request is not None:
+        request.password_pool_busy = True
+
+def password_pool_was_busy(request):
+    return getattr(request, 'password_pool_busy', False)
+
+#  Login backend that checks passwords on the password pool. A full pool fails the login instead
+#  of raising, Django's own login views such as the admin's would turn PasswordPoolBusy into a 500.
+class PasswordPoolBackend(ModelBackend):
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        try:
+            return self.check_password_login(username, password, **kwargs)
+        except PasswordPoolBusy:
+            mark_password_pool_busy(request)
+            return None
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        try:
+            return await self.acheck_password_login(username, password, **kwargs)
+        except PasswordPoolBusy:
+            mark_password_pool_busy(request)
+            return None
+
+    def check_password_login(self, username, password, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # Hash once anyway so unknown emails take as long as wrong passwords
+            hash_password(password)
+            return None
+        correct, must_update = verify_password(password, user.password)
+        if correct and must_update:
+            user.password = hash_password(password)
+            user.save(update_fields=['password'])
+        if correct and self.user_can_authenticate(user):
+            return user
+        return None
+
+    async def acheck_password_login(self, username, password, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = await UserModel._default_manager.aget_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            await ahash_password(password)
+            return None
+        correct, must_update = await averify_password(password, user.password)
+        if correct and must_update:
+            user.password = await ahash_password(password)
+            await user.asave(update_fields=['password'])
+        if correct and self.user_can_authenticate(user):
+            return user
+        return None
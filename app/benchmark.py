@@ -0,0 +1,51 @@
+import statistics
+import threading
+import time
+from collections import Counter
+import requests
+
+
+#  Closed-loop HTTP load for the benchmark commands. `clients` maps a label to the number of
+#  concurrent clients and a function sending one request with a requests session, each
+#  client sends its next request as soon as the previous one returns.
+def run_load(clients, duration):
+    results = {label: [] for label in clients}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(label, send):
+        session = requests.Session()
+        samples = []
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                status_code = send(session).status_code
+            except requests.RequestException:
+                status_code = 'error'
+            samples.append((status_code, time.monotonic() - started))
+        with lock:
+            results[label].extend(samples)
+
+    threads = [
+        threading.Thread(target=client, args=(label, send))
+        for label, (count, send) in clients.items()
+        for _ in range(count)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.monotonic() - started
+
+#  Throughput of successful requests, their latency percentiles and every status seen
+def format_result(label, samples, elapsed, width=6):
+    if not samples:
+        return f"{label:>{width}}: no requests completed"
+    statuses = Counter(status_code for status_code, _ in samples)
+    ok = [duration for status_code, duration in samples if status_code in (200, 304)]
+    line = f"{label:>{width}}: {len(ok) / elapsed:8.1f} ok/s"
+    if ok:
+        quantiles = statistics.quantiles(ok, n=100) if len(ok) > 1 else [ok[0]] * 99
+        line += f"  p50 {quantiles[49] * 1000:7.1f}ms  p95 {quantiles[94] * 1000:7.1f}ms  p99 {quantiles[98] * 1000:7.1f}ms"
+    return line + "  statuses " + ", ".join(f"{code}: {count}" for code, count in sorted(statuses.items(), key=str))
@@ -0,0 +1,98 @@
+import asyncio
+import time
+from hashlib import sha256
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+CATEGORY_VERSION_KEY = 'category:version'
+# How long a worker may hold the recompute lock, and how long others wait for its result
+RECOMPUTE_LOCK_TIMEOUT = 10
+RECOMPUTE_POLL_INTERVAL = 0.05
+
+
+#  Whether every worker process sees the same cache, local memory is private to each process
+def cache_is_shared(alias='default'):
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
+
+#  Read-through cache with stampede protection, only the worker that takes the lock
+#  recomputes a cold key while the others wait for its result
+def get_or_compute(key, compute, timeout):
+    value = cache.get(key)
+    if value is not None:
+        return value
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, RECOMPUTE_LOCK_TIMEOUT):
+        try:
+            value = compute()
+            cache.set(key, value, timeout)
+            return value
+        finally:
+            cache.delete(lock_key)
+    deadline = time.monotonic() + RECOMPUTE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(RECOMPUTE_POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        if cache.get(lock_key) is None:
+            # The lock holder failed, for example with a 404, so compute it here
+            break
+    return compute()
+
+#  get_or_compute for async views, `compute` is a coroutine function
+async def aget_or_compute(key, compute, timeout):
+    value = await cache.aget(key)
+    if value is not None:
+        return value
+    lock_key = f'{key}:lock'
+    if await cache.aadd(lock_key, 1, RECOMPUTE_LOCK_TIMEOUT):
+        try:
+            value = await compute()
+            await cache.aset(key, value, timeout)
+            return value
+        finally:
+            await cache.adelete(lock_key)
+    deadline = time.monotonic() + RECOMPUTE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(RECOMPUTE_POLL_INTERVAL)
+        value = await cache.aget(key)
+        if value is not None:
+            return value
+        if await cache.aget(lock_key) is None:
+            break
+    return await compute()
+
+#  Category keys carry a version that every category write bumps, so a response computed
+#  before a write can never be served after it. A fresh version starts from the clock so an
+#  evicted version key cannot bring back old entries. The version lives in the cache, so a
+#  write only reaches the workers that share it, with local memory only its own process.
+def category_cache_version():
+    return cache.get_or_set(CATEGORY_VERSION_KEY, time.time_ns, None)
+
+def category_cache_key(kind, identifier, version=None):
+    digest = sha256(identifier.encode()).hexdigest()
+    if version is None:
+        version = category_cache_version()
+    return f'category:v{version}:{kind}:{digest}'
+
+def get_or_compute_category(kind, identifier, compute):
+    return get_or_compute(category_cache_key(kind, identifier), compute, settings.CATEGORY_CACHE_TIMEOUT)
+
+async def acategory_cache_version():
+    return await cache.aget_or_set(CATEGORY_VERSION_KEY, time.time_ns, None)
+
+async def aget_or_compute_category(kind, identifier, compute):
+    key = category_cache_key(kind, identifier, await acategory_cache_version())
+    return await aget_or_compute(key, compute, settings.CATEGORY_CACHE_TIMEOUT)
+
+def invalidate_categories():
+    # Bumped after commit so readers cannot cache uncommitted rows under the new version
+    def bump():
+        try:
+            cache.incr(CATEGORY_VERSION_KEY)
+        except ValueError:
+            cache.set(CATEGORY_VERSION_KEY, time.time_ns(), None)
+    transaction.on_commit(bump)
@@ -0,0 +1,249 @@
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+from itertools import islice
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import BigIntegerField, Case, F, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .cache import cache_is_shared
+from .models import User, ProductList, Cart, CartItem
+
+logger = logging.getLogger(__name__)
+
+# How long a change may hold a cart, and how long another change waits for it
+CART_LOCK_TIMEOUT = 5
+CART_LOCK_POLL_INTERVAL = 0.01
+
+#  A cart lives in the cache as {'version': n, 'items': {product_id: {'slug': slug, 'quantity': q}}}.
+#  Every change gets a new version and queues the cart for the write-behind flush, the database
+#  copy is only read when the cache has lost the cart. Carts are only kept in a cache every
+#  worker shares, with a per process cache each change is made in the database instead.
+
+
+class CartError(Exception):
+    pass
+
+#  Another change held the cart for longer than CART_LOCK_TIMEOUT
+class CartBusy(Exception):
+    pass
+
+def cart_key(user_id):
+    return f'cart:{user_id}'
+
+def get_cart(user_id):
+    if not cache_is_shared():
+        return load_cart(user_id)
+    state = cache.get(cart_key(user_id))
+    if state is None:
+        # A change this process has not flushed yet is newer than the database copy
+        with _pending_lock:
+            state = _pending.get(user_id)
+        if state is None:
+            state = load_cart(user_id)
+        cache.set(cart_key(user_id), state, settings.CART_CACHE_TIMEOUT)
+    return state
+
+def load_cart(user_id):
+    version = Cart.objects.filter(pk=user_id).values_list('version', flat=True).first()
+    if version is None:
+        return {'version': 0, 'items': {}}
+    items = CartItem.objects.filter(cart_id=user_id).order_by('pk').values_list('product_id', 'product__slug', 'quantity')
+    return {'version': version, 'items': {product_id: {'slug': slug, 'quantity': quantity} for product_id, slug, quantity in items}}
+
+#  Versions come from the clock in microseconds with the process id as tiebreaker, so a worker
+#  that rebuilt an evicted cart from an older database copy cannot reuse the version of a change
+#  another worker has not flushed yet
+def next_version(version):
+    return max(version + 1, time.time_ns() // 1000 * 1000 + os.getpid() % 1000)
+
+#  Changes to one cart run one at a time, under a cache lock every worker sees or, without a
+#  shared cache, under the lock of the cart row
+def change_cart(user_id, change):
+    if not cache_is_shared():
+        return change_stored_cart(user_id, change)
+    lock_key = f'{cart_key(user_id)}:lock'
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + CART_LOCK_TIMEOUT
+    # The lock expires on its own, a holder that died only delays the next change
+    while not cache.add(lock_key, token, CART_LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            raise CartBusy("The cart is being changed by another request, try again.")
+        time.sleep(CART_LOCK_POLL_INTERVAL)
+    try:
+        state = get_cart(user_id)
+        items = {product_id: dict(item) for product_id, item in state['items'].items()}
+        change(items)
+        state = {'version': next_version(state['version']), 'items': items}
+        cache.set(cart_key(user_id), state, settings.CART_CACHE_TIMEOUT)
+    finally:
+        # Only our own lock, after an expiry it may belong to the next change
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+    schedule_flush(user_id, state)
+    return state
+
+def change_stored_cart(user_id, change):
+    with transaction.atomic():
+        Cart.objects.bulk_create([Cart(user_id=user_id)], ignore_conflicts=True)
+        Cart.objects.select_for_update().get(pk=user_id)
+        state = load_cart(user_id)
+        change(state['items'])
+        state['version'] = next_version(state['version'])
+        persist_carts({user_id: state})
+    return state
+
+def add_item(user_id, product_id, slug, quantity):
+    def add(items):
+        if product_id not in items and len(items) >= settings.CART_MAX_ITEMS:
+            raise CartError(f"A cart holds at most {settings.CART_MAX_ITEMS} products.")
+        current = items.get(product_id, {}).get('quantity', 0)
+        items[product_id] = {'slug': slug, 'quantity': min(current + quantity, settings.CART_MAX_QUANTITY)}
+    return change_cart(user_id, add)
+
+#  Quantity 0 removes the product
+def set_item_quantity(user_id, slug, quantity):
+    def update(items):
+        product_id = item_product_id(items, slug)
+        if quantity:
+            items[product_id]['quantity'] = quantity
+        else:
+            del items[product_id]
+    return change_cart(user_id, update)
+
+def remove_item(user_id, slug):
+    return set_item_quantity(user_id, slug, 0)
+
+def clear_cart(user_id):
+    return change_cart(user_id, lambda items: items.clear())
+
+def item_product_id(items, slug):
+    for product_id, item in items.items():
+        if item['slug'] == slug:
+            return product_id
+    raise CartError(f"{slug} is not in the cart.")
+
+#  Cart lines and total with the current prices, read for the whole cart in one query.
+#  Products deleted since they were added are left out.
+def cart_contents(state):
+    rows = {
+        row['pk']: row
+        for row in ProductList.objects.filter(pk__in=state['items'])
+        .annotate(unit_price=Coalesce('product_price_after_discount', 'product_price'))
+        .values('pk', 'product_name', 'unit_price', 'product_stock', 'product_availability')
+    }
+    lines = []
+    for product_id, item in state['items'].items():
+        row = rows.get(product_id)
+        if row is None:
+            continue
+        lines.append({
+            'product': item['slug'],
+            'product_name': row['product_name'],
+            'unit_price': row['unit_price'],
+            'quantity': item['quantity'],
+            'line_total': row['unit_price'] * item['quantity'],
+            'available': row['product_availability'] and row['product_stock'] >= item['quantity'],
+        })
+    return {
+        'items': lines,
+        'item_count': sum(line['quantity'] for line in lines),
+        'total': sum((line['line_total'] for line in lines), 0),
+    }
+
+#  Write-behind buffer of this process, the latest state of every cart changed since the last flush
+_pending = {}
+_pending_lock = threading.Lock()
+_flusher = None
+
+#  A forked worker starts without the parent's buffer, which the parent flushes itself, and
+#  starts its own flusher since threads do not survive a fork
+def _reset_after_fork():
+    global _pending_lock, _flusher
+    _pending.clear()
+    _pending_lock = threading.Lock()
+    _flusher = None
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def schedule_flush(user_id, state):
+    global _flusher
+    with _pending_lock:
+        _pending[user_id] = state
+        if settings.CART_FLUSH_INTERVAL and _flusher is None:
+            _flusher = threading.Thread(target=flush_periodically, name='cart-flush', daemon=True)
+            _flusher.start()
+            atexit.register(flush_carts)
+    if not settings.CART_FLUSH_INTERVAL:
+        transaction.on_commit(flush_carts)
+
+def flush_periodically():
+    while True:
+        time.sleep(settings.CART_FLUSH_INTERVAL)
+        try:
+            flush_carts()
+        except Exception:
+            logger.exception("Flushing carts failed")
+        finally:
+            close_old_connections()
+
+#  Write the buffered carts in batches of CART_FLUSH_BATCH_SIZE, returns how many were written
+def flush_carts(batch_size=None):
+    batch_size = batch_size or settings.CART_FLUSH_BATCH_SIZE
+    flushed = 0
+    while True:
+        with _pending_lock:
+            batch = dict(islice(_pending.items(), batch_size))
+            for user_id in batch:
+                del _pending[user_id]
+        if not batch:
+            return flushed
+        try:
+            persist_carts(batch)
+        except Exception:
+            with _pending_lock:
+                # Changes made while the batch was written are newer, keep those
+                for user_id, state in batch.items():
+                    _pending.setdefault(user_id, state)
+            raise
+        flushed += len(batch)
+
+#  Write {user_id: state} in one transaction and a fixed number of queries. Another process
+#  may flush the same cart, so carts stored with the same or a newer version are skipped.
+def persist_carts(states):
+    with transaction.atomic():
+        user_ids = sorted(User.objects.filter(pk__in=states).values_list('pk', flat=True))
+        Cart.objects.bulk_create([Cart(user_id=user_id) for user_id in user_ids], ignore_conflicts=True)
+        stored = dict(Cart.objects.filter(pk__in=user_ids).order_by('pk').select_for_update().values_list('pk', 'version'))
+        states = {user_id: state for user_id, state in states.items() if user_id in stored and state['version'] > stored[user_id]}
+        if not states:
+            return
+        Cart.objects.filter(pk__in=states).update(
+            version=Case(
+                *[When(pk=user_id, then=Value(state['version'])) for user_id, state in states.items()],
+                default=F('version'), output_field=BigIntegerField(),
+            ),
+            updated_at=timezone.now(),
+        )
+        product_ids = {product_id for state in states.values() for product_id in state['items']}
+        existing = set(ProductList.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+        removed = Q()
+        for user_id, state in states.items():
+            removed |= Q(cart_id=user_id) & ~Q(product_id__in=list(state['items']))
+        CartItem.objects.filter(removed).delete()
+        CartItem.objects.bulk_create(
+            [
+                CartItem(cart_id=user_id, product_id=product_id, quantity=item['quantity'])
+                for user_id, state in sorted(states.items())
+                for product_id, item in sorted(state['items'].items())
+                if product_id in existing
+            ],
+            update_conflicts=True,
+            unique_fields=['cart', 'product'],
+            update_fields=['quantity'],
+        )
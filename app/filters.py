@@ -0,0 +1,117 @@
+from decimal import Decimal
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import Case, Count, F, FloatField, IntegerField, Q, Value, When
+from django.db.models.functions import Cast, Coalesce
+from django_filters import rest_framework as filters
+from rest_framework.filters import BaseFilterBackend, SearchFilter
+from .models import ProductList
+
+SEARCH_CONFIG = 'english'
+
+# Lower bounds of the price facet buckets, the last bucket has no upper bound
+PRICE_FACET_BOUNDARIES = (Decimal('0'), Decimal('500'), Decimal('1000'), Decimal('5000'), Decimal('10000'))
+
+
+#  Product full-text search, ranked by relevance. Postgres matches the stored search_vector
+#  through its GIN index, other databases fall back to icontains with name matches ranked first.
+class ProductSearchFilter(SearchFilter):
+    search_param = 'q'
+    search_description = 'Search product names, descriptions and specifications.'
+
+    def get_search_query(self, request):
+        return request.query_params.get(self.search_param, '').strip()
+
+    def filter_queryset(self, request, queryset, view):
+        query = self.get_search_query(request)
+        if not query:
+            return queryset
+        return search_products(queryset, query)
+
+#  Products matching `query`, annotated with their search_rank
+def search_products(queryset, query):
+    matches = product_search_condition(queryset, query)
+    if connections[queryset.db].vendor == 'postgresql':
+        search_query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+        # ts_rank is a real, widen it so the rank round-trips exactly through pagination cursors
+        search_rank = Cast(SearchRank(F('search_vector'), search_query), FloatField())
+        return queryset.filter(matches).annotate(search_rank=search_rank)
+    return queryset.filter(matches).annotate(
+        search_rank=Case(When(product_name__icontains=query, then=Value(2.0)), default=Value(1.0), output_field=FloatField())
+    )
+
+def product_search_condition(queryset, query):
+    if connections[queryset.db].vendor == 'postgresql':
+        return Q(search_vector=SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG))
+    return Q(product_name__icontains=query) | Q(product_description__icontains=query) | Q(product_specifications__icontains=query)
+
+#  Product sorting for cursor pagination, every ordering ends on id so cursors stay stable.
+#  Search results default to relevance, everything else to the pagination's newest first.
+class ProductOrderingFilter(BaseFilterBackend):
+    ordering_param = 'ordering'
+    orderings = {
+        'price': ('product_price', 'id'),
+        'discount': ('discount_rate', 'id'),
+        'created': ('product_created_at', 'id'),
+    }
+
+    def get_ordering(self, request, queryset, view):
+        term = request.query_params.get(self.ordering_param, '').strip()
+        fields = self.orderings.get(term.lstrip('-'))
+        if fields is not None:
+            return tuple(f'-{field}' for field in fields) if term.startswith('-') else fields
+        if ProductSearchFilter().get_search_query(request):
+            return ('-search_rank', '-product_created_at', '-id')
+        return None
+
+    def filter_queryset(self, request, queryset, view):
+        # Cursor positions cannot be null, so products without a discount sort as a zero discount
+        if request.query_params.get(self.ordering_param, '').strip().lstrip('-') == 'discount':
+            return queryset.annotate(discount_rate=Coalesce('product_discount', Value(Decimal('0'))))
+        return queryset
+
+#  Product filters
+class ProductFilterSet(filters.FilterSet):
+    category = filters.CharFilter(field_name='product_category')
+    vendor = filters.NumberFilter(field_name='product_vendor')
+    min_price = filters.NumberFilter(field_name='product_price', lookup_expr='gte')
+    max_price = filters.NumberFilter(field_name='product_price', lookup_expr='lte')
+    min_discounted_price = filters.NumberFilter(field_name='product_price_after_discount', lookup_expr='gte')
+    max_discounted_price = filters.NumberFilter(field_name='product_price_after_discount', lookup_expr='lte')
+    available = filters.BooleanFilter(field_name='product_availability')
+    in_stock = filters.BooleanFilter(method='filter_in_stock')
+    has_discount = filters.BooleanFilter(field_name='product_discount', lookup_expr='isnull', exclude=True)
+
+    class Meta:
+        model = ProductList
+        fields = []
+
+    def filter_in_stock(self, queryset, name, value):
+        if value:
+            return queryset.filter(product_stock__gt=0)
+        return queryset.filter(product_stock=0)
+
+#  Category and price bucket counts from a single GROUP BY query
+def product_facets(queryset):
+    boundaries = PRICE_FACET_BOUNDARIES
+    price_bucket = Case(
+        *[When(product_price__gte=lower, then=Value(index)) for index, lower in reversed(list(enumerate(boundaries)))],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    rows = (
+        queryset.order_by()
+        .annotate(price_bucket=price_bucket)
+        .values('product_category', 'price_bucket')
+        .annotate(count=Count('id'))
+    )
+    categories = {}
+    bucket_counts = [0] * len(boundaries)
+    for row in rows:
+        categories[row['product_category']] = categories.get(row['product_category'], 0) + row['count']
+        bucket_counts[row['price_bucket']] += row['count']
+    price_buckets = [
+        {'min': lower, 'max': boundaries[index + 1] if index + 1 < len(boundaries) else None, 'count': bucket_counts[index]}
+        for index, lower in enumerate(boundaries)
+    ]
+    return {'categories': categories, 'price_buckets': price_buckets}
@@ -0,0 +1,177 @@
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+import django
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Formats accepted from uploads, the processed image keeps its format and variants are WebP
+IMAGE_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+
+class ImageProcessingError(Exception):
+    pass
+
+#  Uploads wait here until a worker has processed them. Staged names are
+#  <app_label>.<model>/<pk>/<field>/<random>.<ext>, so a sweep can rebuild any lost job.
+def staging_storage():
+    return FileSystemStorage(location=settings.IMAGE_STAGING_ROOT)
+
+def variants_field_name(field):
+    return f'{field}_variants'
+
+#  Stage uploaded images of a saved instance and queue them once the transaction commits.
+#  The image field keeps its current value until the worker replaces it.
+def stage_images(instance, uploads):
+    for field, upload in uploads.items():
+        extension = os.path.splitext(upload.name)[1].lower()
+        name = f'{instance._meta.label_lower}/{instance.pk}/{field}/{uuid.uuid4().hex}{extension}'
+        staged_name = staging_storage().save(name, upload)
+        transaction.on_commit(lambda staged_name=staged_name: enqueue_image(staged_name))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# A forked worker starts its own processes, the parent's pool cannot be used from a child
+def _reset_after_fork():
+    global _executor, _executor_lock
+    _executor, _executor_lock = None, threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def image_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # Spawned workers set Django up themselves instead of inheriting the server's threads
+                _executor = ProcessPoolExecutor(
+                    max_workers=settings.IMAGE_PROCESSING_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=django.setup,
+                )
+    return _executor
+
+#  With IMAGE_PROCESSING_WORKERS = 0 images are processed in the request, after the commit
+def enqueue_image(staged_name):
+    if not settings.IMAGE_PROCESSING_WORKERS:
+        return process_staged_image(staged_name)
+    def log_failure(future):
+        if future.exception() is not None:
+            # The staged file stays behind for the process_images sweep
+            logger.error("Processing %s failed", staged_name, exc_info=future.exception())
+    image_executor().submit(process_staged_image, staged_name).add_done_callback(log_failure)
+
+#  Open an image after checking it is complete, in an accepted format and not too large, the
+#  same checks for uploads in the request as for staged files in the worker
+def open_image(data):
+    with warnings.catch_warnings():
+        # Oversized images are rejected rather than decoded
+        warnings.simplefilter('error', Image.DecompressionBombWarning)
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.verify()
+            image = Image.open(io.BytesIO(data))
+            if image.format not in IMAGE_FORMATS:
+                raise ImageProcessingError(f"Unsupported image format {image.format}.")
+            if image.width * image.height > settings.IMAGE_MAX_PIXELS:
+                raise ImageProcessingError("Image is too large.")
+        except (UnidentifiedImageError, OSError, SyntaxError, Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+            raise ImageProcessingError(f"Invalid image: {e}")
+    return image
+
+#  Validate the image, strip its metadata and build the variants
+def render_image(data):
+    image = open_image(data)
+    image_format = image.format
+    try:
+        image = ImageOps.exif_transpose(image)
+    except (OSError, SyntaxError) as e:
+        raise ImageProcessingError(f"Invalid image: {e}")
+
+    mode = 'RGBA' if image.mode in ('RGBA', 'LA', 'P') and image_format != 'JPEG' else 'RGB'
+    # A copy of the pixels only, which leaves EXIF, ICC and any other metadata behind
+    image = image.convert(mode)
+    image = Image.frombytes(mode, image.size, image.tobytes())
+
+    def encode(img, fmt):
+        buffer = io.BytesIO()
+        if fmt == 'WEBP':
+            img.save(buffer, fmt, quality=settings.IMAGE_WEBP_QUALITY, method=4)
+        elif fmt == 'JPEG':
+            img.save(buffer, fmt, quality=settings.IMAGE_JPEG_QUALITY, optimize=True)
+        else:
+            img.save(buffer, fmt, optimize=True)
+        return buffer.getvalue()
+
+    variants = {}
+    for width in settings.IMAGE_VARIANT_WIDTHS:
+        # Variants are never wider than the original
+        if width < image.width:
+            height = max(1, round(image.height * width / image.width))
+            variants[str(width)] = encode(image.resize((width, height), Image.LANCZOS), 'WEBP')
+    size = settings.IMAGE_THUMBNAIL_SIZE
+    variants['thumbnail'] = encode(ImageOps.fit(image, (size, size), Image.LANCZOS), 'WEBP')
+    return IMAGE_FORMATS[image_format], encode(image, image_format), variants
+
+#  Worker job, pushes the processed image and its variants to media storage and points the
+#  instance at them. Invalid images are dropped and the instance keeps its previous image.
+#  Other failures leave the staged file for the next process_images sweep.
+def process_staged_image(staged_name):
+    label, pk, field, _ = staged_name.split('/')
+    model = apps.get_model(label)
+    staging = staging_storage()
+    instance = model._default_manager.filter(pk=pk).first()
+    if instance is None:
+        staging.delete(staged_name)
+        return None
+    with staging.open(staged_name, 'rb') as staged:
+        data = staged.read()
+    try:
+        extension, image, variants = render_image(data)
+    except ImageProcessingError as e:
+        logger.warning("Dropped %s: %s", staged_name, e)
+        staging.delete(staged_name)
+        return None
+
+    stem = os.path.join(model._meta.get_field(field).upload_to, uuid.uuid4().hex)
+    image_name = default_storage.save(f'{stem}.{extension}', ContentFile(image))
+    variant_names = {
+        key: default_storage.save(f'{stem}_{key}.webp' if key == 'thumbnail' else f'{stem}_{key}w.webp', ContentFile(content))
+        for key, content in variants.items()
+    }
+
+    setattr(instance, field, image_name)
+    setattr(instance, variants_field_name(field), variant_names)
+    # auto_now fields only change when saved, and they feed the conditional GET validators
+    auto_now_fields = [f.name for f in model._meta.concrete_fields if getattr(f, 'auto_now', False)]
+    instance.save(update_fields=[field, variants_field_name(field), *auto_now_fields])
+    staging.delete(staged_name)
+    return image_name
+
+#  Staged images older than `min_age` seconds, which no worker is expected to hold any more
+def stale_staged_images(min_age=0):
+    staging = staging_storage()
+    if not os.path.isdir(staging.location):
+        return []
+    cutoff = timezone.now() - timedelta(seconds=min_age)
+    names = []
+    for root, _, files in os.walk(staging.location):
+        for filename in files:
+            name = os.path.relpath(os.path.join(root, filename), staging.location).replace(os.sep, '/')
+            if name.count('/') == 3 and staging.get_modified_time(name) <= cutoff:
+                names.append(name)
+    return sorted(names)
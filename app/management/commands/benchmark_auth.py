@@ -0,0 +1,40 @@
+from urllib.parse import urljoin
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from app.benchmark import format_result, run_load
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark login throughput against concurrent product reads on a running server. "
+        "Run it once against the sync login/ endpoint under gunicorn and once against async/login/ "
+        "under uvicorn to compare how a login surge affects catalog reads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/api/drf/v1/', help="Base URL of the API.")
+        parser.add_argument('--login-path', default='login/', help="login/ for the sync view, async/login/ for the async one.")
+        parser.add_argument('--read-path', default='products/')
+        parser.add_argument('--email', required=True, help="Account used for the logins.")
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--logins', type=int, default=16, help="Concurrent login clients.")
+        parser.add_argument('--readers', type=int, default=16, help="Concurrent product read clients.")
+        parser.add_argument('--duration', type=float, default=30, help="Seconds to run.")
+
+    def handle(self, *args, **options):
+        login_url = urljoin(options['url'], options['login_path'])
+        read_url = urljoin(options['url'], options['read_path'])
+        credentials = {'email': options['email'], 'password': options['password']}
+        response = requests.post(login_url, json=credentials, timeout=30)
+        if response.status_code != 200:
+            raise CommandError(f"Login failed with {response.status_code}: {response.text[:200]}")
+        read_headers = {'Authorization': f"Bearer {response.json()['access']}"}
+
+        results, elapsed = run_load({
+            'login': (options['logins'], lambda session: session.post(login_url, json=credentials, timeout=30)),
+            'read': (options['readers'], lambda session: session.get(read_url, headers=read_headers, timeout=30)),
+        }, options['duration'])
+
+        self.stdout.write(f"{login_url} with {options['logins']} clients, {read_url} with {options['readers']} clients, {elapsed:.1f}s")
+        for label, samples in results.items():
+            self.stdout.write(format_result(label, samples, elapsed))
@@ -0,0 +1,45 @@
+from urllib.parse import urljoin
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from app.benchmark import format_result, run_load
+
+# Each endpoint as served by the sync viewsets and by the async read views
+READ_PATHS = {
+    'product list': ('products/', 'async/products/'),
+    'product detail': ('products/{slug}/', 'async/products/{slug}/'),
+    'category list': ('categories/', 'async/categories/'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Load the sync and async catalog read endpoints of a running server side by side, "
+        "one endpoint at a time, and compare throughput and latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/api/drf/v1/', help="Base URL of the API.")
+        parser.add_argument('--email', required=True, help="Account used to get an access token.")
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--clients', type=int, default=32, help="Concurrent clients per run.")
+        parser.add_argument('--duration', type=float, default=15, help="Seconds per endpoint and variant.")
+        parser.add_argument('--slug', help="Product for the detail runs, defaults to the newest product.")
+
+    def handle(self, *args, **options):
+        response = requests.post(urljoin(options['url'], 'login/'), json={'email': options['email'], 'password': options['password']}, timeout=30)
+        if response.status_code != 200:
+            raise CommandError(f"Login failed with {response.status_code}: {response.text[:200]}")
+        headers = {'Authorization': f"Bearer {response.json()['access']}"}
+        slug = options['slug']
+        if slug is None:
+            products = requests.get(urljoin(options['url'], 'products/?page_size=1'), headers=headers, timeout=30).json()['results']
+            if not products:
+                raise CommandError("There are no products to read, pass --slug.")
+            slug = products[0]['slug']
+
+        for name, paths in READ_PATHS.items():
+            self.stdout.write(f"{name}, {options['clients']} clients")
+            for label, path in zip(('sync', 'async'), paths):
+                url = urljoin(options['url'], path.format(slug=slug))
+                results, elapsed = run_load({label: (options['clients'], lambda session: session.get(url, headers=headers, timeout=30))}, options['duration'])
+                self.stdout.write(format_result(label, results[label], elapsed))
@@ -0,0 +1,66 @@
+import json
+import statistics
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from app.startup import STARTUP_STAGES, run_startup
+
+
+class Command(BaseCommand):
+    help = (
+        "Time fresh web worker processes up to a startup stage. Save a baseline with --save and "
+        "fail on a startup regression against it with --compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stage', default='urls', choices=STARTUP_STAGES, help="How far each process starts up, urls is a worker before its first response.")
+        parser.add_argument('--runs', type=int, default=10, help="Processes started, the medians are reported.")
+        parser.add_argument('--save', help="Write the result to this JSON file as a baseline.")
+        parser.add_argument('--compare', help="Baseline JSON file to compare with.")
+        parser.add_argument('--tolerance', type=float, default=10, help="Allowed slowdown against the baseline, in percent.")
+
+    def handle(self, *args, **options):
+        runs = []
+        for _ in range(options['runs']):
+            try:
+                runs.append(run_startup(options['stage'])[0])
+            except RuntimeError as e:
+                raise CommandError(f"The process failed to start: {e}")
+        stages = list(runs[0]['timings'])
+        result = {
+            'stage': options['stage'],
+            'runs': len(runs),
+            'python': sys.version.split()[0],
+            'modules': runs[-1]['modules'],
+            'median_ms': {stage: round(statistics.median(run['timings'][stage] for run in runs) * 1000, 1) for stage in stages},
+            'min_ms': {stage: round(min(run['timings'][stage] for run in runs) * 1000, 1) for stage in stages},
+        }
+        self.stdout.write(f"{len(runs)} processes up to {options['stage']}, {result['modules']} modules")
+        self.stdout.write(f"{'stage':<10} {'median':>9} {'min':>9}")
+        for stage in stages:
+            self.stdout.write(f"{stage:<10} {result['median_ms'][stage]:7.1f}ms {result['min_ms'][stage]:7.1f}ms")
+
+        if options['save']:
+            with open(options['save'], 'w') as baseline:
+                json.dump(result, baseline, indent=2)
+            self.stdout.write(f"Saved the baseline to {options['save']}.")
+        if options['compare']:
+            self.compare(result, options['compare'], options['tolerance'])
+
+    def compare(self, result, path, tolerance):
+        try:
+            with open(path) as baseline_file:
+                baseline = json.load(baseline_file)
+        except FileNotFoundError:
+            raise CommandError(f"Baseline {path} does not exist.")
+        if baseline['stage'] != result['stage']:
+            raise CommandError(f"The baseline measured the {baseline['stage']} stage, run with --stage {baseline['stage']}.")
+        stage = result['stage']
+        before, after = baseline['median_ms'][stage], result['median_ms'][stage]
+        change = (after - before) / before * 100
+        self.stdout.write(
+            f"Against {path}: {before:.1f}ms -> {after:.1f}ms ({change:+.1f}%), "
+            f"{baseline['modules']} -> {result['modules']} modules"
+        )
+        if change > tolerance:
+            raise CommandError(f"Startup to {stage} is {change:.1f}% slower than the baseline, more than the {tolerance:g}% allowed.")
+        self.stdout.write(self.style.SUCCESS(f"Startup to {stage} is within {tolerance:g}% of the baseline."))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from app.api_schema import artifact_path, build_documents, read_artifacts, schema_fingerprint, write_artifacts
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the OpenAPI schema as JSON and YAML artifacts under API_SCHEMA_ROOT, the docs serve them "
+        "from memory. Nothing is rebuilt while the URL confs, views and serializers are unchanged."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Rebuild even when the artifacts are current.")
+        parser.add_argument('--check', action='store_true', help="Only fail when the artifacts are missing or stale.")
+
+    def handle(self, *args, **options):
+        fingerprint = schema_fingerprint()
+        current = read_artifacts(fingerprint) is not None
+        if options['check']:
+            if not current:
+                raise CommandError(f"The API schema artifacts are stale, run manage.py build_api_schema ({fingerprint}).")
+            self.stdout.write(f"The API schema artifacts are current ({fingerprint}).")
+            return
+        if current and not options['force']:
+            self.stdout.write(f"The API schema artifacts are current ({fingerprint}), nothing to build.")
+            return
+        documents = write_artifacts(fingerprint, build_documents())
+        for extension, document in documents.items():
+            self.stdout.write(f"Wrote {artifact_path(fingerprint, extension)} ({len(document)} bytes).")
+        self.stdout.write(self.style.SUCCESS(f"Built the API schema {fingerprint}."))
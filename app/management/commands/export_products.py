@@ -0,0 +1,40 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from app.models import ProductList, VendorProfile
+from app.product_export import EXPORT_CHUNK_SIZE, export_products
+from app.utils import FILE_FORMATS, detect_file_format
+
+
+class Command(BaseCommand):
+    help = "Export products as CSV or NDJSON, streamed so that memory use stays flat for any catalog size."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="Output file, '-' writes to standard output.")
+        parser.add_argument('--vendor', help="Email of the vendor account to export, all products by default.")
+        parser.add_argument('--format', dest='file_format', choices=FILE_FORMATS, help="Defaults to the file extension, or csv.")
+        parser.add_argument('--gzip', action='store_true', help="Compress the output with gzip.")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        queryset = ProductList.objects.all()
+        if options['vendor']:
+            vendor = VendorProfile.objects.filter(user__email=options['vendor']).first()
+            if vendor is None:
+                raise CommandError(f"No vendor profile for {options['vendor']}.")
+            queryset = queryset.filter(product_vendor=vendor)
+        path = options['path']
+        # products.csv.gz is a csv file
+        filename = path[:-len('.gz')] if path.endswith('.gz') else path
+        file_format = detect_file_format(filename, options['file_format']) or 'csv'
+        compress = options['gzip'] or path.endswith('.gz')
+
+        chunks = export_products(queryset, file_format, compress, options['chunk_size'])
+        if path == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+        with open(path, 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f"Exported products to {path}."))
@@ -0,0 +1,38 @@
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from app.models import VendorProfile
+from app.product_import import IMPORT_BATCH_SIZE, ProductImporter, read_rows
+from app.utils import FILE_FORMATS, detect_file_format
+
+
+class Command(BaseCommand):
+    help = "Import products for a vendor from a CSV or NDJSON file and print a per-row error report."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or NDJSON file, '-' reads standard input.")
+        parser.add_argument('--vendor', required=True, help="Email of the vendor account that owns the products.")
+        parser.add_argument('--format', dest='file_format', choices=FILE_FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            vendor = VendorProfile.objects.get(user__email=options['vendor'])
+        except VendorProfile.DoesNotExist:
+            raise CommandError(f"No vendor profile for {options['vendor']}.")
+        file_format = detect_file_format(options['path'], options['file_format'])
+        if file_format is None:
+            raise CommandError("Could not detect the file format, pass --format csv or --format ndjson.")
+
+        importer = ProductImporter(vendor, batch_size=options['batch_size'])
+        if options['path'] == '-':
+            report = importer.run(read_rows(sys.stdin.buffer, file_format))
+        else:
+            try:
+                with open(options['path'], 'rb') as stream:
+                    report = importer.run(read_rows(stream, file_format))
+            except FileNotFoundError:
+                raise CommandError(f"File {options['path']} does not exist.")
+
+        self.stdout.write(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Imported {report['created']} of {report['processed']} rows."))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from app.images import process_staged_image, stale_staged_images
+
+
+class Command(BaseCommand):
+    help = "Process images left in the staging area, for example after a server restart dropped queued jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=600, help="Only images staged at least this many seconds ago, younger ones may still be queued.")
+
+    def handle(self, *args, **options):
+        names = stale_staged_images(options['min_age'])
+        processed = 0
+        for name in names:
+            try:
+                if process_staged_image(name):
+                    processed += 1
+            except Exception as e:
+                self.stderr.write(f"{name}: {e}")
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} of {len(names)} staged images."))
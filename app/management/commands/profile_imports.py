@@ -0,0 +1,43 @@
+from collections import Counter
+from django.core.management.base import BaseCommand, CommandError
+from app.startup import STARTUP_STAGES, parse_importtime, run_startup
+
+
+class Command(BaseCommand):
+    help = (
+        "Profile the imports of a fresh web worker process with python -X importtime. Lists the "
+        "modules by cumulative import time and the top-level packages by their own time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stage', default='urls', choices=STARTUP_STAGES, help="How far the process starts up, urls is a worker before its first response.")
+        parser.add_argument('--top', type=int, default=30, help="Modules and packages shown.")
+        parser.add_argument('--min-ms', type=float, default=1.0, help="Leave out modules that took less.")
+
+    def handle(self, *args, **options):
+        try:
+            result, output = run_startup(options['stage'], importtime=True)
+        except RuntimeError as e:
+            raise CommandError(f"The process failed to start: {e}")
+        imports = parse_importtime(output)
+        total = sum(cumulative for _, _, cumulative, depth in imports if depth == 0)
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"Stage {options['stage']}: {result['modules']} modules, {total / 1000:.0f}ms importing, "
+            + ", ".join(f"{stage} done at {seconds * 1000:.0f}ms" for stage, seconds in result['timings'].items())
+        ))
+
+        self.stdout.write(f"{'cumulative':>10} {'self':>8}  module")
+        slowest = sorted(imports, key=lambda entry: entry[2], reverse=True)
+        for name, own, cumulative, depth in slowest[:options['top']]:
+            if cumulative / 1000 < options['min_ms']:
+                break
+            self.stdout.write(f"{cumulative / 1000:8.1f}ms {own / 1000:6.1f}ms  {'  ' * depth}{name}")
+
+        # Self times add up without counting a module twice
+        packages = Counter()
+        for name, own, _, _ in imports:
+            packages[name.split('.')[0]] += own
+        self.stdout.write("")
+        self.stdout.write(f"{'self':>10} {'share':>6}  package")
+        for package, own in packages.most_common(options['top']):
+            self.stdout.write(f"{own / 1000:8.1f}ms {own / total:6.1%}  {package}")
@@ -0,0 +1,71 @@
+import io
+import pstats
+import statistics
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from app.profiling import stored_profiles
+
+
+class Command(BaseCommand):
+    help = (
+        "Aggregate the request profiles stored by ProfilingMiddleware by view. cProfile runs are "
+        "merged into one pstats report, sampled stacks into their hottest functions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--view', help="Only this view name, for example product-list.")
+        parser.add_argument('--top', type=int, default=25, help="Functions shown per view.")
+        parser.add_argument('--sort', default='cumulative', choices=['cumulative', 'tottime', 'ncalls'], help="pstats sort order.")
+        parser.add_argument('--collapsed-output', help="Also write the merged sampled stacks of every view to this file, for flame graph tools.")
+
+    def handle(self, *args, **options):
+        profiles = defaultdict(lambda: defaultdict(list))
+        for match, path in stored_profiles(options['view']):
+            profiles[match['view']][match['kind']].append((match, path))
+        if not profiles:
+            self.stdout.write(f"No profiles in {settings.PROFILE_ROOT}.")
+            return
+
+        merged_stacks = Counter()
+        for view, kinds in sorted(profiles.items()):
+            durations = [int(match['ms']) for runs in kinds.values() for match, _ in runs]
+            triggers = Counter(match['trigger'] for runs in kinds.values() for match, _ in runs)
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{view}: {len(durations)} profiles ({', '.join(f'{trigger} {count}' for trigger, count in sorted(triggers.items()))}), "
+                f"median {statistics.median(durations):.0f}ms, max {max(durations)}ms"
+            ))
+            if kinds['pstats']:
+                output = io.StringIO()
+                stats = pstats.Stats(*[path for _, path in kinds['pstats']], stream=output)
+                stats.strip_dirs().sort_stats(options['sort']).print_stats(options['top'])
+                self.stdout.write(output.getvalue())
+            if kinds['collapsed']:
+                stacks = Counter()
+                for _, path in kinds['collapsed']:
+                    with open(path) as collapsed:
+                        for line in collapsed:
+                            stack, _, count = line.rstrip('\n').rpartition(' ')
+                            stacks[stack] += int(count)
+                merged_stacks.update({f'{view};{stack}': count for stack, count in stacks.items()})
+                self.write_hot_functions(stacks, options['top'])
+
+        if options['collapsed_output']:
+            with open(options['collapsed_output'], 'w') as output:
+                output.writelines(f'{stack} {count}\n' for stack, count in merged_stacks.most_common())
+            self.stdout.write(self.style.SUCCESS(f"Wrote merged stacks to {options['collapsed_output']}."))
+
+    #  Functions by the share of samples they were running in (self) or on the stack (total)
+    def write_hot_functions(self, stacks, top):
+        total = sum(stacks.values())
+        own, inclusive = Counter(), Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        self.stdout.write(f"{total} stack samples")
+        self.stdout.write(f"{'self':>7} {'total':>7}  function")
+        for frame, count in own.most_common(top):
+            self.stdout.write(f"{count / total:7.1%} {inclusive[frame] / total:7.1%}  {frame}")
+        self.stdout.write("")
@@ -0,0 +1,49 @@
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from app.product_import import read_rows
+from app.user_provisioning import PROVISION_BATCH_SIZE, UserProvisioner
+from app.utils import FILE_FORMATS, detect_file_format
+
+
+class Command(BaseCommand):
+    help = (
+        "Create vendor and customer accounts with their profiles and addresses from a CSV or NDJSON "
+        "file and print a per-row error report. Accounts whose email exists are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or NDJSON file, '-' reads standard input.")
+        parser.add_argument('--format', dest='file_format', choices=FILE_FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=PROVISION_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, help="Password hashing processes, defaults to the CPU count. 0 hashes in this process.")
+        parser.add_argument('--checkpoint', help="Progress file, defaults to <path>.progress. A rerun continues after the last batch it recorded.")
+        parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint and start from the first row.")
+
+    def handle(self, *args, **options):
+        file_format = detect_file_format(options['path'], options['file_format'])
+        if file_format is None:
+            raise CommandError("Could not detect the file format, pass --format csv or --format ndjson.")
+        checkpoint = options['checkpoint']
+        if checkpoint is None and options['path'] != '-':
+            checkpoint = f"{options['path']}.progress"
+
+        provisioner = UserProvisioner(batch_size=options['batch_size'], workers=options['workers'], checkpoint=checkpoint)
+        if options['restart']:
+            provisioner.discard_checkpoint()
+        elif (progress := provisioner.load_checkpoint()) is not None:
+            self.stdout.write(f"Continuing after row {progress['processed']} from {checkpoint}.")
+        if options['path'] == '-':
+            # Standard input cannot be read again, a checkpoint only helps when the input is replayed the same way
+            report = provisioner.run(read_rows(sys.stdin.buffer, file_format))
+        else:
+            try:
+                with open(options['path'], 'rb') as stream:
+                    report = provisioner.run(read_rows(stream, file_format))
+            except FileNotFoundError:
+                raise CommandError(f"File {options['path']} does not exist.")
+
+        self.stdout.write(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {report['created']} of {report['processed']} accounts, {report['skipped']} existed and {report['failed']} failed."
+        ))
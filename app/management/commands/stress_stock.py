@@ -0,0 +1,131 @@
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from django.db.models import Sum
+from app.models import User, VendorProfile, ProductCategory, ProductList, StockReservation, StockReservationItem
+from app.stock import InsufficientStock, ReservationNotHeld, commit_reservation, release_reservation, reserve_stock, sweep_expired_reservations
+
+
+class Command(BaseCommand):
+    help = (
+        "Stress the stock reservation engine with concurrent reservations, commits, releases and "
+        "expiry sweeps on a few throwaway products, then check that no stock was lost or oversold. "
+        "Run it against Postgres, SQLite serializes every write."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=5)
+        parser.add_argument('--stock', type=int, default=200, help="Initial stock of each product.")
+        parser.add_argument('--workers', type=int, default=16, help="Concurrent threads reserving stock.")
+        parser.add_argument('--operations', type=int, default=200, help="Reservations attempted per worker.")
+        parser.add_argument('--keep', action='store_true', help="Keep the throwaway data for inspection.")
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        vendor = User.objects.create_user(f'stress-vendor-{run}@example.com', role=User.Role.VENDOR)
+        buyer = User.objects.create_user(f'stress-buyer-{run}@example.com', role=User.Role.CUSTOMER)
+        category = ProductCategory.objects.create(category_name=f'Stress {run}', category_description='Stock stress test')
+        try:
+            profile = VendorProfile.objects.create(
+                user=vendor, company_name=f'Stress {run}', business_registration_number=run, gst_id=run, phone_number='+14155552671',
+            )
+            product_ids = [
+                ProductList.objects.create(
+                    product_vendor=profile, product_category=category, product_name=f'Stress {number}', product_image='stress.png',
+                    product_description='Stock stress test', product_stock=options['stock'], product_price=1,
+                ).pk
+                for number in range(options['products'])
+            ]
+            outcomes, elapsed = self.stress(buyer.pk, product_ids, options)
+            self.stdout.write(f"{options['workers']} workers, {elapsed:.1f}s: " + ", ".join(f"{key} {count}" for key, count in sorted(outcomes.items())))
+            problems = self.check_stock(product_ids, options['stock'])
+            if outcomes['error']:
+                problems.append(f"{outcomes['error']} operations failed with a database error.")
+        finally:
+            if not options['keep']:
+                vendor.delete()
+                buyer.delete()
+                category.delete()
+        if problems:
+            raise CommandError("\n".join(problems))
+        self.stdout.write(self.style.SUCCESS("Stock is consistent."))
+
+    #  Workers reserve random baskets listed in random order, then commit, release, or leave them
+    #  to expire while a sweeper thread expires them
+    def stress(self, user_id, product_ids, options):
+        outcomes = Counter()
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def worker():
+            seen = Counter()
+            try:
+                for _ in range(options['operations']):
+                    basket = {product_id: random.randint(1, 3) for product_id in random.sample(product_ids, random.randint(1, min(3, len(product_ids))))}
+                    next_step = random.choice(('commit', 'release', 'expire'))
+                    try:
+                        reservation = reserve_stock(user_id, basket, ttl=0 if next_step == 'expire' else 60)
+                        seen['reserved'] += 1
+                        if next_step == 'commit':
+                            commit_reservation(reservation.pk)
+                        elif next_step == 'release':
+                            release_reservation(reservation.pk)
+                        seen[next_step] += 1
+                    except InsufficientStock:
+                        seen['insufficient'] += 1
+                    except ReservationNotHeld:
+                        seen['not held'] += 1
+                    except DatabaseError:
+                        seen['error'] += 1
+            finally:
+                connection.close()
+                with lock:
+                    outcomes.update(seen)
+
+        def sweeper():
+            try:
+                while not done.is_set():
+                    expired = sweep_expired_reservations(batch_size=50)
+                    with lock:
+                        outcomes['swept'] += expired
+                    time.sleep(0.01)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(options['workers'])]
+        sweeper_thread = threading.Thread(target=sweeper)
+        started = time.monotonic()
+        sweeper_thread.start()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        done.set()
+        sweeper_thread.join()
+        elapsed = time.monotonic() - started
+        outcomes['swept'] += sweep_expired_reservations()
+        return outcomes, elapsed
+
+    #  Every unit is either on the product or in a held or committed reservation, and
+    #  availability follows the stock
+    def check_stock(self, product_ids, initial_stock):
+        problems = []
+        if StockReservation.objects.filter(items__product_id__in=product_ids, status=StockReservation.Status.HELD).exists():
+            problems.append("Expired reservations are still held after the final sweep.")
+        taken = dict(
+            StockReservationItem.objects.filter(
+                product_id__in=product_ids,
+                reservation__status__in=[StockReservation.Status.HELD, StockReservation.Status.COMMITTED],
+            ).values('product_id').annotate(quantity=Sum('quantity')).order_by().values_list('product_id', 'quantity')
+        )
+        for product in ProductList.objects.filter(pk__in=product_ids).only('product_stock', 'product_availability'):
+            taken_quantity = taken.get(product.pk, 0)
+            if product.product_stock < 0 or product.product_stock + taken_quantity != initial_stock:
+                problems.append(f"Product {product.pk}: stock {product.product_stock} plus {taken_quantity} taken is not {initial_stock}.")
+            if product.product_availability != (product.product_stock > 0):
+                problems.append(f"Product {product.pk}: availability {product.product_availability} with stock {product.product_stock}.")
+        return problems
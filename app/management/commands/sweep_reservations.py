@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from app.stock import sweep_expired_reservations
+
+
+class Command(BaseCommand):
+    help = "Expire held stock reservations past their expiry and return their stock, run it every minute or so."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Reservations expired per transaction.")
+
+    def handle(self, *args, **options):
+        expired = sweep_expired_reservations(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Expired {expired} reservations."))
@@ -0,0 +1,26 @@
+import sqlite3
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = "Copy the SQLite primary over its replica files, the DB_ENGINE=sqlite stand-in for replication."
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError("Only the DB_ENGINE=sqlite stand-in needs this, real replicas follow the primary themselves.")
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No replicas configured, set DB_SQLITE_REPLICAS.")
+        source = sqlite3.connect(connections['default'].settings_dict['NAME'])
+        try:
+            for alias in settings.DATABASE_REPLICAS:
+                connections[alias].close()
+                target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(f"Copied the primary to {alias}.")
+        finally:
+            source.close()
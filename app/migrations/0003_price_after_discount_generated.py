@@ -0,0 +1,32 @@
+# Generated by Django 6.0.1 on 2026-10-18 08:43
+
+import django.db.models.expressions
+import django.db.models.functions.math
+import django.db.models.lookups
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_pagination_indexes'),
+    ]
+
+    # The column is dropped and re-added as a stored generated column, the database
+    # computes it for every existing row while adding it
+    operations = [
+        migrations.RemoveField(
+            model_name='productlist',
+            name='product_price_after_discount',
+        ),
+        migrations.AddField(
+            model_name='productlist',
+            name='product_price_after_discount',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(django.db.models.lookups.GreaterThan(models.F('product_discount'), 0), then=django.db.models.functions.math.Round(django.db.models.expressions.CombinedExpression(models.F('product_price'), '-', django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('product_price'), '*', models.F('product_discount')), '*', models.Value(Decimal('0.01')))), 2)), default=models.Value(None), output_field=models.DecimalField(decimal_places=2, max_digits=10)), output_field=models.DecimalField(decimal_places=2, max_digits=10, null=True), verbose_name='Product Price After Discount'),
+        ),
+        migrations.AddIndex(
+            model_name='productlist',
+            index=models.Index(fields=['product_price_after_discount', 'id'], name='product_discounted_price_idx'),
+        ),
+    ]
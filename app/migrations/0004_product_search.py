@@ -0,0 +1,60 @@
+# Generated by Django 6.0.1 on 2026-10-18 08:44
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# The vector is kept in sync by a trigger so bulk creates and queryset updates stay searchable.
+# "UPDATE OF" limits recomputation to writes that touch the searchable columns.
+CREATE_SEARCH_SQL = """
+CREATE FUNCTION app_productlist_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.product_name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.product_description, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(NEW.product_specifications, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER app_productlist_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF product_name, product_description, product_specifications
+    ON app_productlist FOR EACH ROW EXECUTE FUNCTION app_productlist_search_vector_update();
+
+UPDATE app_productlist SET product_name = product_name;
+
+CREATE INDEX product_search_vector_idx ON app_productlist USING gin (search_vector);
+"""
+
+DROP_SEARCH_SQL = """
+DROP INDEX IF EXISTS product_search_vector_idx;
+DROP TRIGGER IF EXISTS app_productlist_search_vector_trigger ON app_productlist;
+DROP FUNCTION IF EXISTS app_productlist_search_vector_update();
+"""
+
+
+# Other databases use the icontains fallback in app.filters.ProductSearchFilter
+def create_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_SEARCH_SQL)
+
+
+def drop_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_SEARCH_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_price_after_discount_generated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productlist',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Search Vector'),
+        ),
+        migrations.RunPython(create_search_trigger, drop_search_trigger),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 6.0.1 on 2026-10-18 08:47
+
+import django.db.models.functions.comparison
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_product_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productlist',
+            index=models.Index(fields=['product_price', 'id'], name='product_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productlist',
+            index=models.Index(django.db.models.functions.comparison.Coalesce('product_discount', models.Value(Decimal('0'))), models.F('id'), name='product_discount_rate_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productlist',
+            index=models.Index(fields=['product_category', '-product_created_at', '-id'], name='product_category_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productlist',
+            index=models.Index(fields=['product_category', 'product_price', 'id'], name='product_category_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productlist',
+            index=models.Index(fields=['product_vendor', '-product_created_at', '-id'], name='product_vendor_created_idx'),
+        ),
+    ]
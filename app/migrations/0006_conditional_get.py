@@ -0,0 +1,22 @@
+# Generated by Django 6.0.1 on 2026-10-18 08:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_product_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vendorprofile',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Updated At'),
+        ),
+        migrations.AddIndex(
+            model_name='productlist',
+            index=models.Index(fields=['product_updated_at'], name='product_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_user_token_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customerprofile',
+            name='profile_pic_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Profile picture variants'),
+        ),
+        migrations.AddField(
+            model_name='productcategory',
+            name='category_image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Category Image Variants'),
+        ),
+        migrations.AddField(
+            model_name='productlist',
+            name='product_image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Product Image Variants'),
+        ),
+        migrations.AddField(
+            model_name='vendorprofile',
+            name='logo_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='company logo variants'),
+        ),
+    ]
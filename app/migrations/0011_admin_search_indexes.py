@@ -0,0 +1,42 @@
+# Generated by Django 6.0.1 on 2026-10-18 10:20
+
+from django.db import migrations
+
+
+# Admin searches match prefixes case-insensitively, as UPPER(column) LIKE UPPER('term%').
+# text_pattern_ops lets those LIKEs use the index whatever the database collation.
+CREATE_SEARCH_INDEXES_SQL = """
+CREATE INDEX user_email_upper_like_idx ON app_user (UPPER(email) text_pattern_ops);
+CREATE INDEX user_username_upper_like_idx ON app_user (UPPER(username) text_pattern_ops);
+CREATE INDEX vendor_company_upper_like_idx ON app_vendorprofile (UPPER(company_name) text_pattern_ops);
+CREATE INDEX category_name_upper_like_idx ON app_productcategory (UPPER(category_name) text_pattern_ops);
+"""
+
+DROP_SEARCH_INDEXES_SQL = """
+DROP INDEX IF EXISTS user_email_upper_like_idx;
+DROP INDEX IF EXISTS user_username_upper_like_idx;
+DROP INDEX IF EXISTS vendor_company_upper_like_idx;
+DROP INDEX IF EXISTS category_name_upper_like_idx;
+"""
+
+
+# Other databases scan, their admin tables are small
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_SEARCH_INDEXES_SQL)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_SEARCH_INDEXES_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_carts'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,177 @@
+from hashlib import sha256
+from django.db.models import Count, Max
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.response import Response
+from .replicas import start_replica_reads, stop_replica_reads
+
+
+def conditional_validators(etag_parts, last_modified):
+    etag = '"%s"' % sha256(repr(etag_parts).encode()).hexdigest()[:32]
+    # HTTP dates have whole seconds
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return etag, timestamp
+
+def set_conditional_headers(response, etag, timestamp):
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+#  Answer If-None-Match / If-Modified-Since with 304 before `respond` builds the response,
+#  the ETag is a digest of `etag_parts`, which must change whenever the response would
+def conditional_response(request, etag_parts, last_modified, respond):
+    etag, timestamp = conditional_validators(etag_parts, last_modified)
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = respond()
+    return set_conditional_headers(response, etag, timestamp)
+
+#  conditional_response for async views, `respond` is a coroutine function
+async def aconditional_response(request, etag_parts, last_modified, respond):
+    etag, timestamp = conditional_validators(etag_parts, last_modified)
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = await respond()
+    return set_conditional_headers(response, etag, timestamp)
+
+#  Safe requests read from a replica, see app/replicas.py, unless the user wrote recently
+class ReplicaReadMixin:
+    replica_reads = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.replica_reads = start_replica_reads(request)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        stop_replica_reads(self.replica_reads)
+        self.replica_reads = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+#  Async list and retrieve for viewsets, served by the async read views. Rows are read through
+#  the async ORM, so querysets must load every relation the serializer renders.
+class AsyncReadMixin:
+    async def alist(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.paginator is not None:
+            page = await self.paginator.apaginate_queryset(queryset, request, view=self)
+            if page is not None:
+                return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        instances = [instance async for instance in queryset]
+        return Response(self.get_serializer(instances, many=True).data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        return Response(self.get_serializer(instance).data)
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        instance = await queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]}).afirst()
+        if instance is None:
+            raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
+        self.check_object_permissions(self.request, instance)
+        return instance
+
+#  Lists read with values() and rendered by the serializer's represent_rows, no model instances
+#  are built. Only the serializer's values_columns and the pagination ordering are selected.
+class ValuesListMixin:
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer()
+        queryset = self.values_queryset(serializer)
+        if self.paginator is not None:
+            page = self.paginator.paginate_queryset(queryset, request, view=self)
+            if page is not None:
+                return self.get_paginated_response(serializer.represent_rows(page))
+        return Response(serializer.represent_rows(list(queryset)))
+
+    async def alist(self, request, *args, **kwargs):
+        serializer = self.get_serializer()
+        queryset = self.values_queryset(serializer)
+        if self.paginator is not None:
+            page = await self.paginator.apaginate_queryset(queryset, request, view=self)
+            if page is not None:
+                return self.get_paginated_response(serializer.represent_rows(page))
+        return Response(serializer.represent_rows([row async for row in queryset]))
+
+    def values_queryset(self, serializer):
+        queryset = self.filter_queryset(self.get_queryset())
+        columns = serializer.values_columns()
+        get_ordering = getattr(self.paginator, 'get_ordering', None)
+        if get_ordering is not None:
+            # Cursor positions are read from the rows
+            columns += [field.lstrip('-') for field in get_ordering(self.request, queryset, self)]
+        return queryset.values(*dict.fromkeys(columns))
+
+#  Conditional GET for viewsets. ETag and Last-Modified come from the `updated_field` timestamp,
+#  a single row lookup for details. Paginated lists are validated by the page they serve, the
+#  keys and timestamps of its rows read through the paginator, so nothing counts the whole
+#  filtered listing. Unchanged resources are answered before anything is serialized.
+class ConditionalGetMixin:
+    updated_field = None
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = None
+        if self.paginator is not None:
+            page = self.paginator.paginate_queryset(self.page_state_queryset(queryset), request, view=self)
+        if page is None:
+            state = queryset.order_by().aggregate(last_modified=Max(self.updated_field), count=Count('pk'))
+            etag_parts, last_modified = self.listing_validators(request, state)
+        else:
+            etag_parts, last_modified = self.page_validators(request, page)
+        return conditional_response(request, etag_parts, last_modified, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+        last_modified = queryset.values_list(self.updated_field, flat=True).first()
+        if last_modified is None:
+            # Missing rows take the regular path and its 404
+            return super().retrieve(request, *args, **kwargs)
+        etag_parts = (request.get_full_path(), last_modified)
+        return conditional_response(request, etag_parts, last_modified, lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs))
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = None
+        if self.paginator is not None:
+            page = await self.paginator.apaginate_queryset(self.page_state_queryset(queryset), request, view=self)
+        if page is None:
+            state = await queryset.order_by().aaggregate(last_modified=Max(self.updated_field), count=Count('pk'))
+            etag_parts, last_modified = self.listing_validators(request, state)
+        else:
+            etag_parts, last_modified = self.page_validators(request, page)
+        return await aconditional_response(request, etag_parts, last_modified, lambda: super(ConditionalGetMixin, self).alist(request, *args, **kwargs))
+
+    #  Key, timestamp and the pagination ordering columns of the listed rows
+    def page_state_queryset(self, queryset):
+        columns = ['pk', self.updated_field]
+        get_ordering = getattr(self.paginator, 'get_ordering', None)
+        if get_ordering is not None:
+            # Cursor positions are read from the rows
+            columns += [field.lstrip('-') for field in get_ordering(self.request, queryset, self)]
+        return queryset.values(*dict.fromkeys(columns))
+
+    #  A row joining, leaving or changing within the page changes its rows, a row added past
+    #  either end changes the links. No Last-Modified, a row leaving the page moves no timestamp.
+    def page_validators(self, request, page):
+        rows = [(row['pk'], row[self.updated_field]) for row in page]
+        return (request.get_full_path(), rows, self.paginator.get_next_link(), self.paginator.get_previous_link()), None
+
+    #  Unpaginated lists serve every row, the count changes when rows are deleted, which the
+    #  max timestamp alone would miss
+    def listing_validators(self, request, state):
+        return (request.get_full_path(), state['last_modified'], state['count']), state['last_modified']
+
+    async def aretrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+        last_modified = await queryset.values_list(self.updated_field, flat=True).afirst()
+        if last_modified is None:
+            return await super().aretrieve(request, *args, **kwargs)
+        etag_parts = (request.get_full_path(), last_modified)
+        return await aconditional_response(request, etag_parts, last_modified, lambda: super(ConditionalGetMixin, self).aretrieve(request, *args, **kwargs))
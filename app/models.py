@@ -1,19 +1,28 @@
+from decimal import Decimal
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
+from django.contrib.postgres.search import SearchVectorField
 from phonenumber_field.modelfields import PhoneNumberField
 from django.utils import timezone
 from django.utils.text import slugify
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
+from .utils import save_with_unique_value
+from .product_pricing import price_after_discount_expression
 
 #  Model Manager & Custom User Model
 class CreateUsers(BaseUserManager):
-    def create_user(self, email, password=None, **extra_fields):
+    #  `password_hash` takes a password already hashed with make_password
+    def create_user(self, email, password=None, password_hash=None, **extra_fields):
         if not email:
             raise ValueError('Email is required')
         email = self.normalize_email(email)
         user = self.model(email=email, **extra_fields)
-        user.set_password(password)
+        if password_hash is not None:
+            user.password = password_hash
+        else:
+            user.set_password(password)
         user.save(using=self._db)
         return user
 
@@ -42,21 +51,23 @@ class User(AbstractBaseUser, PermissionsMixin):
     date_joined = models.DateTimeField(verbose_name=_("date joined"),auto_now_add=True)
 
     role = models.CharField(verbose_name=_("User role"), max_length=50, choices=Role.choices)
+    # Carried in issued tokens, bumping it revokes every token issued before
+    token_version = models.PositiveIntegerField(verbose_name=_("Token version"), default=0)
         
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
 
     objects = CreateUsers()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date_joined', '-id'], name='user_joined_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.username:
             base_username = self.email.split('@')[0].lower()
-            username = base_username
-            counter = 1
-            while User.objects.filter(username=username).exists():
-                username = f"{base_username}{counter}"
-                counter += 1
-            self.username = username
+            return save_with_unique_value(self, 'username', base_username, '', super().save, *args, **kwargs)
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -66,12 +77,15 @@ class User(AbstractBaseUser, PermissionsMixin):
 class VendorProfile(models.Model):
     user = models.OneToOneField(User, verbose_name=_("Vendor"), on_delete=models.CASCADE, primary_key=True, related_name='vendor_profile')
     logo = models.ImageField(verbose_name=_("company logo"), upload_to='vendor_logos/', null=True, blank=True)
+    # Variant names by width and 'thumbnail', written by the image pipeline
+    logo_variants = models.JSONField(verbose_name=_("company logo variants"), default=dict, blank=True, editable=False)
     company_name = models.CharField(verbose_name=_("Company Name"), max_length=255, unique=True)
     business_registration_number = models.CharField(verbose_name=_("Registration number"), max_length=255)
     gst_id = models.CharField(verbose_name=_("GST number"), max_length=255)
     phone_number = PhoneNumberField(verbose_name=_("Phone number"))
     website = models.URLField(verbose_name=_("Website"), max_length=200, blank=True)
     is_verified = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
 
     def __str__(self):
         return f"{self.company_name} ({self.user.username})"
@@ -83,6 +97,7 @@ class CustomerProfile(models.Model):
 
     user = models.OneToOneField(User, verbose_name=_("Customer"), on_delete=models.CASCADE, primary_key=True, related_name='customer_profile')
     profile_pic = models.ImageField(verbose_name=_("Profile picture"), upload_to='customer_profiles/', null=True, blank=True)
+    profile_pic_variants = models.JSONField(verbose_name=_("Profile picture variants"), default=dict, blank=True, editable=False)
     phone_number = PhoneNumberField(verbose_name=_("Phone number"))
     date_of_birth = models.DateField(verbose_name=_("Date of birth"), blank=True, null=True)
     gender = models.CharField(verbose_name=_("Gender"), max_length=10, choices=Gender.choices, blank=True, null=True)
@@ -113,12 +128,13 @@ class UserAddress(models.Model):
 class ProductCategory(models.Model):
     category_name = models.CharField(verbose_name=_("Category Name"), max_length=255, unique=True)
     category_image = models.ImageField(verbose_name=_("Category Image"), upload_to='category_images/', null=True, blank=True)
+    category_image_variants = models.JSONField(verbose_name=_("Category Image Variants"), default=dict, blank=True, editable=False)
     category_description = models.CharField(verbose_name=_("Category Description"), max_length=255)
     slug = models.SlugField(verbose_name=_("Category Slug"), max_length=255, unique=True)
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.category_name)
+            return save_with_unique_value(self, 'slug', slugify(self.category_name), '-', super().save, *args, **kwargs)
         super().save(*args, **kwargs)
     
     def __str__(self):
@@ -130,16 +146,38 @@ class ProductList(models.Model):
     product_category = models.ForeignKey(ProductCategory, verbose_name=_("Category"), to_field='slug' , on_delete=models.CASCADE, null=False, blank=False)
     product_name = models.CharField(_("Product Name"), max_length=255, null=False, blank=False)
     product_image = models.ImageField(_("Product Image"), upload_to='product_images/', null=False, blank=False)
+    product_image_variants = models.JSONField(_("Product Image Variants"), default=dict, blank=True, editable=False)
     product_description = models.TextField(_("Product Description"), null=False, blank=False)
     product_specifications = models.TextField(_("Product Specifications"), null=True, blank=True)
     product_stock = models.PositiveIntegerField(_("Product Stock"), null=False, blank=False)
     product_price = models.DecimalField(_("Product Price"), max_digits=10, decimal_places=2, null=False, blank=False)
     product_discount = models.DecimalField(_("Product Discount"), max_digits=4, decimal_places=2, null=True, blank=True)
-    product_price_after_discount = models.DecimalField(_("Product Price After Discount"), max_digits=10, decimal_places=2, null=True, blank=True)
+    # Computed and stored by the database, so bulk creates and queryset updates keep it in sync
+    product_price_after_discount = models.GeneratedField(
+        verbose_name=_("Product Price After Discount"),
+        expression=price_after_discount_expression(models.F('product_price'), models.F('product_discount')),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2, null=True),
+        db_persist=True,
+    )
     product_availability = models.BooleanField(_("Product Availability"), default=True)
     product_created_at = models.DateTimeField(_("Product Created At"), auto_now_add=True)
     product_updated_at = models.DateTimeField(_("Product Updated At"), auto_now=True)
     slug = models.SlugField(_("Product Slug"), max_length=255, unique=True)
+    # Maintained by a database trigger on Postgres, see migration 0004
+    search_vector = SearchVectorField(_("Search Vector"), null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-product_created_at', '-id'], name='product_created_idx'),
+            models.Index(fields=['product_price_after_discount', 'id'], name='product_discounted_price_idx'),
+            models.Index(fields=['product_updated_at'], name='product_updated_idx'),
+            # Filter and sort combinations used by the product listing
+            models.Index(fields=['product_price', 'id'], name='product_price_idx'),
+            models.Index(Coalesce('product_discount', models.Value(Decimal('0'))), 'id', name='product_discount_rate_idx'),
+            models.Index(fields=['product_category', '-product_created_at', '-id'], name='product_category_created_idx'),
+            models.Index(fields=['product_category', 'product_price', 'id'], name='product_category_price_idx'),
+            models.Index(fields=['product_vendor', '-product_created_at', '-id'], name='product_vendor_created_idx'),
+        ]
 
     def clean(self):
         super().clean()
@@ -158,21 +196,62 @@ class ProductList(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             baseslug = slugify(f"{self.product_vendor.company_name}-{self.product_name}")
-            slug = baseslug
-            count = 1
-            while ProductList.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-                slug = f"{baseslug}-{count}"
-                count +=1
-            self.slug = slug
-        self.calculate_price_after_discount()
+            return save_with_unique_value(self, 'slug', baseslug, '-', super().save, *args, **kwargs)
         super().save(*args, **kwargs)
 
-    def calculate_price_after_discount(self):
-        if self.product_price and self.product_discount and self.product_discount > 0:
-            discount_amount = self.product_price * (self.product_discount / 100)
-            self.product_price_after_discount = self.product_price - discount_amount
-        else:
-            self.product_price_after_discount = None
-
     def __str__(self):
         return self.product_name
+
+#  Stock held for a user, it leaves the product when reserved and comes back when the
+#  reservation is released or expires. See app/stock.py.
+class StockReservation(models.Model):
+    class Status(models.TextChoices):
+        HELD = 'HELD', 'Held'
+        COMMITTED = 'COMMITTED', 'Committed'
+        RELEASED = 'RELEASED', 'Released'
+        EXPIRED = 'EXPIRED', 'Expired'
+
+    user = models.ForeignKey(User, verbose_name=_("User"), on_delete=models.CASCADE, related_name='stock_reservations')
+    status = models.CharField(_("Status"), max_length=20, choices=Status.choices, default=Status.HELD)
+    expires_at = models.DateTimeField(_("Expires At"))
+    created_at = models.DateTimeField(_("Created At"), auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='reservation_user_created_idx'),
+            # Only held reservations can expire, the sweep never looks at the rest
+            models.Index(fields=['expires_at'], condition=models.Q(status='HELD'), name='reservation_held_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"Reservation {self.pk} ({self.status})"
+
+class StockReservationItem(models.Model):
+    reservation = models.ForeignKey(StockReservation, verbose_name=_("Reservation"), on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(ProductList, verbose_name=_("Product"), on_delete=models.CASCADE, related_name='reservation_items')
+    quantity = models.PositiveIntegerField(_("Quantity"))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['reservation', 'product'], name='reservation_item_product_unique'),
+        ]
+
+#  Carts are served from the cache, these rows are written behind it in batches. See app/cart.py.
+class Cart(models.Model):
+    user = models.OneToOneField(User, verbose_name=_("User"), on_delete=models.CASCADE, primary_key=True, related_name='cart')
+    # Version of the cached cart written last, a flush never replaces a newer one
+    version = models.PositiveBigIntegerField(_("Version"), default=0)
+    updated_at = models.DateTimeField(_("Updated At"), auto_now=True)
+
+    def __str__(self):
+        return f"Cart of {self.user_id}"
+
+class CartItem(models.Model):
+    cart = models.ForeignKey(Cart, verbose_name=_("Cart"), on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(ProductList, verbose_name=_("Product"), on_delete=models.CASCADE, related_name='cart_items')
+    quantity = models.PositiveIntegerField(_("Quantity"))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='cart_item_product_unique'),
+        ]
@@ -0,0 +1,136 @@
+import json
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+
+
+#  Keyset pagination base, cursors are opaque and page size is capped by settings.
+#  The page query is split from the cursor bookkeeping, so async views can fetch the
+#  same page through the async ORM with apaginate_queryset.
+class CappedCursorPagination(CursorPagination):
+    page_size = settings.PAGINATION_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.PAGINATION_MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        window = self.get_page_window(queryset, request, view)
+        if window is None:
+            return None
+        return self.paginate_results(list(window))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        window = self.get_page_window(queryset, request, view)
+        if window is None:
+            return None
+        return self.paginate_results([instance async for instance in window])
+
+    #  The sliced queryset of the requested page plus one row, which tells if a page follows
+    def get_page_window(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            self.window_offset, self.window_reverse, self.window_position = 0, False, None
+        else:
+            self.window_offset, self.window_reverse, self.window_position = self.cursor
+
+        # Cursor pagination always enforces an ordering
+        if self.window_reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if self.window_position is not None:
+            order = self.ordering[0]
+            is_reversed = order.startswith('-')
+            order_attr = order.lstrip('-')
+            # (cursor reversed) XOR (queryset reversed)
+            if self.cursor.reverse != is_reversed:
+                queryset = queryset.filter(**{order_attr + '__lt': self.window_position})
+            else:
+                queryset = queryset.filter(**{order_attr + '__gt': self.window_position})
+
+        return queryset[self.window_offset:self.window_offset + self.page_size + 1]
+
+    #  Cursor positions for the rows fetched from the page window
+    def paginate_results(self, results):
+        offset, reverse, current_position = self.window_offset, self.window_reverse, self.window_position
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            # The query ran in reverse, put the page back in order
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+#  Product listing newest first
+class ProductCursorPagination(CappedCursorPagination):
+    ordering = ('-product_created_at', '-id')
+
+#  Category listing by slug
+class CategoryCursorPagination(CappedCursorPagination):
+    ordering = ('slug',)
+
+#  Admin user listing newest first
+class UserCursorPagination(CappedCursorPagination):
+    ordering = ('-date_joined', '-id')
+
+#  Stock reservations newest first
+class ReservationCursorPagination(CappedCursorPagination):
+    ordering = ('-created_at', '-id')
+
+#  Admin changelist paginator. On Postgres the count of a large result comes from the
+#  statistics, reltuples for a whole table and the planner's row estimate for a filtered one,
+#  so big tables are never counted row by row. The last pages may come out short or empty.
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate is None or estimate < settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+            return super().count
+        return estimate
+
+#  Estimated rows of a queryset, None where there is no estimate to use
+def estimated_count(queryset):
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    if not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)', [connection.ops.quote_name(queryset.model._meta.db_table)])
+            row = cursor.fetchone()
+        # -1 until the table was first vacuumed or analyzed
+        return int(row[0]) if row is not None and row[0] >= 0 else None
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import password_validation
+from django.contrib.auth.hashers import make_password, verify_password as django_verify_password
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+
+#  Raised when the password pool queue is full, requests are shed instead of queued
+class PasswordPoolBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many sign-in requests, please try again shortly.'
+    default_code = 'password_pool_busy'
+    # Sent as the Retry-After header
+    wait = 1
+
+#  Bounded pool for password hashing and validation. PBKDF2 releases the GIL, so the workers
+#  hash in parallel while request threads and the event loop stay free for other requests.
+class PasswordPool:
+    def __init__(self, workers, max_pending):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password')
+        # Running and queued jobs, a job beyond the limit is rejected right away
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise PasswordPoolBusy()
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def run(self, fn, *args):
+        return self.submit(fn, *args).result()
+
+    async def arun(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# A forked worker gets its own pool, the parent's threads do not come along
+def _reset_after_fork():
+    global _pool, _pool_lock
+    _pool, _pool_lock = None, threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+#  Created on first use, so every server process gets its own workers
+def password_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PasswordPool(settings.PASSWORD_POOL_WORKERS, settings.PASSWORD_POOL_MAX_PENDING)
+    return _pool
+
+def _password_errors(password, user):
+    try:
+        password_validation.validate_password(password, user=user)
+    except DjangoValidationError as e:
+        return list(e.messages)
+    except ValidationError as e:
+        # CustomPasswordStrengthValidator raises DRF's ValidationError
+        return [str(message) for message in e.detail]
+    return []
+
+#  Messages of the failed password validators, empty for a valid password
+def password_errors(password, user=None):
+    return password_pool().run(_password_errors, password, user)
+
+async def apassword_errors(password, user=None):
+    return await password_pool().arun(_password_errors, password, user)
+
+def hash_password(password):
+    return password_pool().run(make_password, password)
+
+async def ahash_password(password):
+    return await password_pool().arun(make_password, password)
+
+#  Returns (correct, must_update), must_update asks for a rehash with the current hasher
+def verify_password(password, encoded):
+    return password_pool().run(django_verify_password, password, encoded)
+
+async def averify_password(password, encoded):
+    return await password_pool().arun(django_verify_password, password, encoded)
@@ -20,7 +20,7 @@ class IsCustomerAndOwnerOrReadOnly(permissions.BasePermission):
         return request.user and request.user.is_authenticated and request.user.role == User.Role.CUSTOMER
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:  return request.user and request.user.is_authenticated
-        return obj.user == request.user
+        return obj.user_id == request.user.pk
 
 # Vendor only have full access
 class IsVendorAndOwnerOrReadOnly(permissions.BasePermission):
@@ -29,7 +29,7 @@ class IsVendorAndOwnerOrReadOnly(permissions.BasePermission):
         return request.user and request.user.is_authenticated and request.user.role == User.Role.VENDOR
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:  return request.user and request.user.is_authenticated
-        return obj.user == request.user
+        return obj.user_id == request.user.pk
 
 # Address update
 class IsCustomerOrVendorAuthenticated(permissions.BasePermission):
@@ -40,7 +40,7 @@ class IsCustomerOrVendorAuthenticated(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return request.user and request.user.is_authenticated
-        return obj.user == request.user
+        return obj.user_id == request.user.pk
 
 # Admin can edit and add categories Vendor and Customers only view categories
 class IsVendorOrAdminAllOrReadOnly(permissions.BasePermission):
@@ -58,5 +58,6 @@ class IsProductOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return request.user and request.user.is_authenticated
-        return obj.product_vendor.user == request.user
+        # VendorProfile is keyed by the user id, so no join is needed
+        return obj.product_vendor_id == request.user.pk
     
@@ -0,0 +1,70 @@
+import csv
+import io
+import zlib
+from django.core.serializers.json import DjangoJSONEncoder
+
+EXPORT_CHUNK_SIZE = 2000
+# Output column to queryset lookup, the import columns read back by import_products come first
+EXPORT_COLUMNS = {
+    'product_category': 'product_category_id',
+    'product_name': 'product_name',
+    'product_image': 'product_image',
+    'product_description': 'product_description',
+    'product_specifications': 'product_specifications',
+    'product_stock': 'product_stock',
+    'product_price': 'product_price',
+    'product_discount': 'product_discount',
+    'product_availability': 'product_availability',
+    'slug': 'slug',
+    'product_vendor': 'product_vendor_id',
+    'product_price_after_discount': 'product_price_after_discount',
+    'product_created_at': 'product_created_at',
+    'product_updated_at': 'product_updated_at',
+}
+EXPORT_CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+
+
+#  Encode the products as CSV or NDJSON in chunks of bytes. Rows are read as tuples through a
+#  chunked iterator (a server-side cursor on Postgres), so memory use does not grow with the
+#  size of the catalog.
+def export_products(queryset, file_format, compress=False, chunk_size=EXPORT_CHUNK_SIZE):
+    rows = queryset.order_by('id').values_list(*EXPORT_COLUMNS.values()).iterator(chunk_size=chunk_size)
+    encode = encode_csv if file_format == 'csv' else encode_ndjson
+    chunks = encode(rows, chunk_size)
+    return gzip_chunks(chunks) if compress else chunks
+
+def encode_csv(rows, chunk_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for number, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if number % chunk_size == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+def encode_ndjson(rows, chunk_size):
+    encoder = DjangoJSONEncoder()
+    columns = list(EXPORT_COLUMNS)
+    lines = []
+    for row in rows:
+        lines.append(encoder.encode(dict(zip(columns, row))))
+        if len(lines) == chunk_size:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
+
+def gzip_chunks(chunks):
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_filename(file_format, compress=False):
+    return f"products.{file_format}{'.gz' if compress else ''}"
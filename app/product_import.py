@@ -0,0 +1,98 @@
+import csv
+import io
+import json
+from itertools import islice
+from django.db import IntegrityError, transaction
+from django.utils.text import slugify
+from .models import ProductCategory, ProductList
+from .serializers import ProductImportSerializer
+from .utils import UNIQUE_VALUE_SAVE_ATTEMPTS, allocate_unique_values
+
+IMPORT_BATCH_SIZE = 500
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+
+#  Read rows one at a time from a binary stream, CSV empty cells are left out so field defaults apply
+def read_rows(stream, file_format):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        for row in csv.DictReader(text):
+            yield {key: value for key, value in row.items() if key and value not in (None, '')}
+        return
+    for line in text:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # Passed on as is so the serializer reports it against its row number
+            yield line
+
+#  Streaming product importer, rows are validated and written one batch per transaction
+class ProductImporter:
+    def __init__(self, vendor, batch_size=IMPORT_BATCH_SIZE, max_errors=IMPORT_MAX_REPORTED_ERRORS):
+        self.vendor = vendor
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+
+    def run(self, rows):
+        report = {'processed': 0, 'created': 0, 'failed': 0, 'errors': [], 'errors_truncated': False}
+        numbered_rows = enumerate(rows, start=1)
+        while batch := list(islice(numbered_rows, self.batch_size)):
+            products = self.validate_batch(batch, report)
+            self.create_batch(products, report)
+            report['processed'] += len(batch)
+        return report
+
+    def validate_batch(self, batch, report):
+        category_slugs = {row.get('product_category') for _, row in batch if isinstance(row, dict)}
+        categories = ProductCategory.objects.in_bulk([slug for slug in category_slugs if isinstance(slug, str)], field_name='slug')
+        products = []
+        for number, row in batch:
+            serializer = ProductImportSerializer(data=row, context={'categories': categories})
+            if serializer.is_valid():
+                products.append((number, ProductList(product_vendor=self.vendor, **serializer.validated_data)))
+            else:
+                self.add_error(report, number, serializer.errors)
+        return products
+
+    def create_batch(self, products, report):
+        if not products:
+            return
+        instances = [product for _, product in products]
+        bases = [slugify(f"{self.vendor.company_name}-{product.product_name}") for product in instances]
+        for attempt in range(UNIQUE_VALUE_SAVE_ATTEMPTS):
+            for product, slug in zip(instances, allocate_unique_values(ProductList.objects.all(), 'slug', bases, '-')):
+                product.slug = slug
+            try:
+                with transaction.atomic():
+                    ProductList.objects.bulk_create(instances)
+            except IntegrityError:
+                if ProductList.objects.filter(slug__in=[product.slug for product in instances]).exists():
+                    # A concurrent writer took one of the slugs, allocate the batch again
+                    continue
+                # Another constraint failed, find the rows it failed for
+                self.create_rows(products, report)
+                return
+            report['created'] += len(instances)
+            return
+        for number, _ in products:
+            self.add_error(report, number, {'slug': ['Could not allocate a unique slug.']})
+
+    #  One transaction per row, rows failing a constraint are reported with the database's error
+    def create_rows(self, products, report):
+        for number, product in products:
+            try:
+                with transaction.atomic():
+                    ProductList.objects.bulk_create([product])
+            except IntegrityError as e:
+                self.add_error(report, number, {'non_field_errors': [str(e)]})
+            else:
+                report['created'] += 1
+
+    def add_error(self, report, number, errors):
+        report['failed'] += 1
+        if len(report['errors']) < self.max_errors:
+            report['errors'].append({'row': number, 'errors': errors})
+        else:
+            report['errors_truncated'] = True
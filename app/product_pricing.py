@@ -0,0 +1,87 @@
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Max, Min, Value, When
+from django.db.models.functions import Round
+from django.db.models.lookups import GreaterThan
+from django.utils import timezone
+
+REPRICE_PREVIEW_SIZE = 20
+# Range of product_price, a DecimalField(10, 2) that must stay above zero
+MIN_PRODUCT_PRICE = Decimal('0.01')
+MAX_PRODUCT_PRICE = Decimal('99999999.99')
+
+
+class PriceOutOfRange(Exception):
+    def __init__(self, lowest, highest):
+        self.lowest = lowest
+        self.highest = highest
+        super().__init__(
+            f"New prices would range from {lowest.quantize(MIN_PRODUCT_PRICE)} to {highest.quantize(MIN_PRODUCT_PRICE)}, "
+            f"prices must stay between {MIN_PRODUCT_PRICE} and {MAX_PRODUCT_PRICE}."
+        )
+
+#  Discounted price, used by the ProductList generated column and by repricing previews
+def price_after_discount_expression(price, discount):
+    return Case(
+        When(GreaterThan(discount, 0), then=Round(price - price * discount * Value(Decimal('0.01')), 2)),
+        default=Value(None),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+
+def filter_products(queryset, category=None, min_price=None, max_price=None, slugs=None):
+    if category is not None:
+        queryset = queryset.filter(product_category_id=category)
+    if min_price is not None:
+        queryset = queryset.filter(product_price__gte=min_price)
+    if max_price is not None:
+        queryset = queryset.filter(product_price__lte=max_price)
+    if slugs is not None:
+        queryset = queryset.filter(slug__in=slugs)
+    return queryset
+
+#  New price and discount expressions, fields left out of the change keep their current value
+def reprice_expressions(changes):
+    price = F('product_price')
+    if 'price' in changes:
+        price = Value(changes['price'], output_field=DecimalField(max_digits=10, decimal_places=2))
+    elif 'price_change_percent' in changes:
+        price = Round(price * Value(1 + changes['price_change_percent'] / Decimal(100)), 2)
+    discount = F('product_discount')
+    if 'discount' in changes:
+        discount = Value(changes['discount'], output_field=DecimalField(max_digits=4, decimal_places=2))
+    return price, discount
+
+#  A relative change can take prices to zero or past the column's digits, the lowest and highest
+#  new price are checked in one aggregate before anything is written
+def check_price_range(queryset, price):
+    # Unbounded decimals, an out of range value must be read back to be reported
+    bounds = queryset.aggregate(lowest=Min(price, output_field=DecimalField()), highest=Max(price, output_field=DecimalField()))
+    if bounds['lowest'] is None:
+        return
+    if bounds['lowest'] < MIN_PRODUCT_PRICE or bounds['highest'] > MAX_PRODUCT_PRICE:
+        raise PriceOutOfRange(bounds['lowest'], bounds['highest'])
+
+#  Reprice every matching product in a single UPDATE, the database recomputes the discounted price,
+#  or preview the result without writing. Raises PriceOutOfRange for a change that would leave
+#  a price outside the product price range.
+@transaction.atomic
+def reprice_products(queryset, changes, filters, dry_run=False):
+    queryset = filter_products(queryset, **filters)
+    price, discount = reprice_expressions(changes)
+    if 'price_change_percent' in changes:
+        check_price_range(queryset, price)
+    if dry_run:
+        price_after_discount = price_after_discount_expression(price, discount)
+        preview = (
+            queryset.annotate(new_price=price, new_discount=discount, new_price_after_discount=price_after_discount)
+            .order_by('id')
+            .values('slug', 'product_price', 'new_price', 'product_discount', 'new_discount', 'product_price_after_discount', 'new_price_after_discount')
+            [:REPRICE_PREVIEW_SIZE]
+        )
+        return {'dry_run': True, 'affected': queryset.count(), 'preview': list(preview)}
+    updated = queryset.update(
+        product_price=price,
+        product_discount=discount,
+        product_updated_at=timezone.now(),
+    )
+    return {'dry_run': False, 'affected': updated}
@@ -0,0 +1,210 @@
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+from .authentication import TokenUserAuthentication
+
+PROFILE_HEADER = 'X-Profile'
+# <time>_<view>_<trigger>_<milliseconds>ms.<pstats|collapsed>
+PROFILE_NAME = re.compile(r'^(?P<time>\d{8}T\d{6}\.\d{6})_(?P<view>[\w.-]+)_(?P<trigger>header|sample|slow)_(?P<ms>\d+)ms\.(?P<kind>pstats|collapsed)$')
+
+
+#  Opt-in profiling of single requests:
+#  - an admin sending `X-Profile: 1`, or a PROFILE_SAMPLE_RATE share of requests, runs under
+#    cProfile and is saved as a .pstats file
+#  - with PROFILE_SLOW_REQUEST_MS set, every request runs under the stack sampler and the
+#    collapsed stacks of the ones slower than that are saved as a .collapsed file
+#  Async requests always use the stack sampler on the event loop thread, cProfile would also
+#  pick up other tasks on the loop and only one profiler may run per thread. Work the request
+#  hands to sync_to_async threads does not show up in its stacks.
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        trigger = profile_trigger(request, request_user(request))
+        if trigger is not None:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            name = save_profile(request, trigger, time.perf_counter() - started, profiler)
+            if trigger == 'header':
+                response[PROFILE_HEADER] = name
+            return response
+        if not settings.PROFILE_SLOW_REQUEST_MS:
+            return self.get_response(request)
+        token = stack_sampler().start(threading.get_ident())
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            stacks = stack_sampler().stop(token)
+        return finish_sampled(request, response, None, time.perf_counter() - started, stacks)
+
+    async def __acall__(self, request):
+        user = await request.auser() if hasattr(request, 'auser') else None
+        if request.headers.get(PROFILE_HEADER):
+            # Authenticating the token may query the database, see check_token_version
+            trigger = await sync_to_async(profile_trigger)(request, user)
+        else:
+            trigger = profile_trigger(request, user)
+        if trigger is None and not settings.PROFILE_SLOW_REQUEST_MS:
+            return await self.get_response(request)
+        token = stack_sampler().start(threading.get_ident())
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stacks = stack_sampler().stop(token)
+        return finish_sampled(request, response, trigger, time.perf_counter() - started, stacks)
+
+def finish_sampled(request, response, trigger, elapsed, stacks):
+    if trigger is None and elapsed * 1000 >= settings.PROFILE_SLOW_REQUEST_MS:
+        trigger = 'slow'
+    if trigger is not None:
+        name = save_profile(request, trigger, elapsed, stacks)
+        # Only admins asking for a profile learn where it went
+        if trigger == 'header':
+            response[PROFILE_HEADER] = name
+    return response
+
+def request_user(request):
+    # Only read when the header asks for a profile, the session user costs a query
+    return request.user if request.headers.get(PROFILE_HEADER) and hasattr(request, 'user') else None
+
+#  Why this request is profiled, None when it is not
+def profile_trigger(request, user):
+    if request.headers.get(PROFILE_HEADER) and is_admin(request, user):
+        return 'header'
+    rate = settings.PROFILE_SAMPLE_RATE
+    if rate > 0 and random.random() < rate:
+        return 'sample'
+    return None
+
+#  Session admins and staff JWT bearers, the token is read from its claims like the API does
+def is_admin(request, user):
+    if user is not None and user.is_authenticated and user.is_staff:
+        return True
+    try:
+        result = TokenUserAuthentication().authenticate(request)
+    except APIException:
+        return False
+    return result is not None and result[0].is_staff
+
+#  One thread samples the stacks of every registered request thread each
+#  PROFILE_SAMPLE_INTERVAL seconds and counts them by collapsed stack
+class StackSampler:
+    def __init__(self, interval):
+        self.interval = interval
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self, thread_id):
+        token = object()
+        with self.lock:
+            self.requests[token] = (thread_id, Counter())
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='stack-sampler', daemon=True)
+                self.thread.start()
+        return token
+
+    def stop(self, token):
+        with self.lock:
+            return self.requests.pop(token)[1]
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                requests = list(self.requests.values())
+            if not requests:
+                continue
+            frames = sys._current_frames()
+            for thread_id, stacks in requests:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stack = collapse_stack(frame)
+                    with self.lock:
+                        stacks[stack] += 1
+
+def collapse_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+# A forked worker starts its own sampler thread
+def _reset_after_fork():
+    global _sampler, _sampler_lock
+    _sampler, _sampler_lock = None, threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def stack_sampler():
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                _sampler = StackSampler(settings.PROFILE_SAMPLE_INTERVAL)
+    return _sampler
+
+#  Write a cProfile profile or sampled stacks under PROFILE_ROOT, returns the file name
+def save_profile(request, trigger, elapsed, profile):
+    match = getattr(request, 'resolver_match', None)
+    view = re.sub(r'[^\w.-]', '-', match.view_name if match else 'unresolved')
+    kind = 'pstats' if isinstance(profile, cProfile.Profile) else 'collapsed'
+    name = f"{timezone.now():%Y%m%dT%H%M%S.%f}_{view}_{trigger}_{round(elapsed * 1000)}ms.{kind}"
+    os.makedirs(settings.PROFILE_ROOT, exist_ok=True)
+    path = os.path.join(settings.PROFILE_ROOT, name)
+    if kind == 'pstats':
+        profile.dump_stats(path)
+    else:
+        with open(path, 'w') as output:
+            output.writelines(f'{stack} {count}\n' for stack, count in profile.items())
+    prune_profiles()
+    return name
+
+#  Keep the newest PROFILE_MAX_FILES profiles
+def prune_profiles():
+    names = sorted(name for name in os.listdir(settings.PROFILE_ROOT) if PROFILE_NAME.match(name))
+    for name in names[:-settings.PROFILE_MAX_FILES]:
+        try:
+            os.remove(os.path.join(settings.PROFILE_ROOT, name))
+        except FileNotFoundError:
+            pass
+
+#  Stored profiles as (match, path), optionally for one view only
+def stored_profiles(view=None):
+    if not os.path.isdir(settings.PROFILE_ROOT):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(settings.PROFILE_ROOT)):
+        match = PROFILE_NAME.match(name)
+        if match and (view is None or match['view'] == view):
+            profiles.append((match, os.path.join(settings.PROFILE_ROOT, name)))
+    return profiles
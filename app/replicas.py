@@ -0,0 +1,156 @@
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import SAFE_METHODS
+from .authentication import TokenUserAuthentication
+from .cache import cache_is_shared
+
+# The replica the current request reads from, set by ReplicaReadMixin once it picked one,
+# so a request never mixes replicas
+_replica_reads = ContextVar('replica_reads', default=None)
+
+# Replicas that failed their health check, by alias, are skipped until the given monotonic time
+_unhealthy = {}
+_unhealthy_lock = threading.Lock()
+
+# A lock another thread held at the fork would never be released in the child
+def _reset_after_fork():
+    global _unhealthy_lock
+    _unhealthy_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def pin_key(user_id):
+    return f'db:pin:{user_id}'
+
+#  Users who just wrote read their own writes from the primary for DATABASE_REPLICA_PIN_SECONDS.
+#  Pins reach every worker through a shared cache. With a per process cache the user's next
+#  request may land on a worker that never saw the pin, so signed-in users always read from
+#  the primary and only anonymous reads go to the replicas.
+def pin_to_primary(user_id):
+    cache.set(pin_key(user_id), 1, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+def pinned_to_primary(user_id):
+    if user_id is None:
+        return False
+    return not cache_is_shared() or cache.get(pin_key(user_id)) is not None
+
+#  Picks the replica for a request and returns it, or None when the request reads from the
+#  primary. Async views run this on a worker thread, it checks the cache and the replica's
+#  connection, and stop it from the event loop, so the context variable is cleared rather
+#  than reset to a token of the worker thread's context.
+def start_replica_reads(request):
+    if not settings.DATABASE_REPLICAS or request.method not in SAFE_METHODS:
+        return None
+    if pinned_to_primary(getattr(request.user, 'pk', None)):
+        return None
+    alias = choose_replica()
+    _replica_reads.set(alias)
+    return alias
+
+def stop_replica_reads(alias):
+    if alias is not None:
+        _replica_reads.set(None)
+
+#  Reads inside go to the primary, for results that outlive the request such as cache fills
+@contextmanager
+def primary_reads():
+    token = _replica_reads.set(None)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+#  A random healthy replica, or None when every replica is down. Django checks persistent
+#  connections with CONN_HEALTH_CHECKS, this check opens the connection so a replica that is
+#  down is caught before the request's first query.
+def choose_replica():
+    now = time.monotonic()
+    with _unhealthy_lock:
+        candidates = [alias for alias in settings.DATABASE_REPLICAS if _unhealthy.get(alias, 0) <= now]
+    random.shuffle(candidates)
+    for alias in candidates:
+        if replica_healthy(alias):
+            return alias
+    return None
+
+def replica_healthy(alias):
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError:
+        with _unhealthy_lock:
+            _unhealthy[alias] = time.monotonic() + settings.DATABASE_REPLICA_RETRY_SECONDS
+        return False
+    return True
+
+#  Reads go to a replica only inside a request that ReplicaReadMixin marked for it, and never
+#  inside a transaction on the primary. Everything else, including every write, uses default.
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = _replica_reads.get()
+        if alias is None or connections['default'].in_atomic_block:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+#  Pins the user of every successful unsafe request to the primary. JWT users are read from
+#  the token claims, the API authenticates them inside the view where middleware cannot see it.
+class ReadYourWritesMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if wrote(request, response):
+            user = getattr(request, 'user', None)
+            pin_writer(request, user.pk if user is not None and user.is_authenticated else None)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if wrote(request, response):
+            user = await request.auser() if hasattr(request, 'auser') else None
+            # Authenticating the token may query the database, see check_token_version
+            await sync_to_async(pin_writer)(request, user.pk if user is not None and user.is_authenticated else None)
+        return response
+
+def wrote(request, response):
+    return settings.DATABASE_REPLICAS and request.method not in SAFE_METHODS and response.status_code < 400
+
+def pin_writer(request, user_id):
+    if not cache_is_shared():
+        # Nothing to pin, see pinned_to_primary
+        return
+    if user_id is None:
+        try:
+            result = TokenUserAuthentication().authenticate(request)
+        except APIException:
+            result = None
+        user_id = result[0].pk if result is not None else None
+    if user_id is not None:
+        pin_to_primary(user_id)
@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import random
+import socket
+import statistics
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+METRICS_PROCESSES_KEY = 'request-metrics:processes'
+METRICS_PROCESS_KEY = f'request-metrics:{socket.gethostname()}:{os.getpid()}'
+
+_current = ContextVar('request_metrics', default=None)
+
+
+#  Query count, SQL time, repeated statements and serializer time of one request
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.serializer_time = 0.0
+        self.serializing = False
+
+    #  execute_wrapper hook, statements are counted without their parameters so N+1 loops add up
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+    def repeated_statements(self):
+        threshold = settings.REQUEST_METRICS_DUPLICATE_THRESHOLD
+        return [(sql, count) for sql, count in self.statements.most_common(3) if count >= threshold]
+
+#  Serializer time, taken by TimedSerializerMixin around to_representation. A nested
+#  serializer runs inside its parent and is only counted once.
+def timed_representation(represent, instance):
+    metrics = _current.get()
+    if metrics is None or metrics.serializing:
+        return represent(instance)
+    metrics.serializing = True
+    started = time.perf_counter()
+    try:
+        return represent(instance)
+    finally:
+        metrics.serializer_time += time.perf_counter() - started
+        metrics.serializing = False
+
+#  Samples a share of the requests, REQUEST_METRICS_SAMPLE_RATE, and reports their SQL and
+#  serializer cost in a Server-Timing header and a JSON log line. Requests left out of the
+#  sample only pay for a random number.
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not sampled():
+            return self.get_response(request)
+        metrics, started = RequestMetrics(), time.perf_counter()
+        with measure(metrics):
+            response = self.get_response(request)
+        finish(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not sampled():
+            return await self.get_response(request)
+        metrics, started = RequestMetrics(), time.perf_counter()
+        with measure(metrics):
+            response = await self.get_response(request)
+        finish(request, response, metrics, time.perf_counter() - started)
+        return response
+
+def sampled():
+    rate = settings.REQUEST_METRICS_SAMPLE_RATE
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+@contextmanager
+def measure(metrics):
+    token = _current.set(metrics)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            yield metrics
+    finally:
+        _current.reset(token)
+
+def finish(request, response, metrics, elapsed):
+    match = getattr(request, 'resolver_match', None)
+    view = f'{request.method} {match.view_name if match else "unresolved"}'
+    sample = {
+        'total_ms': round(elapsed * 1000, 2),
+        'db_ms': round(metrics.db_time * 1000, 2),
+        'queries': metrics.queries,
+        'duplicates': metrics.duplicates,
+        'serializer_ms': round(metrics.serializer_time * 1000, 2),
+    }
+    if settings.REQUEST_METRICS_SERVER_TIMING:
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={sample["db_ms"]};desc="{metrics.queries} queries, {metrics.duplicates} repeated"',
+            f'serializer;dur={sample["serializer_ms"]}',
+            f'total;dur={sample["total_ms"]}',
+        ])
+    log = {'view': view, 'path': request.path, 'status': response.status_code, **sample}
+    repeated = metrics.repeated_statements()
+    if repeated:
+        # Likely an N+1 query, one statement run once per row
+        log['repeated'] = [{'sql': sql[:300], 'count': count} for sql, count in repeated]
+        logger.warning(json.dumps(log))
+    else:
+        logger.info(json.dumps(log))
+    record(view, sample)
+
+#  Rolling window of the latest samples per view. Each process keeps its own and publishes it
+#  to the cache now and then, so the summary covers every worker sharing the cache.
+_windows = defaultdict(lambda: deque(maxlen=settings.REQUEST_METRICS_WINDOW))
+_windows_lock = threading.Lock()
+_published_at = 0.0
+
+#  A forked worker publishes its own samples under its own pid
+def _reset_after_fork():
+    global METRICS_PROCESS_KEY, _windows_lock, _published_at
+    METRICS_PROCESS_KEY = f'request-metrics:{socket.gethostname()}:{os.getpid()}'
+    _windows.clear()
+    _windows_lock = threading.Lock()
+    _published_at = 0.0
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def record(view, sample):
+    global _published_at
+    with _windows_lock:
+        _windows[view].append(sample)
+        if time.monotonic() - _published_at < settings.REQUEST_METRICS_PUBLISH_INTERVAL:
+            return
+        _published_at = time.monotonic()
+        snapshot = {view: list(samples) for view, samples in _windows.items()}
+    timeout = settings.REQUEST_METRICS_PUBLISH_INTERVAL * 30
+    cache.set(METRICS_PROCESS_KEY, snapshot, timeout)
+    # The registry is a read-modify-write without a lock, two processes registering at once
+    # can drop one of them, and so can the pruning in metrics_summary. Every publish checks
+    # the registry again, so a dropped process is back after one publish interval.
+    processes = cache.get(METRICS_PROCESSES_KEY, set())
+    if METRICS_PROCESS_KEY not in processes:
+        cache.set(METRICS_PROCESSES_KEY, processes | {METRICS_PROCESS_KEY}, None)
+
+#  Percentiles per view over the windows of every process that published recently
+def metrics_summary():
+    with _windows_lock:
+        windows = {METRICS_PROCESS_KEY: {view: list(samples) for view, samples in _windows.items()}}
+    processes = cache.get(METRICS_PROCESSES_KEY, set()) - {METRICS_PROCESS_KEY}
+    published = cache.get_many(list(processes))
+    windows.update(published)
+    if len(published) < len(processes):
+        # Forget processes that stopped publishing
+        cache.set(METRICS_PROCESSES_KEY, set(published) | {METRICS_PROCESS_KEY}, None)
+
+    samples_by_view = defaultdict(list)
+    for window in windows.values():
+        for view, samples in window.items():
+            samples_by_view[view].extend(samples)
+    return {
+        'processes': len(windows),
+        'sample_rate': settings.REQUEST_METRICS_SAMPLE_RATE,
+        'views': {view: summarize(samples) for view, samples in sorted(samples_by_view.items())},
+    }
+
+def summarize(samples):
+    def percentiles(key):
+        values = [sample[key] for sample in samples]
+        if len(values) == 1:
+            return {'p50': values[0], 'p95': values[0], 'p99': values[0]}
+        quantiles = statistics.quantiles(values, n=100, method='inclusive')
+        return {'p50': round(quantiles[49], 2), 'p95': round(quantiles[94], 2), 'p99': round(quantiles[98], 2)}
+    return {
+        'samples': len(samples),
+        'total_ms': percentiles('total_ms'),
+        'db_ms': percentiles('db_ms'),
+        'serializer_ms': percentiles('serializer_ms'),
+        'queries': percentiles('queries'),
+        'max_repeated_queries': max(sample['duplicates'] for sample in samples),
+    }
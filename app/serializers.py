@@ -1,11 +1,161 @@
-from rest_framework import serializers
-from .models import User, CustomerProfile, VendorProfile, UserAddress, ProductCategory, ProductList
-from django.contrib.auth import password_validation
-from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import exceptions, serializers
+from phonenumber_field.serializerfields import PhoneNumberField
+from django.core.files.storage import default_storage
+from django.conf import settings
+from .models import User, CustomerProfile, VendorProfile, UserAddress, ProductCategory, ProductList, StockReservation, StockReservationItem
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from .authentication import TOKEN_VERSION_CLAIM, bump_token_version, password_pool_was_busy
+from .passwords import PasswordPoolBusy, hash_password, password_errors, verify_password
+from .request_metrics import timed_representation
+from .images import IMAGE_FORMATS, ImageProcessingError, open_image, stage_images, variants_field_name
+from .stock import InsufficientStock, reserve_stock
+from .utils import FILE_FORMATS, detect_file_format
+
+
+#  URLs of the image variants kept by the image pipeline
+class ImageVariantsField(serializers.ReadOnlyField):
+    def to_representation(self, value):
+        request = self.context.get('request')
+        urls = {}
+        for key, name in (value or {}).items():
+            url = default_storage.url(name)
+            urls[key] = request.build_absolute_uri(url) if request is not None else url
+        return urls
+
+#  Uploads to `staged_image_fields` are staged and processed in the background, the instance
+#  shows its new image and variants once the image pipeline is done
+class StagedImagesMixin:
+    staged_image_fields = ()
+
+    #  Uploads get the checks of the image pipeline here, a new instance is saved without its
+    #  image until the worker has processed it, so the worker must not find it invalid
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        for field in self.staged_image_fields:
+            upload = attrs.get(field)
+            if not upload:
+                continue
+            if getattr(upload, 'image', None) is not None and upload.image.format not in IMAGE_FORMATS:
+                raise serializers.ValidationError({field: 'Upload a JPEG, PNG or WebP image.'})
+            upload.seek(0)
+            try:
+                open_image(upload.read())
+            except ImageProcessingError as e:
+                raise serializers.ValidationError({field: str(e)})
+            finally:
+                upload.seek(0)
+        return attrs
+
+    def pop_staged_images(self, validated_data):
+        uploads = {}
+        for field in self.staged_image_fields:
+            if field not in validated_data:
+                continue
+            if validated_data[field]:
+                uploads[field] = validated_data.pop(field)
+            else:
+                # Clearing an image clears its variants too
+                validated_data[variants_field_name(field)] = {}
+        return uploads
+
+    def create(self, validated_data):
+        uploads = self.pop_staged_images(validated_data)
+        instance = super().create(validated_data)
+        stage_images(instance, uploads)
+        return instance
+
+    def update(self, instance, validated_data):
+        uploads = self.pop_staged_images(validated_data)
+        instance = super().update(instance, validated_data)
+        stage_images(instance, uploads)
+        return instance
+
+#  Counts the representation of a response serializer toward the request's serializer time,
+#  rows listed with values() included, see SparseFieldsMixin.represent_rows
+class TimedSerializerMixin:
+    def to_representation(self, instance):
+        return timed_representation(super().to_representation, instance)
+
+    def represent_rows(self, rows):
+        return timed_representation(super().represent_rows, rows)
+
+#  Sparse fieldsets for reads, `?fields=a,b` keeps only the named fields and `?omit=a,b` drops
+#  them. List responses leave out `list_omit` unless they are asked for by name. Views load
+#  only the `values_columns` of the remaining fields.
+class SparseFieldsMixin:
+    list_omit = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None and request.method in ('GET', 'HEAD'):
+            keep = self.sparse_field_names(request, self.context.get('listing', False))
+            for name in list(self.fields):
+                if name not in keep:
+                    self.fields.pop(name)
+
+    def sparse_field_names(self, request, listing=False):
+        readable = [name for name, field in self.fields.items() if not field.write_only]
+        def requested(param):
+            value = request.query_params.get(param)
+            if value is None:
+                return None
+            names = [name.strip() for name in value.split(',') if name.strip()]
+            unknown = [name for name in names if name not in readable]
+            if unknown:
+                raise serializers.ValidationError({param: [f"Unknown fields: {', '.join(unknown)}."]})
+            return set(names)
+        wanted, omitted = requested('fields'), requested('omit') or set()
+        if wanted is None:
+            wanted = set(readable) - set(self.list_omit if listing else ())
+        return [name for name in readable if name in wanted and name not in omitted]
+
+    def values_columns(self):
+        return [field.source for field in self.fields.values() if not field.write_only]
+
+    #  Render rows read with values(columns) without building model instances. File fields hold
+    #  storage names there and relations their key, which must be the value the field renders.
+    #  Model fields without a serializer counterpart pass through.
+    def represent_rows(self, rows):
+        request = self.context.get('request')
+        def file_url(name):
+            url = default_storage.url(name)
+            return request.build_absolute_uri(url) if request is not None else url
+        plan = []
+        for name, field in self.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.FileField):
+                convert = file_url
+            elif isinstance(field, (serializers.RelatedField, serializers.ModelField)):
+                convert = None
+            else:
+                convert = field.to_representation
+            plan.append((name, field.source, convert))
+        rendered = []
+        for row in rows:
+            item = {}
+            for name, source, convert in plan:
+                value = row[source]
+                item[name] = value if value in (None, '') or convert is None else convert(value)
+            rendered.append(item)
+        return rendered
+
+#  Updates write the submitted fields only, so an edit cannot put back a column that changed
+#  since the instance was read, like a product_stock taken by a reservation in the meantime
+class SubmittedFieldsUpdateMixin:
+    def update(self, instance, validated_data):
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        auto_now_fields = [f.name for f in instance._meta.concrete_fields if getattr(f, 'auto_now', False)]
+        instance.save(update_fields=[*validated_data, *auto_now_fields])
+        return instance
 
 
 #  Craete user serializer
-class CreateUserSerializer(serializers.ModelSerializer):
+class CreateUserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     password = serializers.CharField(style={'input_type': 'password'}, write_only=True, min_length=8, required=True, help_text='Password must be at least 8 characters and contain an uppercase letter, a lowercase letter, a number, and a special character.')
     password2 = serializers.CharField(style={'input_type': 'password'}, write_only=True, min_length=8, required=True, help_text="Please confirm your password.")
     username = serializers.CharField(read_only=True)
@@ -29,15 +179,19 @@ class CreateUserSerializer(serializers.ModelSerializer):
         if self.instance and attrs.get('role') and attrs['role'] != self.instance.role:
             raise serializers.ValidationError({'role': 'The user role cannot be changed after creation.'})
 
-        try:
-            password_validation.validate_password(attrs['password'], user=self.instance)
-        except DjangoValidationError as e:
-            raise serializers.ValidationError({'password': list(e.messages)})
+        # Async views run the password checks on the pool themselves
+        if not self.context.get('defer_password_checks'):
+            errors = password_errors(attrs['password'], user=self.instance)
+            if errors:
+                raise serializers.ValidationError({'password': errors})
         return attrs
 
     def create(self, validated_data):
         validated_data.pop('password2')
-        user = User.objects.create_user(**validated_data)
+        password = validated_data.pop('password')
+        # Async views pass a hash computed on the pool to save()
+        password_hash = validated_data.pop('password_hash', None) or hash_password(password)
+        user = User.objects.create_user(password_hash=password_hash, **validated_data)
         return user
 
 #  Change password serializer
@@ -46,35 +200,44 @@ class ChangeUserPasswordSerializer(serializers.Serializer):
     new_password = serializers.CharField(style={'input_type': 'password'}, write_only=True, required=True, min_length=8, help_text='New password must be at least 8 characters and contain an uppercase letter, a lowercase letter, a number, and a special character.')
     new_password2 = serializers.CharField(style={'input_type': 'password'}, write_only=True, required=True, min_length=8, help_text="Please confirm your new password.")
 
+    OLD_PASSWORD_INCORRECT = 'Old password is incorrect.'
+
+    # The comparisons run first so that mismatched input never reaches the password pool
     def validate(self, attrs):
         old_password = attrs.get('old_password')
         new_password = attrs.get('new_password')
-        if not self.instance.check_password(old_password):
-            raise serializers.ValidationError({'old_password': 'Old password is incorrect.'})
-        elif attrs['new_password'] != attrs['new_password2']:
+        if attrs['new_password'] != attrs['new_password2']:
             raise serializers.ValidationError({'new_password2': 'New passwords do not match.'})
         elif old_password == attrs['new_password']:
             raise serializers.ValidationError({'new_password': 'New password cannot be the same as the old password.'})
-        try:
-            password_validation.validate_password(new_password, user=self.instance)
-        except DjangoValidationError as e:
-            raise serializers.ValidationError({'new_password': list(e.messages)})
+        # Async views run the password checks on the pool themselves
+        if self.context.get('defer_password_checks'):
+            return attrs
+        correct, _ = verify_password(old_password, self.instance.password)
+        if not correct:
+            raise serializers.ValidationError({'old_password': self.OLD_PASSWORD_INCORRECT})
+        errors = password_errors(new_password, user=self.instance)
+        if errors:
+            raise serializers.ValidationError({'new_password': errors})
         return attrs
     def update(self, instance, validated_data):
-        instance.set_password(validated_data['new_password'])
+        instance.password = validated_data.get('password_hash') or hash_password(validated_data['new_password'])
         instance.save()
+        bump_token_version(instance)
         return instance
 
 #  User profile serializer
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'email', 'username', 'role']
         read_only_fields = ['id','username', 'role']
 
 #  Customer profile serializer
-class CustomerProfileSerializer(serializers.ModelSerializer):
+class CustomerProfileSerializer(TimedSerializerMixin, StagedImagesMixin, serializers.ModelSerializer):
     age = serializers.IntegerField(read_only=True)
+    profile_pic_variants = ImageVariantsField()
+    staged_image_fields = ('profile_pic',)
 
     class Meta:
         model = CustomerProfile
@@ -82,31 +245,50 @@ class CustomerProfileSerializer(serializers.ModelSerializer):
         read_only_fields = ['user']
 
 #  Vendor profile serializer
-class VendorProfileSerializer(serializers.ModelSerializer):
+class VendorProfileSerializer(TimedSerializerMixin, StagedImagesMixin, serializers.ModelSerializer):
+    logo_variants = ImageVariantsField()
+    staged_image_fields = ('logo',)
+
     class Meta:
         model = VendorProfile
         fields = '__all__'
         read_only_fields = ['user']
 
 # User address
-class UserAddressSerializer(serializers.ModelSerializer):
+class UserAddressSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = UserAddress
         fields = '__all__'
 
 #  Category serializer
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedSerializerMixin, StagedImagesMixin, serializers.ModelSerializer):
+    category_image_variants = ImageVariantsField()
+    staged_image_fields = ('category_image',)
+
     class Meta:
         model = ProductCategory 
         fields = '__all__'
         read_only_fields = ['slug']
 
 #  Product serializer
-class ProductListSerializer(serializers.ModelSerializer):
+class ProductListSerializer(TimedSerializerMixin, SparseFieldsMixin, StagedImagesMixin, SubmittedFieldsUpdateMixin, serializers.ModelSerializer):
+    product_image_variants = ImageVariantsField()
+    # Generated column, declared so it renders as a decimal string like the other prices
+    product_price_after_discount = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    staged_image_fields = ('product_image',)
+    # Long texts the catalog pages do not show
+    list_omit = ('product_description', 'product_specifications')
+
     class Meta:
         model = ProductList
-        fields = '__all__'
-        read_only_fields = ['slug', 'product_price_after_discount', 'product_created_at', 'product_updated_at']
+        exclude = ['search_vector']
+        read_only_fields = ['slug', 'product_created_at', 'product_updated_at']
+
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        # The database computes the discounted price from the saved price and discount
+        instance.refresh_from_db(fields=['product_price_after_discount'])
+        return instance
 
     def validate_product_name(self, value):
         if len(value)<3:
@@ -121,8 +303,252 @@ class ProductListSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Product price must be greater than zero.")
         return value
     def validate_product_discount(self, value):
+        if value is None:
+            return value
+        if value <= 0:
+            raise serializers.ValidationError("Product discount must be greater than zero.")
+        elif value >= 100:
+            raise serializers.ValidationError("Product discount must be less than 100.")
+        return value
+
+#  Product import row serializer, categories are resolved from a per-batch lookup in the context
+class ProductImportSerializer(ProductListSerializer):
+    product_category = serializers.SlugField(max_length=255)
+    product_image = serializers.CharField(max_length=100, help_text="Name of an image already uploaded to media storage.")
+    staged_image_fields = ()
+
+    class Meta:
+        model = ProductList
+        fields = ['product_category', 'product_name', 'product_image', 'product_description', 'product_specifications', 'product_stock', 'product_price', 'product_discount', 'product_availability']
+
+    def validate_product_category(self, value):
+        category = self.context['categories'].get(value)
+        if category is None:
+            raise serializers.ValidationError("Category does not exist.")
+        return category
+
+#  One account of a provisioning file. Only the row itself is checked here, taken emails and
+#  company names are found for the whole batch when it is written.
+class ProvisionUserSerializer(serializers.Serializer):
+    VENDOR_FIELDS = ('company_name', 'business_registration_number', 'gst_id', 'phone_number', 'website')
+    CUSTOMER_FIELDS = ('phone_number', 'date_of_birth', 'gender')
+    ADDRESS_FIELDS = ('country', 'state', 'city', 'door_number', 'street', 'pincode')
+
+    email = serializers.EmailField(max_length=254)
+    role = serializers.ChoiceField(choices=CreateUserSerializer.USER_ROLE_CHOICES)
+    password = serializers.CharField(required=False, max_length=128, help_text="Left out, the account gets an unusable password.")
+    company_name = serializers.CharField(required=False, max_length=255)
+    business_registration_number = serializers.CharField(required=False, max_length=255)
+    gst_id = serializers.CharField(required=False, max_length=255)
+    phone_number = PhoneNumberField(required=False)
+    website = serializers.URLField(required=False, max_length=200)
+    date_of_birth = serializers.DateField(required=False)
+    gender = serializers.ChoiceField(choices=CustomerProfile.Gender.choices, required=False)
+    country = serializers.CharField(required=False, max_length=50)
+    state = serializers.CharField(required=False, max_length=100)
+    city = serializers.CharField(required=False, max_length=100)
+    door_number = serializers.CharField(required=False, max_length=100)
+    street = serializers.CharField(required=False, max_length=100)
+    pincode = serializers.CharField(required=False, max_length=10)
+
+    def validate_email(self, value):
+        return User.objects.normalize_email(value)
+
+    def validate(self, attrs):
+        if attrs['role'] == User.Role.VENDOR:
+            required = ('company_name', 'business_registration_number', 'gst_id', 'phone_number')
+        else:
+            required = ('phone_number',)
+        missing = {field: ['This field is required.'] for field in required if field not in attrs}
+        if missing:
+            raise serializers.ValidationError(missing)
+        return attrs
+
+#  Product file upload serializer
+class ProductFileSerializer(serializers.Serializer):
+    file = serializers.FileField(help_text="CSV or NDJSON file.")
+    file_format = serializers.ChoiceField(choices=FILE_FORMATS, required=False, help_text="Defaults to the file extension.")
+
+    def validate(self, attrs):
+        attrs['file_format'] = detect_file_format(attrs['file'].name, attrs.get('file_format'))
+        if attrs['file_format'] is None:
+            raise serializers.ValidationError({'file_format': 'Could not detect the file format, choose csv or ndjson.'})
+        return attrs
+
+#  Product export query parameters
+class ProductExportSerializer(serializers.Serializer):
+    file_format = serializers.ChoiceField(choices=FILE_FORMATS, default='csv')
+    gzip = serializers.BooleanField(default=False, help_text="Compress the file with gzip.")
+
+#  Bulk repricing serializer, filters pick the vendor's products and changes describe the new prices
+class ProductRepriceSerializer(serializers.Serializer):
+    FILTER_FIELDS = ('category', 'min_price', 'max_price', 'slugs')
+    CHANGE_FIELDS = ('price', 'price_change_percent', 'discount')
+
+    category = serializers.SlugField(max_length=255, required=False, help_text="Only products in this category.")
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, help_text="Only products priced at or above this value.")
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, help_text="Only products priced at or below this value.")
+    slugs = serializers.ListField(child=serializers.SlugField(max_length=255), required=False, allow_empty=False, max_length=1000, help_text="Only these products.")
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, help_text="New price.")
+    price_change_percent = serializers.DecimalField(max_digits=5, decimal_places=2, required=False, help_text="Relative price change, -10 lowers prices by 10%.")
+    discount = serializers.DecimalField(max_digits=4, decimal_places=2, required=False, allow_null=True, help_text="New discount, null removes the discount.")
+    dry_run = serializers.BooleanField(default=False, help_text="Return the affected count and a preview without saving.")
+
+    def validate_price(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Product price must be greater than zero.")
+        return value
+    def validate_price_change_percent(self, value):
+        if value <= -100:
+            raise serializers.ValidationError("Price change must be greater than -100.")
+        return value
+    def validate_discount(self, value):
+        if value is None:
+            return value
         if value <= 0:
             raise serializers.ValidationError("Product discount must be greater than zero.")
         elif value >= 100:
             raise serializers.ValidationError("Product discount must be less than 100.")
-        return value
\ No newline at end of file
+        return value
+
+    def validate(self, attrs):
+        if 'price' in attrs and 'price_change_percent' in attrs:
+            raise serializers.ValidationError({'price_change_percent': 'Give either a new price or a price change, not both.'})
+        if not any(field in attrs for field in self.CHANGE_FIELDS):
+            raise serializers.ValidationError('Give a new price, price change or discount.')
+        if 'min_price' in attrs and 'max_price' in attrs and attrs['min_price'] > attrs['max_price']:
+            raise serializers.ValidationError({'max_price': 'Maximum price must not be lower than minimum price.'})
+        return attrs
+
+#  Preview row of a repricing dry run, prices render as decimal strings like in product responses
+class RepricePreviewSerializer(TimedSerializerMixin, serializers.Serializer):
+    slug = serializers.SlugField()
+    product_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    new_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    product_discount = serializers.DecimalField(max_digits=4, decimal_places=2)
+    new_discount = serializers.DecimalField(max_digits=4, decimal_places=2)
+    product_price_after_discount = serializers.DecimalField(max_digits=10, decimal_places=2)
+    new_price_after_discount = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+#  Product facets, bucket bounds render as decimal strings like the prices they bound
+class PriceBucketSerializer(serializers.Serializer):
+    min = serializers.DecimalField(max_digits=10, decimal_places=2)
+    max = serializers.DecimalField(max_digits=10, decimal_places=2, allow_null=True)
+    count = serializers.IntegerField()
+
+class ProductFacetsSerializer(TimedSerializerMixin, serializers.Serializer):
+    categories = serializers.DictField(child=serializers.IntegerField())
+    price_buckets = PriceBucketSerializer(many=True)
+
+#  Reservation items name products by slug, all of them are looked up in one query
+class StockReservationItemSerializer(serializers.ModelSerializer):
+    product = serializers.SlugField(source='product.slug', max_length=255)
+    quantity = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        model = StockReservationItem
+        fields = ['product', 'quantity']
+
+class StockReservationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    items = StockReservationItemSerializer(many=True, allow_empty=False, max_length=settings.STOCK_RESERVATION_MAX_ITEMS)
+
+    class Meta:
+        model = StockReservation
+        fields = ['id', 'status', 'expires_at', 'created_at', 'items']
+        read_only_fields = ['status', 'expires_at', 'created_at']
+
+    def validate_items(self, items):
+        slugs = [item['product']['slug'] for item in items]
+        if len(set(slugs)) != len(slugs):
+            raise serializers.ValidationError("Each product can only be listed once.")
+        products = ProductList.objects.only('pk', 'slug').in_bulk(slugs, field_name='slug')
+        missing = [slug for slug in slugs if slug not in products]
+        if missing:
+            raise serializers.ValidationError(f"Unknown products: {', '.join(missing)}.")
+        return [{'product': products[item['product']['slug']], 'quantity': item['quantity']} for item in items]
+
+    def create(self, validated_data):
+        products = {item['product'].pk: item['product'] for item in validated_data['items']}
+        try:
+            reservation = reserve_stock(
+                self.context['request'].user.pk,
+                {item['product'].pk: item['quantity'] for item in validated_data['items']},
+            )
+        except InsufficientStock as e:
+            raise serializers.ValidationError({'items': [f"Not enough stock for {products[e.product_id].slug}."]})
+        return reservation
+
+#  Product added to the cart, by slug
+class CartItemSerializer(serializers.Serializer):
+    product = serializers.SlugField(max_length=255)
+    quantity = serializers.IntegerField(min_value=1, max_value=settings.CART_MAX_QUANTITY, default=1)
+
+    def validate(self, attrs):
+        product_id = ProductList.objects.filter(slug=attrs['product'], product_availability=True).values_list('pk', flat=True).first()
+        if product_id is None:
+            raise serializers.ValidationError({'product': 'No available product with this slug.'})
+        attrs['product_id'] = product_id
+        return attrs
+
+#  New quantity of a product in the cart, 0 removes it
+class CartQuantitySerializer(serializers.Serializer):
+    quantity = serializers.IntegerField(min_value=0, max_value=settings.CART_MAX_QUANTITY)
+
+class CartLineSerializer(serializers.Serializer):
+    product = serializers.SlugField()
+    product_name = serializers.CharField()
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    quantity = serializers.IntegerField()
+    line_total = serializers.DecimalField(max_digits=12, decimal_places=2)
+    available = serializers.BooleanField(help_text="False when the product is unavailable or short of stock.")
+
+#  Cart contents priced at the current discounted prices
+class CartSerializer(TimedSerializerMixin, serializers.Serializer):
+    items = CartLineSerializer(many=True)
+    item_count = serializers.IntegerField()
+    total = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+#  Login serializer, the claims let TokenUserAuthentication skip the user lookup. A login the
+#  backend failed because the password pool was full is answered with PasswordPoolBusy's 503.
+class UserTokenObtainPairSerializer(TokenObtainPairSerializer):
+    def validate(self, attrs):
+        try:
+            return super().validate(attrs)
+        except exceptions.AuthenticationFailed:
+            if password_pool_was_busy(self.context.get('request')):
+                raise PasswordPoolBusy()
+            raise
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        set_user_claims(token, user)
+        return token
+
+def set_user_claims(token, user):
+    token['role'] = user.role
+    token['is_active'] = user.is_active
+    token['is_staff'] = user.is_staff
+    token['is_superuser'] = user.is_superuser
+    token[TOKEN_VERSION_CLAIM] = user.token_version
+
+#  Token refresh serializer, refresh tokens issued before a password change are rejected. The
+#  claims are issued again from the user row, so a role or staff change applies from the next
+#  refresh instead of lasting as long as the refresh token.
+class UserTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = User.objects.filter(pk=refresh.payload.get(api_settings.USER_ID_CLAIM)).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user) or refresh.payload.get(TOKEN_VERSION_CLAIM, 0) != user.token_version:
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        set_user_claims(refresh, user)
+        data = {'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION and hasattr(refresh, 'blacklist'):
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+            data['refresh'] = str(refresh)
+        return data
@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .authentication import revoke_access_tokens
+from .cache import invalidate_categories
+from .models import ProductCategory, User
+
+
+@receiver([post_save, post_delete], sender=ProductCategory)
+def invalidate_category_cache(sender, **kwargs):
+    invalidate_categories()
+
+
+# Access tokens are not checked against the database, so deactivated and deleted users are revoked here
+@receiver(post_save, sender=User)
+def revoke_inactive_user_tokens(sender, instance, **kwargs):
+    if not instance.is_active:
+        revoke_access_tokens(instance.pk)
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user_tokens(sender, instance, **kwargs):
+    revoke_access_tokens(instance.pk)
@@ -0,0 +1,120 @@
+import gc
+import json
+import os
+import re
+import subprocess
+import sys
+from django.conf import settings
+from django.urls import URLResolver, get_resolver
+from django.utils.module_loading import import_string
+from django.views.decorators.csrf import csrf_exempt
+
+#  What a process has done once each stage is through:
+#  - settings: imported the settings module
+#  - setup: django.setup(), every app and model loaded
+#  - urls: also loaded the URL conf, what a web worker does before its first response
+#  - warm: also ran warm_up(), what a gunicorn --preload master does before it forks
+STARTUP_STAGES = ('settings', 'setup', 'urls', 'warm')
+
+# Run in a fresh interpreter, prints the seconds spent in each stage as JSON
+STARTUP_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+stage = sys.argv[1]
+timings = {}
+from django.conf import settings
+settings.INSTALLED_APPS
+timings['settings'] = time.perf_counter() - started
+if stage != 'settings':
+    import django
+    django.setup()
+    timings['setup'] = time.perf_counter() - started
+if stage in ('urls', 'warm'):
+    from app.startup import load_urls
+    load_urls()
+    timings['urls'] = time.perf_counter() - started
+if stage == 'warm':
+    from app.startup import warm_up
+    warm_up()
+    timings['warm'] = time.perf_counter() - started
+print(json.dumps({'timings': timings, 'modules': len(sys.modules)}))
+'''
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+#  View imported on its first request, for rarely used views whose modules are slow to import
+def lazy_view(path):
+    def view(request, *args, **kwargs):
+        return view.load()(request, *args, **kwargs)
+    def load():
+        if view.target is None:
+            view.target = import_string(path)
+        return view.target
+    view.target = None
+    view.load = load
+    return csrf_exempt(view)
+
+#  include() for a URL conf imported on its first request rather than with the root URL conf.
+#  The first reverse() of the process imports it as well, which JSON API requests never call.
+def lazy_include(module, namespace):
+    return (module, namespace, namespace)
+
+#  Import the URL conf with every include, without importing the lazy views and includes
+def load_urls():
+    def walk(resolver):
+        for pattern in resolver.url_patterns:
+            # Lazy includes still name their module
+            if isinstance(pattern, URLResolver) and not isinstance(pattern.urlconf_name, str):
+                walk(pattern)
+    walk(get_resolver())
+
+#  Load in one go what workers would otherwise import on their first requests, the lazy views
+#  and includes among them. Run in the gunicorn master before it forks, the workers then share
+#  these pages copy-on-write.
+def warm_up():
+    import phonenumbers
+    from django.core.files.storage import storages
+    from django.db import connections
+    from .api_schema import api_schema
+
+    def walk(resolver):
+        for pattern in resolver.url_patterns:
+            if isinstance(pattern, URLResolver):
+                walk(pattern)
+            elif hasattr(pattern.callback, 'load'):
+                pattern.callback.load()
+    walk(get_resolver())
+    api_schema()
+    # The media storage backend and its client library
+    storages['default']
+    # Phone number metadata is otherwise read per region, the first time a number of it is parsed
+    phonenumbers.PhoneMetadata.load_all()
+    # Forked workers must not share the master's database connections
+    connections.close_all()
+    # Keep the collector from touching, and so copying, the shared objects in every worker
+    gc.freeze()
+
+#  Start a fresh interpreter that runs up to `stage`, returns its timings and the raw
+#  `-X importtime` output when asked for
+def run_startup(stage, importtime=False):
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', STARTUP_SCRIPT, stage]
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE)}
+    # Profile what a web worker imports, not what manage.py adds
+    env.setdefault('DJANGO_WEB_PROCESS', 'True')
+    result = subprocess.run(command, capture_output=True, text=True, env=env, cwd=settings.BASE_DIR)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit status {result.returncode}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+#  (module, self_us, cumulative_us, depth) per `-X importtime` line, in import order
+def parse_importtime(output):
+    imports = []
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            imports.append((match[4], int(match[1]), int(match[2]), (len(match[3]) - 1) // 2))
+    return imports
@@ -0,0 +1,109 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.utils import timezone
+from .models import ProductList, StockReservation, StockReservationItem
+
+#  Stock moves through conditional UPDATE statements only, a product row is never read,
+#  changed in Python and written back, so concurrent reservations cannot lose each other.
+
+
+class StockError(Exception):
+    pass
+
+class InsufficientStock(StockError):
+    def __init__(self, product_id):
+        self.product_id = product_id
+        super().__init__(f"Not enough stock for product {product_id}.")
+
+class ReservationNotHeld(StockError):
+    def __init__(self, reservation_id):
+        self.reservation_id = reservation_id
+        super().__init__(f"Reservation {reservation_id} is no longer held.")
+
+#  Take `quantity` units of a product, the product turns unavailable when its last unit goes
+def take_stock(product_id, quantity):
+    updated = ProductList.objects.filter(
+        pk=product_id, product_availability=True, product_stock__gte=quantity,
+    ).update(
+        product_stock=F('product_stock') - quantity,
+        # The right hand side sees the row before the update
+        product_availability=Case(When(product_stock=quantity, then=Value(False)), default=Value(True)),
+        product_updated_at=timezone.now(),
+    )
+    if not updated:
+        raise InsufficientStock(product_id)
+
+#  Put stock back, {product_id: quantity}, in one UPDATE. Products that ran out become available again.
+def return_stock(quantities):
+    if not quantities:
+        return
+    # Lock the rows in primary key order first, like reserve_stock does
+    list(ProductList.objects.filter(pk__in=quantities).order_by('pk').select_for_update().values_list('pk', flat=True))
+    ProductList.objects.filter(pk__in=quantities).update(
+        product_stock=F('product_stock') + Case(
+            *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+            output_field=IntegerField(),
+        ),
+        product_availability=Case(When(product_stock=0, then=Value(True)), default=F('product_availability')),
+        product_updated_at=timezone.now(),
+    )
+
+#  Total quantity per product held by the given reservations
+def reserved_quantities(reservation_ids):
+    rows = (
+        StockReservationItem.objects.filter(reservation_id__in=reservation_ids)
+        .values('product_id').annotate(quantity=Sum('quantity')).order_by()
+    )
+    return {row['product_id']: row['quantity'] for row in rows}
+
+#  Reserve {product_id: quantity} for a user, all of it or nothing. Products are taken in primary
+#  key order, so two reservations sharing products lock them in the same order and cannot deadlock.
+def reserve_stock(user_id, quantities, ttl=None):
+    ttl = settings.STOCK_RESERVATION_TTL if ttl is None else ttl
+    with transaction.atomic():
+        for product_id in sorted(quantities):
+            take_stock(product_id, quantities[product_id])
+        reservation = StockReservation.objects.create(user_id=user_id, expires_at=timezone.now() + timedelta(seconds=ttl))
+        reservation.items.bulk_create([
+            StockReservationItem(reservation=reservation, product_id=product_id, quantity=quantity)
+            for product_id, quantity in sorted(quantities.items())
+        ])
+    return reservation
+
+#  The held stock is sold, it does not come back
+def commit_reservation(reservation_id):
+    updated = StockReservation.objects.filter(
+        pk=reservation_id, status=StockReservation.Status.HELD, expires_at__gt=timezone.now(),
+    ).update(status=StockReservation.Status.COMMITTED)
+    if not updated:
+        raise ReservationNotHeld(reservation_id)
+
+#  The held stock goes back to the products
+def release_reservation(reservation_id):
+    with transaction.atomic():
+        # Only one of a concurrent release, commit or sweep wins the status change
+        updated = StockReservation.objects.filter(
+            pk=reservation_id, status=StockReservation.Status.HELD,
+        ).update(status=StockReservation.Status.RELEASED)
+        if not updated:
+            raise ReservationNotHeld(reservation_id)
+        return_stock(reserved_quantities([reservation_id]))
+
+#  Expire held reservations past their expiry in batches, one transaction and one stock UPDATE
+#  per batch. Rows locked by a running commit or release are skipped and left to them.
+def sweep_expired_reservations(batch_size=500):
+    expired = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(status=StockReservation.Status.HELD, expires_at__lte=timezone.now())
+                .order_by('expires_at', 'pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                return expired
+            StockReservation.objects.filter(pk__in=ids, status=StockReservation.Status.HELD).update(status=StockReservation.Status.EXPIRED)
+            return_stock(reserved_quantities(ids))
+        expired += len(ids)
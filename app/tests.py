@@ -1,3 +1,848 @@
-from django.test import TestCase
+import io
+import os
+import re
+import tempfile
+import threading
+from unittest import mock, skipUnless
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, OperationalError, connection, connections, router
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.serializers import BaseSerializer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from . import cart, passwords, replicas
+from .authentication import TOKEN_VERSION_CLAIM, bump_token_version
+from .cart import add_item, flush_carts, get_cart, persist_carts
+from .images import process_staged_image, staging_storage
+from .models import User, VendorProfile, ProductCategory, ProductList, StockReservation, StockReservationItem, Cart, CartItem
+from .passwords import PasswordPool
+from .product_import import ProductImporter
+from .replicas import pin_to_primary, primary_reads, start_replica_reads, stop_replica_reads
+from .serializers import UserTokenObtainPairSerializer
+from .stock import InsufficientStock, ReservationNotHeld, commit_reservation, release_reservation, reserve_stock, sweep_expired_reservations
+from .utils import allocate_unique_values, next_unique_value
 
-# Create your tests here.
+
+def create_vendor(email='vendor@example.com', company_name='Acme'):
+    user = User.objects.create_user(email, 'Passw0rd!', role=User.Role.VENDOR)
+    VendorProfile.objects.create(user=user, company_name=company_name, business_registration_number='1', gst_id='1', phone_number='+14155552671')
+    return user
+
+#  A file based cache in a temporary directory, shared by processes like Redis would be
+def use_shared_cache(test):
+    location = test.enterContext(tempfile.TemporaryDirectory())
+    test.enterContext(override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}))
+
+def create_product(vendor, name, **fields):
+    category, _ = ProductCategory.objects.get_or_create(category_name='Shirts', defaults={'category_description': 'Shirts'})
+    fields = {'product_image': 'products/tee.png', 'product_description': 'A plain cotton tee.', 'product_stock': 10, 'product_price': 100, **fields}
+    return ProductList.objects.create(product_vendor_id=vendor.pk, product_category=category, product_name=name, **fields)
+
+def create_products(vendor, count, stock=10):
+    return [
+        create_product(vendor, f'Tee {number}', product_stock=stock, product_price=100 + number, product_discount=10 if number % 2 else None)
+        for number in range(count)
+    ]
+
+
+#  Product endpoints run a fixed number of queries, however many rows they render. Request
+#  metrics are off so no sampled request adds its own statements.
+@override_settings(REQUEST_METRICS_SAMPLE_RATE=0, PROFILE_SAMPLE_RATE=0)
+class ProductQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = create_vendor()
+        cls.products = create_products(cls.vendor, 15)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.vendor)
+
+    #  Send the request and assert it ran `num` queries and answered `status_code`
+    def assertRequestQueries(self, num, method, url, data=None, status_code=200):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertEqual(response.status_code, status_code, response.content)
+        self.assertEqual(len(queries), num, '\n'.join(query['sql'] for query in queries.captured_queries))
+        return response
+
+    def test_list(self):
+        # The page's validators, then the page itself
+        response = self.assertRequestQueries(2, 'get', '/api/drf/v1/products/')
+        self.assertEqual(len(response.data['results']), 15)
+
+    def test_list_query_count_does_not_grow_with_rows(self):
+        create_products(self.vendor, 10)
+        self.assertRequestQueries(2, 'get', '/api/drf/v1/products/?page_size=25')
+
+    def test_retrieve(self):
+        # The row's timestamp for the validators, then the row with its category slug
+        response = self.assertRequestQueries(2, 'get', f'/api/drf/v1/products/{self.products[1].slug}/')
+        self.assertEqual(response.data['product_category'], 'shirts')
+
+    def test_update(self):
+        # The row with its category, the UPDATE and the generated discounted price read back
+        response = self.assertRequestQueries(3, 'patch', f'/api/drf/v1/products/{self.products[1].slug}/', {'product_discount': '20'})
+        self.assertEqual(response.data['product_price_after_discount'], '80.80')
+
+
+#  Reservations one at a time, on any database
+@override_settings(REQUEST_METRICS_SAMPLE_RATE=0, PROFILE_SAMPLE_RATE=0)
+class StockReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer@example.com', 'Passw0rd!', role=User.Role.CUSTOMER)
+        cls.shirt, cls.tee = create_products(create_vendor(), 2, stock=2)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def assertStock(self, product, stock, available):
+        product.refresh_from_db()
+        self.assertEqual((product.product_stock, product.product_availability), (stock, available))
+
+    def reserve(self, **quantities):
+        items = [{'product': getattr(self, name).slug, 'quantity': quantity} for name, quantity in quantities.items()]
+        return self.client.post('/api/drf/v1/stock-reservations/', {'items': items}, format='json')
+
+    def test_reserve_and_commit(self):
+        response = self.reserve(shirt=1, tee=2)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.data['status'], StockReservation.Status.HELD)
+        self.assertStock(self.shirt, 1, True)
+        self.assertStock(self.tee, 0, False)
+        response = self.client.post(f"/api/drf/v1/stock-reservations/{response.data['id']}/commit/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], StockReservation.Status.COMMITTED)
+        # Sold stock does not come back
+        self.assertEqual(self.client.post(f"/api/drf/v1/stock-reservations/{response.data['id']}/release/").status_code, 409)
+        self.assertStock(self.tee, 0, False)
+
+    def test_release_restores_stock_and_availability(self):
+        reservation = reserve_stock(self.customer.pk, {self.shirt.pk: 2})
+        self.assertStock(self.shirt, 0, False)
+        release_reservation(reservation.pk)
+        self.assertStock(self.shirt, 2, True)
+        with self.assertRaises(ReservationNotHeld):
+            release_reservation(reservation.pk)
+        self.assertStock(self.shirt, 2, True)
+
+    def test_insufficient_stock_reserves_nothing(self):
+        with self.assertRaises(InsufficientStock) as raised:
+            reserve_stock(self.customer.pk, {self.shirt.pk: 1, self.tee.pk: 3})
+        self.assertEqual(raised.exception.product_id, self.tee.pk)
+        self.assertStock(self.shirt, 2, True)
+        self.assertFalse(StockReservation.objects.exists())
+        response = self.reserve(tee=3)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['items'], [f'Not enough stock for {self.tee.slug}.'])
+
+    def test_unavailable_product_cannot_be_reserved(self):
+        ProductList.objects.filter(pk=self.shirt.pk).update(product_availability=False)
+        with self.assertRaises(InsufficientStock):
+            reserve_stock(self.customer.pk, {self.shirt.pk: 1})
+
+    def test_sweep_returns_expired_stock(self):
+        expired = reserve_stock(self.customer.pk, {self.shirt.pk: 2, self.tee.pk: 1}, ttl=0)
+        held = reserve_stock(self.customer.pk, {self.tee.pk: 1})
+        self.assertEqual(sweep_expired_reservations(), 1)
+        self.assertStock(self.shirt, 2, True)
+        self.assertStock(self.tee, 1, True)
+        self.assertEqual(
+            dict(StockReservation.objects.values_list('pk', 'status')),
+            {expired.pk: StockReservation.Status.EXPIRED, held.pk: StockReservation.Status.HELD},
+        )
+        with self.assertRaises(ReservationNotHeld):
+            commit_reservation(expired.pk)
+        self.assertEqual(sweep_expired_reservations(), 0)
+
+
+#  Concurrent reservations on real transactions. SQLite runs one writer at a time, so these
+#  only mean something on a database with row locks.
+@skipUnlessDBFeature('has_select_for_update')
+class StockReservationConcurrencyTests(TransactionTestCase):
+    WORKERS = 20
+
+    def setUp(self):
+        self.vendor = create_vendor()
+        self.customer = User.objects.create_user('customer@example.com', 'Passw0rd!', role=User.Role.CUSTOMER)
+
+    #  Run `reserve(index)` in WORKERS threads released together, returns the reservations
+    #  made and how many found too little stock
+    def reserve_concurrently(self, reserve):
+        barrier = threading.Barrier(self.WORKERS)
+        reservations, shortages, errors = [], [], []
+        def worker(index):
+            try:
+                barrier.wait()
+                reservations.append(reserve(index))
+            except InsufficientStock:
+                shortages.append(index)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(self.WORKERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return reservations, len(shortages)
+
+    def test_no_oversell_and_unavailable_at_zero(self):
+        product, = create_products(self.vendor, 1, stock=7)
+        reservations, shortages = self.reserve_concurrently(lambda index: reserve_stock(self.customer.pk, {product.pk: 1}))
+        self.assertEqual((len(reservations), shortages), (7, self.WORKERS - 7))
+        product.refresh_from_db()
+        self.assertEqual(product.product_stock, 0)
+        self.assertFalse(product.product_availability)
+
+        release_reservation(reservations[0].pk)
+        product.refresh_from_db()
+        self.assertEqual(product.product_stock, 1)
+        self.assertTrue(product.product_availability)
+
+    def test_multi_item_reservations_keep_stock_consistent(self):
+        products = create_products(self.vendor, 3, stock=12)
+        # Overlapping products in different orders, each reservation takes all of its items or none
+        def reserve(index):
+            chosen = products[index % 3:] + products[:index % 3]
+            return reserve_stock(self.customer.pk, {product.pk: 1 + index % 2 for product in reversed(chosen[:2])})
+        reservations, shortages = self.reserve_concurrently(reserve)
+        self.assertEqual(len(reservations) + shortages, self.WORKERS)
+        for product in products:
+            product.refresh_from_db()
+            reserved = sum(StockReservationItem.objects.filter(product=product).values_list('quantity', flat=True))
+            self.assertGreaterEqual(product.product_stock, 0)
+            self.assertEqual(product.product_stock + reserved, 12)
+            self.assertEqual(product.product_availability, product.product_stock > 0)
+
+
+#  A second connection to the test database stands in for a replica, the way copies of
+#  db.sqlite3 do for the DB_ENGINE=sqlite stand-in
+REPLICA = 'replica_test'
+
+def add_replica(test):
+    primary = connections['default']
+    connections[REPLICA] = type(primary)(dict(primary.settings_dict), REPLICA)
+    def remove_replica():
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        replicas._unhealthy.clear()
+    test.addCleanup(remove_replica)
+
+@override_settings(DATABASE_REPLICAS=[REPLICA])
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        add_replica(self)
+
+    #  The database a request's reads are routed to
+    def read_database(self, user=None, method='get'):
+        request = getattr(RequestFactory(), method)('/api/drf/v1/products/')
+        request.user = user or AnonymousUser()
+        token = start_replica_reads(request)
+        try:
+            return router.db_for_read(ProductList)
+        finally:
+            stop_replica_reads(token)
+
+    def test_anonymous_reads_use_a_replica(self):
+        self.assertEqual(self.read_database(), REPLICA)
+
+    def test_unsafe_requests_use_the_primary(self):
+        self.assertEqual(self.read_database(method='post'), 'default')
+
+    def test_unpinned_user_reads_from_a_replica(self):
+        use_shared_cache(self)
+        self.assertEqual(self.read_database(User(pk=1)), REPLICA)
+
+    def test_pinned_user_reads_from_the_primary(self):
+        use_shared_cache(self)
+        pin_to_primary(1)
+        self.assertEqual(self.read_database(User(pk=1)), 'default')
+        self.assertEqual(self.read_database(User(pk=2)), REPLICA)
+
+    def test_signed_in_users_read_from_the_primary_without_a_shared_cache(self):
+        # Another worker could have missed the pin
+        self.assertEqual(self.read_database(User(pk=1)), 'default')
+        self.assertEqual(self.read_database(), REPLICA)
+
+    def test_primary_reads_inside_replica_reads(self):
+        request = RequestFactory().get('/api/drf/v1/categories/')
+        request.user = AnonymousUser()
+        token = start_replica_reads(request)
+        try:
+            with primary_reads():
+                self.assertEqual(router.db_for_read(ProductCategory), 'default')
+            self.assertEqual(router.db_for_read(ProductCategory), REPLICA)
+        finally:
+            stop_replica_reads(token)
+
+    def test_unhealthy_replica_falls_back_to_the_primary(self):
+        with mock.patch.object(connections[REPLICA], 'ensure_connection', side_effect=OperationalError):
+            self.assertEqual(self.read_database(), 'default')
+        # Skipped until DATABASE_REPLICA_RETRY_SECONDS have passed
+        self.assertEqual(self.read_database(), 'default')
+        replicas._unhealthy.clear()
+        self.assertEqual(self.read_database(), REPLICA)
+
+
+#  The async read views authenticate and pick the replica on a worker thread, where the
+#  replica's health check runs
+@override_settings(DATABASE_REPLICAS=[REPLICA], REQUEST_METRICS_SAMPLE_RATE=0, PROFILE_SAMPLE_RATE=0)
+class AsyncReadViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = create_vendor()
+        create_products(cls.vendor, 3)
+        cls.authorization = f'Bearer {UserTokenObtainPairSerializer.get_token(cls.vendor).access_token}'
+
+    def setUp(self):
+        # Signed-in users only read from replicas with a shared cache
+        use_shared_cache(self)
+        add_replica(self)
+        self.enterContext(mock.patch.object(connections[REPLICA], 'ensure_connection', side_effect=OperationalError))
+
+    async def test_list_fails_over_from_an_unhealthy_replica(self):
+        response = await self.async_client.get('/api/drf/v1/async/products/', headers={'Authorization': self.authorization})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 3)
+        self.assertIn(REPLICA, replicas._unhealthy)
+
+    async def test_revoked_token_is_rejected(self):
+        await sync_to_async(bump_token_version)(self.vendor)
+        response = await self.async_client.get('/api/drf/v1/async/products/', headers={'Authorization': self.authorization})
+        self.assertEqual(response.status_code, 401)
+
+
+class CategoryCacheTests(TestCase):
+    def setUp(self):
+        ProductCategory.objects.create(category_name='Shirts', category_description='Shirts')
+        self.client = APIClient()
+        self.client.force_authenticate(create_vendor())
+
+    def category_names(self):
+        response = self.client.get('/api/drf/v1/categories/')
+        self.assertEqual(response.status_code, 200)
+        return [category['category_name'] for category in response.json()['results']]
+
+    def test_list_is_cached_until_a_category_write(self):
+        use_shared_cache(self)
+        self.assertEqual(self.category_names(), ['Shirts'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.category_names(), ['Shirts'])
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductCategory.objects.create(category_name='Hats', category_description='Hats')
+        self.assertCountEqual(self.category_names(), ['Shirts', 'Hats'])
+
+    def test_not_cached_without_a_shared_cache(self):
+        # A per process cache would miss the version bumps of other workers
+        self.assertEqual(self.category_names(), ['Shirts'])
+        ProductCategory.objects.create(category_name='Hats', category_description='Hats')
+        response = self.client.get('/api/drf/v1/categories/')
+        self.assertNotIn('ETag', response)
+        self.assertCountEqual([category['category_name'] for category in response.json()['results']], ['Shirts', 'Hats'])
+
+
+#  Search runs on the stored search_vector on Postgres and on the icontains fallback elsewhere,
+#  both rank name matches first
+@override_settings(REQUEST_METRICS_SAMPLE_RATE=0, PROFILE_SAMPLE_RATE=0)
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = create_vendor()
+        cls.shirt = create_product(cls.vendor, 'Linen Shirt', product_description='Breathable summer wear.')
+        cls.tee = create_product(cls.vendor, 'Cotton Tee', product_description='Soft cotton, pairs with linen trousers.')
+        cls.scarf = create_product(cls.vendor, 'Wool Scarf', product_description='Warm winter wear.', product_specifications='Hand wash in cold water.')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.vendor)
+
+    def search(self, query, **params):
+        response = self.client.get('/api/drf/v1/products/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [product['slug'] for product in response.data['results']]
+
+    def test_name_matches_rank_before_description_matches(self):
+        self.assertEqual(self.search('linen'), [self.shirt.slug, self.tee.slug])
+
+    def test_matches_descriptions_and_specifications(self):
+        self.assertEqual(self.search('breathable'), [self.shirt.slug])
+        self.assertEqual(self.search('wash'), [self.scarf.slug])
+
+    def test_no_match(self):
+        self.assertEqual(self.search('silk'), [])
+
+    def test_explicit_ordering_overrides_relevance(self):
+        self.assertEqual(self.search('wear', ordering='-created'), [self.scarf.slug, self.shirt.slug])
+
+    @skipUnless(connection.vendor == 'postgresql', 'The search trigger is Postgres only')
+    def test_trigger_keeps_search_vector_current(self):
+        # Queryset updates skip save(), the trigger still recomputes the vector
+        ProductList.objects.filter(pk=self.scarf.pk).update(product_name='Silk Scarf')
+        self.assertEqual(self.search('silk'), [self.scarf.slug])
+        self.assertEqual(self.search('wool'), [])
+
+
+class ProductSearchMigrationTests(TransactionTestCase):
+    def columns(self):
+        with connection.cursor() as cursor:
+            return [column.name for column in connection.introspection.get_table_description(cursor, 'app_productlist')]
+
+    def test_search_migration_unapplies_and_applies(self):
+        executor = MigrationExecutor(connection)
+        leaves = executor.loader.graph.leaf_nodes()
+        executor.migrate([('app', '0003_price_after_discount_generated')])
+        try:
+            self.assertNotIn('search_vector', self.columns())
+        finally:
+            executor = MigrationExecutor(connection)
+            executor.migrate(leaves)
+        self.assertIn('search_vector', self.columns())
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT tgname FROM pg_trigger WHERE tgrelid = 'app_productlist'::regclass AND NOT tgisinternal")
+                self.assertEqual(cursor.fetchall(), [('app_productlist_search_vector_trigger',)])
+
+
+def image_bytes(width, height, image_format='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), 'red').save(buffer, image_format)
+    return buffer.getvalue()
+
+#  The image pipeline in the request, IMAGE_PROCESSING_WORKERS = 0, with media and staging
+#  in temporary directories
+@override_settings(IMAGE_PROCESSING_WORKERS=0, REQUEST_METRICS_SAMPLE_RATE=0, PROFILE_SAMPLE_RATE=0)
+class ImagePipelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = create_vendor()
+        cls.category = ProductCategory.objects.create(category_name='Shirts', category_description='Shirts')
+
+    def setUp(self):
+        self.media_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.staging_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(
+            MEDIA_ROOT=self.media_root, IMAGE_STAGING_ROOT=self.staging_root,
+            STORAGES={**settings.STORAGES, 'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'}},
+        ))
+        self.client = APIClient()
+        self.client.force_authenticate(self.vendor)
+
+    def upload(self, data, name='shirt.png'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/drf/v1/products/', {
+                'product_category': self.category.slug, 'product_vendor': self.vendor.pk, 'product_name': 'Linen Shirt',
+                'product_description': 'Breathable summer wear.', 'product_stock': 3, 'product_price': '10.00',
+                'product_image': SimpleUploadedFile(name, data, content_type='image/png'),
+            }, format='multipart')
+
+    def staged_files(self):
+        return [name for _, _, names in os.walk(self.staging_root) for name in names]
+
+    def test_upload_is_stored_with_webp_variants(self):
+        response = self.upload(image_bytes(1600, 1000))
+        self.assertEqual(response.status_code, 201, response.content)
+        product = ProductList.objects.get(slug=response.data['slug'])
+        self.assertTrue(product.product_image.name.endswith('.png'))
+        self.assertEqual(set(product.product_image_variants), {'320', '640', '1280', 'thumbnail'})
+        for key, name in product.product_image_variants.items():
+            with Image.open(os.path.join(self.media_root, name)) as variant:
+                self.assertEqual(variant.format, 'WEBP')
+                self.assertEqual(variant.size, (160, 160) if key == 'thumbnail' else (int(key), int(key) * 5 // 8))
+        self.assertEqual(self.staged_files(), [])
+
+    def test_variants_are_never_wider_than_the_image(self):
+        response = self.upload(image_bytes(400, 300, 'JPEG'), 'shirt.jpg')
+        self.assertEqual(response.status_code, 201, response.content)
+        product = ProductList.objects.get(slug=response.data['slug'])
+        self.assertTrue(product.product_image.name.endswith('.jpg'))
+        self.assertEqual(set(product.product_image_variants), {'320', 'thumbnail'})
+
+    def test_undecodable_upload_is_rejected(self):
+        data = image_bytes(400, 400)
+        response = self.upload(data[:len(data) // 2])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('product_image', response.data)
+        self.assertFalse(ProductList.objects.exists())
+        self.assertEqual(self.staged_files(), [])
+
+    @override_settings(IMAGE_MAX_PIXELS=10_000)
+    def test_oversized_upload_is_rejected(self):
+        response = self.upload(image_bytes(200, 100))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['product_image'], ['Image is too large.'])
+        self.assertFalse(ProductList.objects.exists())
+
+    def test_worker_drops_an_undecodable_staged_file(self):
+        product = create_product(self.vendor, 'Linen Shirt')
+        staged_name = staging_storage().save(f'app.productlist/{product.pk}/product_image/broken.png', ContentFile(b'not an image'))
+        self.assertIsNone(process_staged_image(staged_name))
+        product.refresh_from_db()
+        self.assertEqual(product.product_image.name, 'products/tee.png')
+        self.assertEqual(self.staged_files(), [])
+
+
+class UniqueValueTests(TestCase):
+    def create_categories(self, *slugs):
+        ProductCategory.objects.bulk_create(ProductCategory(category_name=slug, category_description=slug, slug=slug) for slug in slugs)
+
+    def test_suffixes_are_ordered_as_numbers(self):
+        self.create_categories('shirts', *(f'shirts-{number}' for number in range(1, 11)), 'shirts-extra', 'shirtsleeve-99')
+        self.assertEqual(next_unique_value(ProductCategory.objects.all(), 'slug', 'shirts', '-'), 'shirts-11')
+
+    def test_zero_padded_suffixes_count_by_value(self):
+        self.create_categories('shirts', 'shirts-009', 'shirts-10')
+        self.assertEqual(next_unique_value(ProductCategory.objects.all(), 'slug', 'shirts', '-'), 'shirts-11')
+        self.assertEqual(next_unique_value(ProductCategory.objects.all(), 'slug', 'hats', '-'), 'hats')
+
+    def test_save_allocates_the_next_slug(self):
+        self.create_categories('shirts', 'shirts-9', 'shirts-10')
+        category = ProductCategory.objects.create(category_name='Shirts', category_description='Shirts')
+        self.assertEqual(category.slug, 'shirts-11')
+
+    def test_batch_duplicates_get_their_own_suffix(self):
+        self.create_categories('tee', 'tee-1', 'tee-3')
+        bases = ['tee', 'tee', 'hat', 'tee', 'hat']
+        self.assertEqual(allocate_unique_values(ProductCategory.objects.all(), 'slug', bases, '-'), ['tee-2', 'tee-4', 'hat', 'tee-5', 'hat-1'])
+
+    def test_save_retries_past_a_value_taken_concurrently(self):
+        self.create_categories('shirts')
+        allocated = []
+        def allocate_and_race(*args, **kwargs):
+            value = next_unique_value(*args, **kwargs)
+            if not allocated:
+                # Another writer inserts the value between the lookup and the insert
+                self.create_categories(value)
+            allocated.append(value)
+            return value
+        with mock.patch('app.utils.next_unique_value', side_effect=allocate_and_race):
+            category = ProductCategory.objects.create(category_name='Shirts', category_description='Shirts')
+        self.assertEqual(allocated, ['shirts-1', 'shirts-2'])
+        self.assertEqual(category.slug, 'shirts-2')
+
+    def test_other_integrity_errors_are_not_retried(self):
+        ProductCategory.objects.create(category_name='Shirts', category_description='Shirts')
+        with mock.patch('app.utils.next_unique_value', wraps=next_unique_value) as allocate:
+            with self.assertRaises(IntegrityError):
+                ProductCategory.objects.create(category_name='Shirts', category_description='Shirts')
+        self.assertEqual(allocate.call_count, 1)
+
+
+#  Revocation is checked against the user row without a shared cache and against the cache's
+#  revocation entries with one, see SharedCacheTokenRevocationTests
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], REQUEST_METRICS_SAMPLE_RATE=0, PROFILE_SAMPLE_RATE=0)
+class TokenRevocationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = create_vendor()
+
+    def setUp(self):
+        self.client = APIClient()
+        response = self.client.post('/api/drf/v1/login/', {'email': self.vendor.email, 'password': 'Passw0rd!'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.access, self.refresh = response.data['access'], response.data['refresh']
+
+    def read_products(self, access):
+        return self.client.get('/api/drf/v1/products/', headers={'Authorization': f'Bearer {access}'}).status_code
+
+    def refresh_token(self, refresh):
+        return self.client.post('/api/drf/v1/token/refresh/', {'refresh': refresh}, format='json')
+
+    def test_password_change_revokes_access_and_refresh_tokens(self):
+        self.assertEqual(self.read_products(self.access), 200)
+        response = self.client.put(
+            '/api/drf/v1/change-password/', {'old_password': 'Passw0rd!', 'new_password': 'N3w-Passw0rd', 'new_password2': 'N3w-Passw0rd'},
+            format='json', headers={'Authorization': f'Bearer {self.access}'},
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.read_products(self.access), 401)
+        self.assertEqual(self.refresh_token(self.refresh).status_code, 401)
+
+    def test_deleted_user_is_revoked(self):
+        response = self.client.delete('/api/drf/v1/deactivate/', headers={'Authorization': f'Bearer {self.access}'})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.read_products(self.access), 401)
+        self.assertEqual(self.refresh_token(self.refresh).status_code, 401)
+
+    def test_deactivated_user_is_revoked(self):
+        self.vendor.is_active = False
+        self.vendor.save()
+        self.assertEqual(self.read_products(self.access), 401)
+        self.assertEqual(self.refresh_token(self.refresh).status_code, 401)
+
+    def test_refresh_issues_claims_from_the_user_row(self):
+        User.objects.filter(pk=self.vendor.pk).update(role=User.Role.CUSTOMER, is_staff=True)
+        response = self.refresh_token(self.refresh)
+        self.assertEqual(response.status_code, 200, response.content)
+        access = AccessToken(response.data['access'])
+        self.assertEqual((access['role'], access['is_staff'], access[TOKEN_VERSION_CLAIM]), (User.Role.CUSTOMER, True, 0))
+        self.assertEqual(self.read_products(response.data['access']), 200)
+
+class SharedCacheTokenRevocationTests(TokenRevocationTests):
+    def setUp(self):
+        use_shared_cache(self)
+        super().setUp()
+
+
+#  Cart endpoints and storage, for a cache every worker shares and for the per process default
+class CartTestsMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer@example.com', 'Passw0rd!', role=User.Role.CUSTOMER)
+        cls.products = create_products(create_vendor(), 3)
+
+    def setUp(self):
+        self.addCleanup(cart._pending.clear)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def change(self, method, url, data=None):
+        response = getattr(self.client, method)(f'/api/drf/v1/cart/{url}', data, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def stored_items(self):
+        return dict(CartItem.objects.filter(cart_id=self.customer.pk).values_list('product__slug', 'quantity'))
+
+    def test_add_update_remove(self):
+        shirt, tee, hat = (product.slug for product in self.products)
+        self.change('post', 'items/', {'product': shirt, 'quantity': 2})
+        self.change('post', 'items/', {'product': shirt})
+        self.change('post', 'items/', {'product': tee})
+        self.change('post', 'items/', {'product': hat})
+        self.change('patch', f'items/{tee}/', {'quantity': 4})
+        self.change('delete', f'items/{hat}/')
+        data = self.change('get', '')
+        self.assertEqual([(line['product'], line['quantity']) for line in data['items']], [(shirt, 3), (tee, 4)])
+        # The second product has a 10% discount
+        self.assertEqual((data['item_count'], data['total']), (7, '663.60'))
+
+    def test_unknown_item_is_not_found(self):
+        response = self.client.patch('/api/drf/v1/cart/items/missing/', {'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_changes_are_persisted(self):
+        shirt, tee, _ = (product.slug for product in self.products)
+        self.change('post', 'items/', {'product': shirt, 'quantity': 2})
+        self.change('post', 'items/', {'product': tee})
+        flush_carts()
+        self.assertEqual(self.stored_items(), {shirt: 2, tee: 1})
+        self.change('delete', f'items/{shirt}/')
+        flush_carts()
+        self.assertEqual(self.stored_items(), {tee: 1})
+        self.assertEqual(Cart.objects.get(pk=self.customer.pk).version, get_cart(self.customer.pk)['version'])
+
+    def test_versions_only_grow(self):
+        first = add_item(self.customer.pk, self.products[0].pk, self.products[0].slug, 1)
+        second = add_item(self.customer.pk, self.products[0].pk, self.products[0].slug, 1)
+        self.assertGreater(second['version'], first['version'])
+        flush_carts()
+        # A flush of an older copy, from another process, never replaces the stored cart
+        persist_carts({self.customer.pk: first})
+        self.assertEqual(self.stored_items(), {self.products[0].slug: 2})
+
+#  Without a shared cache every change is made in the database, under the cart row's lock
+class CartTests(CartTestsMixin, TestCase):
+    def test_changes_are_stored_at_once(self):
+        add_item(self.customer.pk, self.products[0].pk, self.products[0].slug, 2)
+        self.assertEqual(self.stored_items(), {self.products[0].slug: 2})
+        self.assertEqual(cart._pending, {})
+        self.assertEqual(get_cart(self.customer.pk)['items'], {self.products[0].pk: {'slug': self.products[0].slug, 'quantity': 2}})
+
+#  With a shared cache changes are written behind, CART_FLUSH_INTERVAL = 0 queues the flush
+#  for the commit, which these tests run by hand
+@override_settings(CART_FLUSH_INTERVAL=0)
+class SharedCacheCartTests(CartTestsMixin, TestCase):
+    def setUp(self):
+        use_shared_cache(self)
+        super().setUp()
+
+    def test_changes_are_written_behind(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            add_item(self.customer.pk, self.products[0].pk, self.products[0].slug, 2)
+        self.assertEqual(self.stored_items(), {})
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.stored_items(), {self.products[0].slug: 2})
+
+    def test_evicted_cart_is_read_from_the_unflushed_buffer_then_the_database(self):
+        add_item(self.customer.pk, self.products[0].pk, self.products[0].slug, 2)
+        cache.delete(cart.cart_key(self.customer.pk))
+        self.assertEqual(get_cart(self.customer.pk)['items'][self.products[0].pk]['quantity'], 2)
+        flush_carts()
+        cache.delete(cart.cart_key(self.customer.pk))
+        self.assertEqual(get_cart(self.customer.pk)['items'][self.products[0].pk]['quantity'], 2)
+
+    def test_cart_held_by_another_change_is_busy(self):
+        lock_key = f'{cart.cart_key(self.customer.pk)}:lock'
+        cache.add(lock_key, 'another-change', 60)
+        with mock.patch('app.cart.CART_LOCK_TIMEOUT', 0.05):
+            response = self.client.post('/api/drf/v1/cart/items/', {'product': self.products[0].slug}, format='json')
+        self.assertEqual(response.status_code, 409)
+        # The other change's lock is left alone
+        self.assertEqual(cache.get(lock_key), 'another-change')
+
+
+#  A full password pool fails logins. The API answers 503, Django's own login views such as the
+#  admin's treat it as a failed login instead of a server error.
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], REQUEST_METRICS_SAMPLE_RATE=0, PROFILE_SAMPLE_RATE=0)
+class PasswordPoolBusyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin@example.com', 'Passw0rd!')
+
+    def setUp(self):
+        # No room for a single job
+        self.enterContext(mock.patch.object(passwords, '_pool', PasswordPool(1, 0)))
+
+    def test_api_login_is_unavailable(self):
+        response = self.client.post('/api/drf/v1/login/', {'email': self.admin.email, 'password': 'Passw0rd!'}, content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    async def test_async_login_is_unavailable(self):
+        response = await self.async_client.post('/api/drf/v1/async/login/', {'email': self.admin.email, 'password': 'Passw0rd!'}, content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+
+    def test_admin_login_fails_cleanly(self):
+        response = self.client.post('/admin/login/', {'username': self.admin.email, 'password': 'Passw0rd!'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+
+class ProductImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = VendorProfile.objects.get(user=create_vendor())
+        cls.category = ProductCategory.objects.create(category_name='Shirts', category_description='Shirts')
+
+    def row(self, name, **fields):
+        return {
+            'product_category': 'shirts', 'product_name': name, 'product_image': 'products/tee.png',
+            'product_description': 'Breathable summer wear.', 'product_stock': 3, 'product_price': '10.00', **fields,
+        }
+
+    def imported_slugs(self):
+        return list(ProductList.objects.order_by('pk').values_list('slug', flat=True))
+
+    def test_import_allocates_unique_slugs_and_reports_invalid_rows(self):
+        create_product(self.vendor.user, 'Linen Shirt')
+        rows = [self.row('Linen Shirt'), self.row('Linen Shirt'), self.row('Cotton Tee', product_price='-1'), self.row('Cotton Tee')]
+        report = ProductImporter(self.vendor, batch_size=2).run(rows)
+        self.assertEqual((report['processed'], report['created'], report['failed']), (4, 3, 1))
+        self.assertEqual([error['row'] for error in report['errors']], [3])
+        self.assertEqual(self.imported_slugs(), ['acme-linen-shirt', 'acme-linen-shirt-1', 'acme-linen-shirt-2', 'acme-cotton-tee'])
+
+    def test_slug_taken_concurrently_is_allocated_again(self):
+        allocated = []
+        def allocate_and_race(*args, **kwargs):
+            slugs = allocate_unique_values(*args, **kwargs)
+            if not allocated:
+                # Another writer takes the first slug before the batch is inserted
+                create_product(self.vendor.user, 'Linen Shirt')
+            allocated.append(slugs)
+            return slugs
+        with mock.patch('app.product_import.allocate_unique_values', side_effect=allocate_and_race):
+            report = ProductImporter(self.vendor).run([self.row('Linen Shirt')])
+        self.assertEqual(allocated, [['acme-linen-shirt'], ['acme-linen-shirt-1']])
+        self.assertEqual((report['created'], report['failed']), (1, 0))
+
+    def test_other_integrity_errors_are_reported_for_their_rows(self):
+        products = [
+            (number, ProductList(product_vendor=self.vendor, product_category=self.category, **fields))
+            for number, fields in enumerate([
+                {'product_name': 'Linen Shirt', 'product_image': 'products/tee.png', 'product_description': 'Linen.', 'product_stock': 3, 'product_price': 10},
+                # Past the serializer, the database's check on the stock fails
+                {'product_name': 'Cotton Tee', 'product_image': 'products/tee.png', 'product_description': 'Cotton.', 'product_stock': -1, 'product_price': 10},
+            ], start=1)
+        ]
+        report = {'created': 0, 'failed': 0, 'errors': [], 'errors_truncated': False}
+        ProductImporter(self.vendor).create_batch(products, report)
+        self.assertEqual((report['created'], report['failed']), (1, 1))
+        self.assertEqual(report['errors'][0]['row'], 2)
+        self.assertNotIn('slug', report['errors'][0]['errors'])
+        self.assertEqual(self.imported_slugs(), ['acme-linen-shirt'])
+
+
+class ProductFacetTests(TestCase):
+    def test_counts_with_decimal_bucket_bounds(self):
+        vendor = create_vendor()
+        for price in (100, 499.99, 500, 12000):
+            create_product(vendor, f'Tee {price}', product_price=price)
+        client = APIClient()
+        client.force_authenticate(vendor)
+        response = client.get('/api/drf/v1/products/facets/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'categories': {'shirts': 4},
+            'price_buckets': [
+                {'min': '0.00', 'max': '500.00', 'count': 2},
+                {'min': '500.00', 'max': '1000.00', 'count': 1},
+                {'min': '1000.00', 'max': '5000.00', 'count': 0},
+                {'min': '5000.00', 'max': '10000.00', 'count': 0},
+                {'min': '10000.00', 'max': None, 'count': 1},
+            ],
+        })
+
+
+@override_settings(REQUEST_METRICS_SAMPLE_RATE=1, REQUEST_METRICS_SERVER_TIMING=True, PROFILE_SAMPLE_RATE=0)
+class RequestMetricsTests(TestCase):
+    def server_timing(self, response):
+        return dict(re.findall(r'(\w+);dur=([\d.]+)', response['Server-Timing']))
+
+    def test_serializer_time_of_a_list(self):
+        vendor = create_vendor()
+        create_products(vendor, 5)
+        client = APIClient()
+        client.force_authenticate(vendor)
+        response = client.get('/api/drf/v1/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(float(self.server_timing(response)['serializer']), 0)
+
+    def test_drf_serializers_are_left_alone(self):
+        self.assertEqual(BaseSerializer.data.fget.__module__, 'rest_framework.serializers')
+
+
+#  Admin searches match prefixes whatever their case
+@override_settings(REQUEST_METRICS_SAMPLE_RATE=0, PROFILE_SAMPLE_RATE=0)
+class AdminSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = create_vendor('Sales@Acme.example', company_name='Acme Ltd')
+        create_vendor('orders@globex.example', company_name='Globex')
+        cls.admin = User.objects.create_superuser('admin@example.com', 'Passw0rd!')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def search(self, url, term):
+        response = self.client.get(url, {'q': term})
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['cl'].result_list)
+
+    def test_prefix_search_ignores_case(self):
+        self.assertEqual(self.search('/admin/app/vendorprofile/', 'acme'), [self.vendor.vendor_profile])
+        self.assertEqual(self.search('/admin/app/user/', 'sales@acme'), [self.vendor])
+        self.assertEqual(self.search('/admin/app/user/', 'ACME'), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'The search indexes are Postgres only')
+    def test_search_uses_upper_pattern_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            sql, params = User.objects.filter(email__istartswith='acme').query.sql_with_params()
+            cursor.execute(f'EXPLAIN {sql}', params)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        self.assertIn('user_email_upper_like_idx', plan)
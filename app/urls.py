@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework_simplejwt.views import TokenObtainPairView,TokenRefreshView
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import (
     UserCreateView,
     UserListView, 
@@ -10,7 +11,13 @@ from .views import (
     CustomerProfileView, 
     VendorProfileView,
     UserAddressView,
-    ProductCategoryView
+    ProductCategoryView,
+    ProductListView,
+    StockReservationView,
+    CartView,
+    CartItemView,
+    CartItemDetailView,
+    RequestMetricsView
 )
 
 
@@ -20,7 +27,9 @@ router = DefaultRouter()
 router.register(r'customer-profile', CustomerProfileView, basename='customer_profile')
 router.register(r'vendor-profile', VendorProfileView, basename='vendor_profile')
 router.register(r'categories', ProductCategoryView, basename='category')
+router.register(r'products', ProductListView, basename='product')
 router.register(r'user-address', UserAddressView, basename='user_address')
+router.register(r'stock-reservations', StockReservationView, basename='stock_reservation')
 router.register(r'admin/user-list', UserListView, basename='user_list')
 
 urlpatterns = [
@@ -45,4 +54,22 @@ urlpatterns = [
     # deactivate
     path('deactivate/', UserAccountDeleteView.as_view(), name='user_account_delete'),
 
+    # request metrics
+    path('admin/request-metrics/', RequestMetricsView.as_view(), name='request_metrics'),
+
+    # cart
+    path('cart/', CartView.as_view(), name='cart'),
+    path('cart/items/', CartItemView.as_view(), name='cart_items'),
+    path('cart/items/<slug:slug>/', CartItemDetailView.as_view(), name='cart_item_detail'),
+
+    # async auth endpoints for ASGI servers, password work runs on the bounded password pool
+    path('async/signup/', async_views.signup, name='async_signup'),
+    path('async/login/', async_views.login, name='async_token_obtain_pair'),
+    path('async/change-password/', async_views.change_password, name='async_change_password'),
+
+    # async catalog reads for ASGI servers
+    path('async/products/', async_views.product_list, name='async_product_list'),
+    path('async/products/<slug:slug>/', async_views.product_detail, name='async_product_detail'),
+    path('async/categories/', async_views.category_list, name='async_category_list'),
+
 ]
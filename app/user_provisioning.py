@@ -0,0 +1,179 @@
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import django
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from .models import User, VendorProfile, CustomerProfile, UserAddress
+from .serializers import ProvisionUserSerializer
+from .utils import UNIQUE_VALUE_SAVE_ATTEMPTS, allocate_unique_values
+
+PROVISION_BATCH_SIZE = 1000
+PROVISION_MAX_REPORTED_ERRORS = 1000
+
+
+#  Streaming account provisioning for migrations from other platforms. Every batch is written
+#  in one transaction with bulk inserts, usernames are allocated in memory against one snapshot
+#  query and passwords are hashed in worker processes while the previous batch is written.
+#  With a checkpoint file the report is saved after every batch, a rerun with the same file
+#  continues after the last batch written. Accounts whose email already exists are skipped,
+#  so a batch written just before a crash is not created twice.
+class UserProvisioner:
+    def __init__(self, batch_size=PROVISION_BATCH_SIZE, workers=None, checkpoint=None, max_errors=PROVISION_MAX_REPORTED_ERRORS):
+        self.batch_size = batch_size
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.checkpoint = checkpoint
+        self.max_errors = max_errors
+
+    def run(self, rows):
+        report = self.load_checkpoint() or {'processed': 0, 'created': 0, 'skipped': 0, 'failed': 0, 'errors': [], 'errors_truncated': False}
+        # Rows written before the checkpoint are read past, they are not validated again
+        numbered_rows = islice(enumerate(rows, start=1), report['processed'], None)
+        executor = self.hashing_executor()
+        try:
+            written = None
+            while True:
+                batch = list(islice(numbered_rows, self.batch_size))
+                accounts, invalid = self.validate_batch(batch)
+                hashes = self.hash_passwords(executor, accounts)
+                if written is not None:
+                    self.finish_batch(*written, report)
+                if not batch:
+                    break
+                written = (batch, accounts, invalid, hashes)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        self.discard_checkpoint()
+        return report
+
+    #  Valid accounts and the errors of the other rows, the errors are only reported once
+    #  the batch is written so a checkpoint never counts a batch that is still pending
+    def validate_batch(self, batch):
+        accounts, invalid = [], []
+        seen = set()
+        for number, row in batch:
+            serializer = ProvisionUserSerializer(data=row)
+            if not serializer.is_valid():
+                invalid.append((number, serializer.errors))
+            elif serializer.validated_data['email'] in seen:
+                invalid.append((number, {'email': ['Duplicate email in the batch.']}))
+            else:
+                seen.add(serializer.validated_data['email'])
+                accounts.append((number, serializer.validated_data))
+        return accounts, invalid
+
+    #  Spawned workers set Django up themselves, so they hash with the configured hashers
+    def hashing_executor(self):
+        if not self.workers:
+            return None
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup)
+
+    #  Hashes of the batch in account order, an iterator that only waits once it is read
+    def hash_passwords(self, executor, accounts):
+        passwords = [data.get('password') for _, data in accounts]
+        if executor is None:
+            return iter([make_password(password) for password in passwords])
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return executor.map(make_password, passwords, chunksize=chunksize)
+
+    def finish_batch(self, batch, accounts, invalid, hashes, report):
+        for number, errors in invalid:
+            self.add_error(report, number, errors)
+        self.create_batch(accounts, list(hashes), report)
+        report['processed'] += len(batch)
+        self.save_checkpoint(report)
+
+    def create_batch(self, accounts, hashes, report):
+        if not accounts:
+            return
+        for attempt in range(UNIQUE_VALUE_SAVE_ATTEMPTS):
+            pending, taken = self.drop_taken(list(zip(accounts, hashes)))
+            if pending:
+                bases = [data['email'].split('@')[0].lower() for (_, data), _ in pending]
+                usernames = allocate_unique_values(User.objects.all(), 'username', bases)
+                try:
+                    with transaction.atomic():
+                        self.write_accounts(pending, usernames)
+                except IntegrityError:
+                    # A concurrent writer took one of the usernames, emails or company names, check the batch again
+                    continue
+            self.add_taken(taken, report)
+            report['created'] += len(pending)
+            return
+        self.add_taken(taken, report)
+        for (number, _), _ in pending:
+            self.add_error(report, number, {'username': ['Could not allocate a unique username.']})
+
+    #  Splits off the accounts whose email or, for vendors, company name is taken. Both are
+    #  looked up for the whole batch at once. Returns the accounts left and the taken rows.
+    def drop_taken(self, pending):
+        emails = [data['email'] for (_, data), _ in pending]
+        existing_emails = set(User.objects.filter(email__in=emails).values_list('email', flat=True))
+        company_names = [data['company_name'] for (_, data), _ in pending if data['role'] == User.Role.VENDOR]
+        taken_names = set(VendorProfile.objects.filter(company_name__in=company_names).values_list('company_name', flat=True))
+        kept, taken = [], []
+        for (number, data), password in pending:
+            if data['email'] in existing_emails:
+                taken.append((number, None))
+            elif data['role'] == User.Role.VENDOR and data['company_name'] in taken_names:
+                taken.append((number, {'company_name': ['A vendor with this company name already exists.']}))
+            else:
+                if data['role'] == User.Role.VENDOR:
+                    taken_names.add(data['company_name'])
+                kept.append(((number, data), password))
+        return kept, taken
+
+    #  Existing accounts are skipped, a rerun after a crash finds the batch it had written
+    def add_taken(self, taken, report):
+        for number, errors in taken:
+            if errors is None:
+                report['skipped'] += 1
+            else:
+                self.add_error(report, number, errors)
+
+    def write_accounts(self, pending, usernames):
+        users = User.objects.bulk_create([
+            User(email=data['email'], username=username, role=data['role'], password=password)
+            for ((_, data), password), username in zip(pending, usernames)
+        ])
+        vendors, customers, addresses = [], [], []
+        for user, ((_, data), _) in zip(users, pending):
+            if data['role'] == User.Role.VENDOR:
+                vendors.append(VendorProfile(user=user, **{field: data[field] for field in ProvisionUserSerializer.VENDOR_FIELDS if field in data}))
+            else:
+                customers.append(CustomerProfile(user=user, **{field: data[field] for field in ProvisionUserSerializer.CUSTOMER_FIELDS if field in data}))
+            address = {field: data[field] for field in ProvisionUserSerializer.ADDRESS_FIELDS if field in data}
+            if address:
+                addresses.append(UserAddress(user=user, **address))
+        VendorProfile.objects.bulk_create(vendors)
+        CustomerProfile.objects.bulk_create(customers)
+        UserAddress.objects.bulk_create(addresses)
+
+    def load_checkpoint(self):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return None
+        with open(self.checkpoint) as checkpoint:
+            return json.load(checkpoint)
+
+    def discard_checkpoint(self):
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+    #  Replaced in one rename, a crash never leaves half a checkpoint behind
+    def save_checkpoint(self, report):
+        if not self.checkpoint:
+            return
+        partial = f'{self.checkpoint}.partial'
+        with open(partial, 'w') as checkpoint:
+            json.dump(report, checkpoint)
+        os.replace(partial, self.checkpoint)
+
+    def add_error(self, report, number, errors):
+        report['failed'] += 1
+        if len(report['errors']) < self.max_errors:
+            report['errors'].append({'row': number, 'errors': errors})
+        else:
+            report['errors_truncated'] = True
@@ -0,0 +1,88 @@
+import re
+from pathlib import PurePath
+from django.db import IntegrityError, transaction
+from django.db.models import BigIntegerField, Case, Q, Value, When
+from django.db.models.functions import Cast, Substr
+
+UNIQUE_VALUE_SAVE_ATTEMPTS = 5
+# Bases per query when a batch allocates its unique values
+UNIQUE_VALUE_LOOKUP_CHUNK = 200
+
+FILE_FORMATS = ('csv', 'ndjson')
+FILE_FORMAT_EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+
+#  Next free value for a unique field such as a slug or username, found in a single query.
+#  Taken values are `base` or `base<separator><n>`, the database orders them by n so zero
+#  padded and longer suffixes compare as numbers. Never returns a number below `minimum`.
+def next_unique_value(queryset, field, base, separator='', minimum=0):
+    # Up to 18 digits, the most a bigint holds for any value
+    pattern = rf'^{re.escape(base)}({re.escape(separator)}[0-9]{{1,18}})?$'
+    number = Case(
+        When(**{field: base}, then=Value(0)),
+        default=Cast(Substr(field, len(base) + len(separator) + 1), BigIntegerField()),
+        output_field=BigIntegerField(),
+    )
+    highest = (
+        queryset.filter(**{f'{field}__regex': pattern})
+        .annotate(suffix_number=number)
+        .order_by('-suffix_number')
+        .values_list('suffix_number', flat=True)
+        .first()
+    )
+    return unique_value(base, separator, max(minimum, 0 if highest is None else highest + 1))
+
+def unique_value(base, separator, number):
+    return f"{base}{separator}{number}" if number else base
+
+#  Allocate a unique value for every base of a batch against one snapshot query,
+#  values are handed out in order so duplicates inside the batch get their own suffix
+def allocate_unique_values(queryset, field, bases, separator=''):
+    if not bases:
+        return []
+    distinct = sorted(set(bases))
+    taken = set()
+    # Large batches are looked up in chunks, one OR per base would outgrow the query parser
+    for start in range(0, len(distinct), UNIQUE_VALUE_LOOKUP_CHUNK):
+        lookup = Q()
+        for base in distinct[start:start + UNIQUE_VALUE_LOOKUP_CHUNK]:
+            lookup |= Q(**{field: base}) | Q(**{f'{field}__startswith': f'{base}{separator}'})
+        taken.update(queryset.filter(lookup).values_list(field, flat=True))
+    counters = {}
+    values = []
+    for base in bases:
+        value, counter = base, counters.get(base, 0)
+        if counter:
+            value = f"{base}{separator}{counter}"
+        while value in taken:
+            counter += 1
+            value = f"{base}{separator}{counter}"
+        counters[base] = counter
+        taken.add(value)
+        values.append(value)
+    return values
+
+#  Save an instance after allocating its unique value, a concurrent writer taking the
+#  same value makes the insert fail and the next free value is allocated again
+def save_with_unique_value(instance, field, base, separator, save, *args, **kwargs):
+    manager = type(instance)._default_manager.db_manager(kwargs.get('using'))
+    minimum = 0
+    for attempt in range(UNIQUE_VALUE_SAVE_ATTEMPTS):
+        others = manager.exclude(pk=instance.pk) if instance.pk else manager.all()
+        value = next_unique_value(others, field, base, separator, minimum)
+        setattr(instance, field, value)
+        try:
+            with transaction.atomic(using=manager.db):
+                return save(*args, **kwargs)
+        except IntegrityError:
+            # Only retry when the allocated value is what collided
+            if attempt == UNIQUE_VALUE_SAVE_ATTEMPTS - 1 or not others.filter(**{field: value}).exists():
+                raise
+            # The next attempt starts past the collided value instead of computing it again
+            minimum = int(value[len(base) + len(separator):] or 0) + 1
+
+#  File format from an explicit choice or the file extension, None when unknown
+def detect_file_format(filename, file_format=None):
+    if file_format:
+        return file_format if file_format in FILE_FORMATS else None
+    return FILE_FORMAT_EXTENSIONS.get(PurePath(filename or '').suffix.lower())
@@ -1,15 +1,24 @@
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.generics import CreateAPIView, UpdateAPIView, RetrieveUpdateAPIView, DestroyAPIView
+from rest_framework.generics import CreateAPIView, UpdateAPIView, RetrieveUpdateAPIView, DestroyAPIView, GenericAPIView
 from rest_framework.viewsets import ModelViewSet
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny, IsAuthenticatedOrReadOnly
+from rest_framework.authentication import SessionAuthentication, BasicAuthentication
+from django.http import StreamingHttpResponse
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from .models import (
     User, 
     CustomerProfile, 
     VendorProfile, 
     UserAddress, 
     ProductCategory,
-    ProductList
+    ProductList,
+    StockReservation,
+    StockReservationItem
     )
 from .serializers import ( 
     CreateUserSerializer,
@@ -19,7 +28,16 @@ from .serializers import (
     VendorProfileSerializer,
     CategorySerializer,
     UserAddressSerializer,
-    ProductListSerializer
+    ProductListSerializer,
+    ProductFileSerializer,
+    ProductRepriceSerializer,
+    RepricePreviewSerializer,
+    ProductFacetsSerializer,
+    ProductExportSerializer,
+    StockReservationSerializer,
+    CartSerializer,
+    CartItemSerializer,
+    CartQuantitySerializer
 )
 from .permissions import (
     IsAdminReadOnlyOrOwnerEdit,
@@ -29,6 +47,19 @@ from .permissions import (
     IsCustomerOrVendorAuthenticated,
     IsProductOwnerOrReadOnly
 )
+from django_filters.rest_framework import DjangoFilterBackend
+from .filters import ProductFilterSet, ProductOrderingFilter, ProductSearchFilter, product_facets
+from .authentication import DatabaseUserAuthentication
+from .cart import CartBusy, CartError, add_item, cart_contents, clear_cart, get_cart, remove_item, set_item_quantity
+from .cache import acategory_cache_version, aget_or_compute_category, cache_is_shared, category_cache_version, get_or_compute_category
+from .mixins import AsyncReadMixin, ConditionalGetMixin, ReplicaReadMixin, ValuesListMixin, aconditional_response, conditional_response
+from .pagination import ProductCursorPagination, CategoryCursorPagination, UserCursorPagination, ReservationCursorPagination
+from .product_export import EXPORT_CONTENT_TYPES, export_filename, export_products
+from .product_import import ProductImporter, read_rows
+from .product_pricing import PriceOutOfRange, reprice_products
+from .replicas import primary_reads
+from .request_metrics import metrics_summary
+from .stock import ReservationNotHeld, commit_reservation, release_reservation
 
 
 class UserCreateView(CreateAPIView):
@@ -40,11 +71,23 @@ class UserListView(ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserProfileSerializer
     permission_classes = [IsAdminUser]
+    pagination_class = UserCursorPagination
     lookup_field = 'pk'
 
+# Views that work on the User row itself authenticate against the database
+DATABASE_USER_AUTHENTICATION = [DatabaseUserAuthentication, SessionAuthentication, BasicAuthentication]
+
+#  Per-view latency, SQL and serializer percentiles of the sampled requests
+class RequestMetricsView(GenericAPIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics_summary(), status=status.HTTP_200_OK)
+
 class UserAccountDeleteView(DestroyAPIView):
     serializer_class = UserProfileSerializer
     permission_classes = [IsAuthenticated]
+    authentication_classes = DATABASE_USER_AUTHENTICATION
 
     def get_object(self):
         return self.request.user
@@ -52,6 +95,7 @@ class UserAccountDeleteView(DestroyAPIView):
 class UserProfileView(RetrieveUpdateAPIView):
     serializer_class = UserProfileSerializer
     permission_classes = [IsAdminReadOnlyOrOwnerEdit]
+    authentication_classes = DATABASE_USER_AUTHENTICATION
 
     def get_object(self):
         return self.request.user
@@ -59,6 +103,7 @@ class UserProfileView(RetrieveUpdateAPIView):
 class ChangeUserPasswordView(UpdateAPIView):
     serializer_class = ChangeUserPasswordSerializer
     permission_classes = [IsAuthenticated]
+    authentication_classes = DATABASE_USER_AUTHENTICATION
     http_method_names = ['put']
 
     def get_object(self):
@@ -80,25 +125,26 @@ class CustomerProfileView(ModelViewSet):
         if getattr(self, 'swagger_fake_view', False):
             return CustomerProfile.objects.none()
         if self.action == 'list':
-            return CustomerProfile.objects.filter(user=self.request.user)
+            return CustomerProfile.objects.filter(user_id=self.request.user.pk)
         return CustomerProfile.objects.all()
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        serializer.save(user_id=self.request.user.pk)
 
-class VendorProfileView(ModelViewSet):
+class VendorProfileView(ConditionalGetMixin, ModelViewSet):
     serializer_class = VendorProfileSerializer
     permission_classes = [IsVendorAndOwnerOrReadOnly]
+    updated_field = 'updated_at'
 
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return VendorProfile.objects.none()
         if self.action == 'list':
-            return VendorProfile.objects.filter(user=self.request.user)
+            return VendorProfile.objects.filter(user_id=self.request.user.pk)
         return VendorProfile.objects.all()
         
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        serializer.save(user_id=self.request.user.pk)
 
 class UserAddressView(ModelViewSet):
     serializer_class = UserAddressSerializer
@@ -107,22 +153,225 @@ class UserAddressView(ModelViewSet):
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return UserAddress.objects.none()
-        return UserAddress.objects.filter(user=self.request.user)
+        return UserAddress.objects.filter(user_id=self.request.user.pk)
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        serializer.save(user_id=self.request.user.pk)
 
-class ProductCategoryView(ModelViewSet):
+class ProductCategoryView(ReplicaReadMixin, AsyncReadMixin, ModelViewSet):
     queryset = ProductCategory.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsVendorOrAdminAllOrReadOnly]
+    pagination_class = CategoryCursorPagination
     lookup_field = 'slug'
 
-class ProductListView(ModelViewSet):
+    # Responses do not depend on the user, so they are cached per URL and per slug.
+    # The cache version changes on every category write, which makes it the ETag source.
+    # Only a shared cache sees the version bumps of every worker, without one responses are
+    # neither cached nor validated. Cache fills read from the primary, a lagging replica
+    # would leave old rows under the new version until CATEGORY_CACHE_TIMEOUT.
+    def list(self, request, *args, **kwargs):
+        if not cache_is_shared():
+            return super().list(request, *args, **kwargs)
+        url = request.build_absolute_uri()
+        def compute():
+            with primary_reads():
+                return super(ProductCategoryView, self).list(request, *args, **kwargs).data
+        def respond():
+            return Response(get_or_compute_category('list', url, compute))
+        return conditional_response(request, (category_cache_version(), url), None, respond)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not cache_is_shared():
+            return super().retrieve(request, *args, **kwargs)
+        slug = kwargs[self.lookup_field]
+        def compute():
+            with primary_reads():
+                return super(ProductCategoryView, self).retrieve(request, *args, **kwargs).data
+        def respond():
+            return Response(get_or_compute_category('detail', slug, compute))
+        return conditional_response(request, (category_cache_version(), request.get_full_path()), None, respond)
+
+    async def alist(self, request, *args, **kwargs):
+        if not cache_is_shared():
+            return await super().alist(request, *args, **kwargs)
+        url = request.build_absolute_uri()
+        async def compute():
+            with primary_reads():
+                return (await super(ProductCategoryView, self).alist(request, *args, **kwargs)).data
+        async def respond():
+            return Response(await aget_or_compute_category('list', url, compute))
+        return await aconditional_response(request, (await acategory_cache_version(), url), None, respond)
+
+class ProductListView(ReplicaReadMixin, ConditionalGetMixin, ValuesListMixin, AsyncReadMixin, ModelViewSet):
     queryset = ProductList.objects.all()
     serializer_class = ProductListSerializer
     permission_classes = [IsProductOwnerOrReadOnly]
+    updated_field = 'product_updated_at'
+    pagination_class = ProductCursorPagination
+    # ProductOrderingFilter comes first, cursor pagination takes its ordering from the first backend that has one
+    filter_backends = [ProductOrderingFilter, ProductSearchFilter, DjangoFilterBackend]
+    filterset_class = ProductFilterSet
     lookup_field = 'slug'
+    action_serializer_classes = {
+        'import_products': ProductFileSerializer,
+        'reprice': ProductRepriceSerializer,
+        'export': ProductExportSerializer,
+    }
+
+    def get_serializer_class(self):
+        return self.action_serializer_classes.get(self.action, super().get_serializer_class())
+
+    # Lists get the compact representation, see ProductListSerializer.list_omit
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'listing': self.action == 'list'}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # Listed with values(), see ValuesListMixin
+            return queryset
+        # category is rendered by slug, load it with the product instead of once per row
+        queryset = queryset.select_related('product_category')
+        if self.action == 'retrieve':
+            # Only the columns of the requested fields
+            return queryset.only(*self.get_serializer().values_columns(), 'product_category__slug')
+        return queryset
 
     def perform_create(self, serializer):
-        serializer.save(product_vendor=self.request.user.vendor_profile)
\ No newline at end of file
+        serializer.save(product_vendor=get_object_or_404(VendorProfile, pk=self.request.user.pk))
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_products(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        rows = read_rows(serializer.validated_data['file'].file, serializer.validated_data['file_format'])
+        report = ProductImporter(get_object_or_404(VendorProfile, pk=request.user.pk)).run(rows)
+        return Response(report, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'])
+    def reprice(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        try:
+            result = reprice_products(
+                ProductList.objects.filter(product_vendor_id=request.user.pk),
+                changes={field: data[field] for field in serializer.CHANGE_FIELDS if field in data},
+                filters={field: data[field] for field in serializer.FILTER_FIELDS if field in data},
+                dry_run=data['dry_run'],
+            )
+        except PriceOutOfRange as e:
+            raise ValidationError({'price_change_percent': [str(e)]})
+        if 'preview' in result:
+            result['preview'] = RepricePreviewSerializer(result['preview'], many=True).data
+        return Response(result, status=status.HTTP_200_OK)
+
+    # Vendors export their own catalog, admins every product, both narrowed by the list filters
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        queryset = self.filter_queryset(ProductList.objects.all())
+        if request.user.role == User.Role.VENDOR:
+            queryset = queryset.filter(product_vendor_id=request.user.pk)
+        elif not (request.user.is_staff or request.user.role == User.Role.ADMINISTRATOR):
+            raise PermissionDenied("Only vendors and admins can export products.")
+        file_format, compress = serializer.validated_data['file_format'], serializer.validated_data['gzip']
+        response = StreamingHttpResponse(
+            export_products(queryset, file_format, compress),
+            content_type='application/gzip' if compress else EXPORT_CONTENT_TYPES[file_format],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{export_filename(file_format, compress)}"'
+        return response
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(ProductFacetsSerializer(product_facets(queryset)).data, status=status.HTTP_200_OK)
+
+#  Stock reservations of the signed in user. Creating one takes the stock right away, it comes
+#  back on release or once the reservation expires, committing it keeps the stock taken.
+class StockReservationView(ModelViewSet):
+    serializer_class = StockReservationSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = ReservationCursorPagination
+    http_method_names = ['get', 'post', 'head', 'options']
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return StockReservation.objects.none()
+        items = StockReservationItem.objects.select_related('product').only('reservation_id', 'quantity', 'product_id', 'product__slug')
+        return StockReservation.objects.filter(user_id=self.request.user.pk).prefetch_related(Prefetch('items', queryset=items))
+
+    def perform_create(self, serializer):
+        reservation = serializer.save()
+        serializer.instance = self.get_queryset().get(pk=reservation.pk)
+
+    @action(detail=True, methods=['post'])
+    def commit(self, request, pk=None):
+        return self.change_reservation(commit_reservation)
+
+    @action(detail=True, methods=['post'])
+    def release(self, request, pk=None):
+        return self.change_reservation(release_reservation)
+
+    def change_reservation(self, change):
+        reservation = self.get_object()
+        try:
+            change(reservation.pk)
+        except ReservationNotHeld as e:
+            return Response({'detail': str(e)}, status=status.HTTP_409_CONFLICT)
+        reservation = self.get_queryset().get(pk=reservation.pk)
+        return Response(self.get_serializer(reservation).data, status=status.HTTP_200_OK)
+
+#  Carts of the signed in user, served from the cache, see app/cart.py
+class CartAPIView(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def handle_exception(self, exc):
+        if isinstance(exc, CartBusy):
+            return Response({'detail': str(exc)}, status=status.HTTP_409_CONFLICT)
+        return super().handle_exception(exc)
+
+class CartView(CartAPIView):
+    serializer_class = CartSerializer
+
+    def get(self, request):
+        return cart_response(get_cart(request.user.pk))
+
+    def delete(self, request):
+        return cart_response(clear_cart(request.user.pk))
+
+class CartItemView(CartAPIView):
+    serializer_class = CartItemSerializer
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        try:
+            state = add_item(request.user.pk, data['product_id'], data['product'], data['quantity'])
+        except CartError as e:
+            raise ValidationError({'product': [str(e)]})
+        return cart_response(state)
+
+class CartItemDetailView(CartAPIView):
+    serializer_class = CartQuantitySerializer
+
+    def patch(self, request, slug):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            return cart_response(set_item_quantity(request.user.pk, slug, serializer.validated_data['quantity']))
+        except CartError as e:
+            raise NotFound(str(e))
+
+    def delete(self, request, slug):
+        try:
+            return cart_response(remove_item(request.user.pk, slug))
+        except CartError as e:
+            raise NotFound(str(e))
+
+def cart_response(state):
+    return Response(CartSerializer(cart_contents(state)).data, status=status.HTTP_200_OK)
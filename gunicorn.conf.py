@@ -0,0 +1,15 @@
+# gunicorn reads this file from the working directory: gunicorn project.wsgi
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', (os.cpu_count() or 1) * 2 + 1))
+# The master imports the app once and the workers fork from it, so a new worker is ready
+# at once and the imported code and data are shared between workers copy-on-write
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True') == 'True'
+
+
+# Runs in the master before the first worker is forked
+def when_ready(server):
+    if server.cfg.preload_app:
+        from app.startup import warm_up
+        warm_up()
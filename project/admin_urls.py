@@ -0,0 +1,6 @@
+from django.contrib import admin
+
+# Included lazily from project/urls.py, web workers import the ModelAdmins once the admin is used
+admin.autodiscover()
+
+urlpatterns = admin.site.get_urls()
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+os.environ.setdefault('DJANGO_WEB_PROCESS', 'True')
+os.environ.setdefault('DJANGO_ASGI_PROCESS', 'True')
 
 application = get_asgi_application()
@@ -2,6 +2,7 @@
 from pathlib import Path
 from dotenv import load_dotenv
 import os
+from importlib.util import find_spec
 
 load_dotenv()
 
@@ -30,28 +31,37 @@ env_hosts = os.getenv('ALLOWED_HOSTS', '').split(',')
 ALLOWED_HOSTS.extend([host for host in env_hosts if host])
 
 
+# Set by project.wsgi and project.asgi. Web workers load the admin on its first request and
+# leave out apps only management commands and collectstatic use, manage.py loads everything
+# so system checks cover every ModelAdmin. See app/startup.py.
+WEB_PROCESS = os.getenv('DJANGO_WEB_PROCESS') == 'True'
+
 # Application definition
 
 INSTALLED_APPS = [
-    'django.contrib.admin',
+    'django.contrib.admin.apps.SimpleAdminConfig' if WEB_PROCESS else 'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'app',
     'rest_framework',
     'rest_framework_simplejwt',
+    'django_filters',
     'corsheaders',
-    'cloudinary',
-    'cloudinary_storage',
-    'drf_yasg',
     'phonenumber_field',
 ]
+if not WEB_PROCESS:
+    # Their template tags, static files and management commands. In web workers the media storage
+    # backend is imported on first use and the API docs templates are found through TEMPLATES.
+    INSTALLED_APPS += ['drf_yasg', 'cloudinary', 'cloudinary_storage']
 
 AUTH_USER_MODEL = 'app.User'
 
 MIDDLEWARE = [
+    'app.request_metrics.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -59,6 +69,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'app.replicas.ReadYourWritesMiddleware',
+    'app.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -68,7 +80,8 @@ ROOT_URLCONF = 'project.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [],
+        # The API docs templates, located without importing drf_yasg in web workers
+        'DIRS': [os.path.join(find_spec('drf_yasg').submodule_search_locations[0], 'templates')] if WEB_PROCESS else [],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -94,16 +107,60 @@ WSGI_APPLICATION = 'project.wsgi.application'
 # }
 
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME' : os.getenv('DB_NAME'),
-        'USER' : os.getenv('DB_USER'),
-        'PASSWORD' : os.getenv('DB_PASSWORD'),
-        'HOST' : os.getenv('DB_HOST'),
-        'PORT' : os.getenv('DB_PORT'),
+# Set by project.asgi. Every ASGI request runs its database work in its own thread context,
+# so persistent connections would pile up, see Django's notes on ASGI deployment.
+ASGI_PROCESS = os.getenv('DJANGO_ASGI_PROCESS') == 'True'
+
+# Connections are kept per worker for DB_CONN_MAX_AGE seconds and checked before reuse,
+# under ASGI they are closed after each request unless DB_CONN_MAX_AGE is set
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 0 if ASGI_PROCESS else 60))
+
+# DB_ENGINE=sqlite is a local stand-in, db.sqlite3 plays the primary and DB_SQLITE_REPLICAS
+# copies of it the replicas, refreshed with `manage.py sync_sqlite_replicas`
+if os.getenv('DB_ENGINE') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
     }
-}
+    for number in range(1, int(os.getenv('DB_SQLITE_REPLICAS', 0)) + 1):
+        DATABASES[f'replica_{number}'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / f'db.replica_{number}.sqlite3',
+            'TEST': {'MIRROR': 'default'},
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME' : os.getenv('DB_NAME'),
+            'USER' : os.getenv('DB_USER'),
+            'PASSWORD' : os.getenv('DB_PASSWORD'),
+            'HOST' : os.getenv('DB_HOST'),
+            'PORT' : os.getenv('DB_PORT'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    # Read replicas, DB_REPLICA_HOSTS=host[:port],... with the primary's credentials
+    for number, replica in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1):
+        host, _, port = replica.strip().partition(':')
+        DATABASES[f'replica_{number}'] = {
+            **DATABASES['default'],
+            'HOST': host,
+            'PORT': port or os.getenv('DB_PORT'),
+            'TEST': {'MIRROR': 'default'},
+        }
+
+# Catalog reads go to the replicas, see app/replicas.py. A user who wrote reads from the
+# primary for DATABASE_REPLICA_PIN_SECONDS, a replica failing its health check is skipped
+# for DATABASE_REPLICA_RETRY_SECONDS. Without a shared cache such as REDIS_URL signed-in
+# users always read from the primary.
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['app.replicas.ReplicaRouter']
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv('DATABASE_REPLICA_PIN_SECONDS', 10))
+DATABASE_REPLICA_RETRY_SECONDS = 30
 
 
 # Password validation
@@ -132,6 +189,16 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Logins check passwords on the bounded password pool
+AUTHENTICATION_BACKENDS = ['app.authentication.PasswordPoolBackend']
+
+# Password pool, hashing and validation jobs beyond PASSWORD_POOL_MAX_PENDING are answered with a 503.
+# Every server process has its own pool and gunicorn already runs about two processes per CPU,
+# see gunicorn.conf.py. A sync worker serves one request at a time, an ASGI worker many.
+PASSWORD_POOL_WORKERS = int(os.getenv('PASSWORD_POOL_WORKERS', 2 if ASGI_PROCESS else 1))
+PASSWORD_POOL_MAX_PENDING = int(os.getenv('PASSWORD_POOL_MAX_PENDING', PASSWORD_POOL_WORKERS * 4))
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -144,6 +211,9 @@ USE_I18N = True
 USE_TZ = True
 
 
+# OpenAPI schema artifacts written by manage.py build_api_schema
+API_SCHEMA_ROOT = os.getenv('API_SCHEMA_ROOT', os.path.join(BASE_DIR, 'api_schema'))
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
@@ -153,8 +223,7 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATIC_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 MEDIA_URL = '/media/'
-
-DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -171,6 +240,106 @@ CLOUDINARY_STORAGE = {
 
 CLOUDINARY_URL = os.getenv('CLOUDINARY_URL')
 
+# Media storage, Cloudinary when it is configured and files under MEDIA_ROOT otherwise.
+# MEDIA_STORAGE=filesystem keeps media local, for example to run the image pipeline offline.
+MEDIA_STORAGE = os.getenv('MEDIA_STORAGE', 'cloudinary' if CLOUDINARY_URL or os.getenv('CLOUD_NAME') else 'filesystem')
+MEDIA_STORAGE_BACKENDS = {
+    'cloudinary': 'cloudinary_storage.storage.MediaCloudinaryStorage',
+    'filesystem': 'django.core.files.storage.FileSystemStorage',
+}
+
+STORAGES = {
+    'default': {
+        'BACKEND': MEDIA_STORAGE_BACKENDS[MEDIA_STORAGE],
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Image pipeline, uploads are staged under IMAGE_STAGING_ROOT and processed by a pool of
+# worker processes, 0 workers processes them in the request once it commits
+IMAGE_STAGING_ROOT = os.getenv('IMAGE_STAGING_ROOT', os.path.join(BASE_DIR, 'media_staging'))
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', 2))
+IMAGE_VARIANT_WIDTHS = (320, 640, 1280)
+IMAGE_THUMBNAIL_SIZE = 160
+IMAGE_MAX_PIXELS = 40_000_000
+IMAGE_WEBP_QUALITY = 80
+IMAGE_JPEG_QUALITY = 85
+
+# Stock reservations, held stock returns to the product once the reservation expires
+STOCK_RESERVATION_TTL = int(os.getenv('STOCK_RESERVATION_TTL', 900))
+STOCK_RESERVATION_MAX_ITEMS = 100
+
+# Carts, served from the cache and written to the database in batches every CART_FLUSH_INTERVAL
+# seconds, 0 writes each change once the request commits. Without a shared cache such as
+# REDIS_URL carts are changed in the database directly.
+CART_CACHE_TIMEOUT = int(os.getenv('CART_CACHE_TIMEOUT', 7 * 24 * 3600))
+CART_FLUSH_INTERVAL = float(os.getenv('CART_FLUSH_INTERVAL', 2))
+CART_FLUSH_BATCH_SIZE = 200
+CART_MAX_ITEMS = 100
+CART_MAX_QUANTITY = 99
+
+# Rest framework, JWT access tokens are turned into users from their claims without a database lookup
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'app.authentication.TokenUserAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+}
+
+SIMPLE_JWT = {
+    'TOKEN_OBTAIN_SERIALIZER': 'app.serializers.UserTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'app.serializers.UserTokenRefreshSerializer',
+    'TOKEN_USER_CLASS': 'app.authentication.ClaimsUser',
+}
+
+# Request metrics, a sampled share of requests reports its SQL and serializer time in a
+# Server-Timing header and a log line. A statement run REQUEST_METRICS_DUPLICATE_THRESHOLD
+# times in one request is logged as a likely N+1 query.
+REQUEST_METRICS_SAMPLE_RATE = float(os.getenv('REQUEST_METRICS_SAMPLE_RATE', 1 if DEBUG else 0.05))
+REQUEST_METRICS_SERVER_TIMING = os.getenv('REQUEST_METRICS_SERVER_TIMING', 'True') == 'True'
+REQUEST_METRICS_DUPLICATE_THRESHOLD = int(os.getenv('REQUEST_METRICS_DUPLICATE_THRESHOLD', 5))
+# Samples kept per view for the percentile summary, and how often a process shares them
+REQUEST_METRICS_WINDOW = 1000
+REQUEST_METRICS_PUBLISH_INTERVAL = 10
+
+# Profiling, off unless configured. Admins get any request profiled with an `X-Profile: 1`
+# header, PROFILE_SAMPLE_RATE profiles a share of all requests and PROFILE_SLOW_REQUEST_MS
+# keeps sampled stacks of requests slower than that. See `manage.py profile_report`.
+PROFILE_ROOT = os.getenv('PROFILE_ROOT', os.path.join(BASE_DIR, 'profiles'))
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_SLOW_REQUEST_MS = int(os.getenv('PROFILE_SLOW_REQUEST_MS', 0))
+# Seconds between stack samples, and how many profile files are kept
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_MAX_FILES = 500
+
+# Pagination, listings pick their pagination class per view
+PAGINATION_PAGE_SIZE = int(os.getenv('PAGINATION_PAGE_SIZE', 20))
+# Upper bound for the ?page_size= query parameter on paginated listings
+PAGINATION_MAX_PAGE_SIZE = int(os.getenv('PAGINATION_MAX_PAGE_SIZE', 100))
+# Admin changelists of tables the Postgres planner expects to hold more rows than this show
+# an estimated count instead of running COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(os.getenv('ADMIN_ESTIMATED_COUNT_THRESHOLD', 10000))
+
+# Cache, local memory unless a Redis server is configured
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+if os.getenv('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+    }
+
+# Category responses are cached and invalidated across workers only with a shared cache,
+# a per process cache cannot see the writes of other workers, see app/cache.py
+CATEGORY_CACHE_TIMEOUT = int(os.getenv('CATEGORY_CACHE_TIMEOUT', 300))
+
 # Swagger
 USE_X_FORWARDED_HOST = True
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')